@@ -0,0 +1,52 @@
+import argparse
+import time
+
+import numpy as np
+
+from pso_optimizer import PSO, EnergyInterpolator
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark per-particle vs batched PSO fitness evaluation")
+    parser.add_argument('--pop_sizes', type=int, nargs='+', default=[60, 600, 6000], help="Swarm sizes to time")
+    parser.add_argument('--target_ratio', type=float, default=0.6,
+                        help="Swarm size / dataset size, as in pso_optimizer.py (default: 0.6)")
+    parser.add_argument('--dim', type=int, default=16, help="Number of PDM columns (default: 16)")
+    parser.add_argument('--max_iter', type=int, default=100, help="Iterations per generation to extrapolate to")
+    parser.add_argument('--repeats', type=int, default=3, help="Timed sweeps per method (default: 3)")
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def time_sweeps(func, X, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(X)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    print(f"{'pop':>6} {'data':>6} {'per-particle':>14} {'batched':>10} {'speedup':>8} "
+          f"{'max |diff|':>11} {'per gen (per-particle / batched)':>34}")
+    for pop_size in args.pop_sizes:
+        num_data = int(round(pop_size / args.target_ratio))
+        pdm_data = rng.integers(0, 200, (num_data, args.dim)).astype(float)
+        energy_data = rng.normal(-5.0, 0.1, num_data)
+        interpolator = EnergyInterpolator(pdm_data, energy_data)
+        pso = PSO(args.dim, pdm_data.min(axis=0) * 0.8, pdm_data.max(axis=0) * 1.2,
+                  interpolator, pop_size=pop_size, max_iter=args.max_iter)
+
+        t_loop, f_loop = time_sweeps(lambda X: np.array([pso.objective_function(x) for x in X]),
+                                     pso.X, args.repeats)
+        t_batch, f_batch = time_sweeps(pso.evaluate, pso.X, args.repeats)
+        diff = np.max(np.abs(f_loop - f_batch))
+        print(f"{pop_size:>6} {num_data:>6} {t_loop:>13.4f}s {t_batch:>9.4f}s {t_loop / t_batch:>7.1f}x "
+              f"{diff:>11.2e} {t_loop * args.max_iter:>16.1f}s / {t_batch * args.max_iter:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -35,6 +35,26 @@ dataset_path = expand_path(config["dataset_path"])
 cutoff = config["cutoff"]
 n_jobs = config["n_jobs"]
 mode = config["mode"]
+pdm_cache = config.get("pdm_cache")
+cache_arg = f" --cache {expand_path(pdm_cache)}" if pdm_cache else ""
+seed = config.get("seed")
+seed_arg = f" --seed {seed}" if seed is not None else ""
+# 'archive' keeps all structures in one structure archive instead of a POSCAR folder
+structure_format = config.get("structure_format", "poscar")
+archive_path = f"{dataset_path}/structures.sarc"
+if structure_format == "archive":
+    generator_out = f"--archive {archive_path}"
+    pdm_input = f"--archive {archive_path}"
+    cif_args = f"--archive {archive_path}"
+    cif_source = f"--cif_table {dataset_path}/cif.csv"
+else:
+    generator_out = f"--outdir {dataset_path}"
+    pdm_input = f"--input_dir {dataset_path}/poscar/"
+    if generation_type == "single":
+        # shuffles of one template share their sites
+        pdm_input += " --fixed_lattice"
+    cif_args = ""
+    cif_source = f"--cif_dir {dataset_path}/cif"
 train_ratio = config["train_ratio"]
 test_ratio = config["test_ratio"]
 val_ratio = config["val_ratio"]
@@ -44,20 +64,20 @@ commands = []
 if generation_type == "single":
     commands.append(
         f"python {apollox_path}/generate_structure/bulk/generate_single_component.py "
-        f"--input {apollox_path}/original_structures/{initial} --num {num} --outdir {dataset_path}"
+        f"--input {apollox_path}/original_structures/{initial} --num {num} {generator_out}{seed_arg}"
     )
 elif generation_type == "variable":
     commands.append(
         f"python {apollox_path}/generate_structure/bulk/generate_variable_component.py "
-        f"--input {apollox_path}/original_structures/{initial} --num {num} --outdir {dataset_path}"
+        f"--input {apollox_path}/original_structures/{initial} --num {num} {generator_out}"
     )
 
 commands += [
     f"python {apollox_path}/prepare_dataset/compute_pdm.py "
-    f"--input_dir {dataset_path}/poscar/ --cutoff {cutoff} --n_jobs {n_jobs} --mode {mode} "
-    f"--starts_with POSCAR --output_csv {dataset_path}/all_structures_summary.csv",
+    f"{pdm_input} --cutoff {cutoff} --n_jobs {n_jobs} --mode {mode} "
+    f"--starts_with POSCAR --output_csv {dataset_path}/all_structures_summary.csv{cache_arg}",
 
-    f"python {apollox_path}/prepare_dataset/transfer_POSCAR_to_cif.py {dataset_path} --n {n_jobs}",
+    f"python {apollox_path}/prepare_dataset/transfer_POSCAR_to_cif.py {dataset_path} --n {n_jobs} {cif_args}",
 
     f"python {apollox_path}/prepare_dataset/split_dataset.py --input {dataset_path}/all_structures_summary.csv "
     f"--output_dir {dataset_path} --train_ratio {train_ratio} "
@@ -65,7 +85,7 @@ commands += [
 
     f"python {apollox_path}/prepare_dataset/append_cif.py --input_csvs {dataset_path}/train_set_scaled.csv "
     f"{dataset_path}/test_set_scaled.csv {dataset_path}/val_set_scaled.csv "
-    f"--output_names train test val --cif_dir {dataset_path}/cif --output_dir {dataset_path}",
+    f"--output_names train test val {cif_source} --output_dir {dataset_path}",
 
     f"python {apollox_path}/prepare_dataset/convert_CVS.py --input_dir {dataset_path}"
 ]
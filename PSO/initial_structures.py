@@ -2,12 +2,17 @@ import os
 import shutil
 import subprocess
 import yaml
-import concurrent.futures
 import time
-import psutil
+import sys
 import pandas as pd
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "prepare_dataset"))
+from compute_pdm import DEFAULT_CACHE_MB, PDMPool, find_poscar_files
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "opt"))
+from chgnet_pool import CHGNetPool
+from prescreen import Screen, summarize
+
 # === Locate ApolloX root directory ===
 def find_apollox_root(current_path):
     while current_path != current_path.parent:
@@ -15,72 +20,6 @@ def find_apollox_root(current_path):
             return current_path / "ApolloX"
         current_path = current_path.parent
     raise RuntimeError("ApolloX directory not found in any parent directory.")
-def has_enough_memory(threshold_gb):
-    mem = psutil.virtual_memory()
-    return mem.available / 1e9 >= threshold_gb
-
-def run_chgnet_for_structure(structure_file: Path, chgnet_script: Path, chgnet_cfg: dict, work_root: Path):
-    structure_name = structure_file.name
-    subfolder_name = structure_file.stem+"_dir"
-    subfolder = work_root / subfolder_name
-
-    subfolder.mkdir(exist_ok=True)
-
-    target_structure_file = subfolder / structure_name
-    if not target_structure_file.exists():
-        shutil.copy(structure_file, target_structure_file)
-
-    cmd_chgnet = [
-        "python", str(chgnet_script),
-        "--input_pattern", structure_name,
-        "--mlp_optstep", str(chgnet_cfg.get("mlp_optstep", 1)),
-        "--fmax", str(chgnet_cfg.get("fmax", 0.01)),
-        "--output_csv", "sorted_energies.csv"
-    ]
-    print(f"[CHGNet] Running optimization for {structure_name} in {subfolder} ...")
-    subprocess.run(cmd_chgnet, cwd=subfolder, check=True)
-    return subfolder / "sorted_energies.csv"
-
-def run_parallel_chgnet(output_dir: Path, chgnet_script: Path, chgnet_cfg: dict, max_workers=2, min_free_mem_gb=4.0):
-    structure_files = [
-        f for f in output_dir.glob("POSCAR*")
-        if f.is_file()
-    ]
-    print(f"[CHGNet] Found {len(structure_files)} structure files to optimize.")
-
-    results = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = []
-        for sf in structure_files:
-            while not has_enough_memory(min_free_mem_gb):
-                print("[MEMORY] Not enough memory, waiting 10 seconds...")
-                time.sleep(10)
-            future = executor.submit(run_chgnet_for_structure, sf, chgnet_script, chgnet_cfg, output_dir)
-            futures.append(future)
-
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                result_path = future.result()
-                results.append(result_path)
-            except subprocess.CalledProcessError as e:
-                print(f"[ERROR] ChgNet failed: {e}")
-
-    return results
-
-def merge_all_sorted_energies(sorted_files, merged_output_path):
-    dfs = []
-    for f in sorted_files:
-        if f.exists():
-            df = pd.read_csv(f)
-            dfs.append(df)
-        else:
-            print(f"[WARN] Sorted energy file not found: {f}")
-    if dfs:
-        combined = pd.concat(dfs, ignore_index=True)
-        combined.to_csv(merged_output_path, index=False)
-        print(f"[MERGE] Combined sorted energies saved to {merged_output_path}")
-    else:
-        print("[MERGE] No sorted energies files to combine.")
 # === Setup paths ===
 script_path = Path(__file__).resolve()
 apollox_root = find_apollox_root(script_path.parent)
@@ -108,7 +47,6 @@ num_files = gen_num * structure_num_per_gen
 
 original_structure_dir = apollox_root / "original_structures"
 opt_script = config["opt_script"]
-pdm_script = apollox_root / "prepare_dataset" / "compute_pdm.py"
 merge_script = pso_dir / "merge.py"
 output_dir = pso_dir / "poscar"
 if output_dir.exists():
@@ -130,49 +68,43 @@ subprocess.run([
 
 # === Step 2: Run ChgNet optimization ===
 shutil.copy(merge_script, output_dir)
-sorted_energy_files = run_parallel_chgnet(
-    output_dir,
-    apollox_root / "opt" / opt_script,
-    chgnet_cfg,
-    max_workers=chgnet_cfg.get("max_workers", 2),
-    min_free_mem_gb=chgnet_cfg.get("min_free_mem_gb", 4.0)
-)
-
-merged_sorted_energies = output_dir / "sorted_energies.csv"
-merge_all_sorted_energies(sorted_energy_files, merged_sorted_energies)
-for subfolder in output_dir.glob("*_dir"):
-    if subfolder.is_dir():
-        for file in subfolder.glob("*.optdone"):
-            target = output_dir / file.name
-            print(f"[CLEANUP] Moving {file.name} to {output_dir}")
-            shutil.move(str(file), str(target))
-        try:
-            shutil.rmtree(subfolder)
-            print(f"[CLEANUP] Removed directory {subfolder}")
-        except Exception as e:
-            print(f"[ERROR] Failed to remove directory {subfolder}: {e}")
+structure_files = sorted(f for f in output_dir.glob("POSCAR*") if f.is_file())
+print(f"[CHGNet] Found {len(structure_files)} structure files to optimize.")
+screen = Screen.from_config(chgnet_cfg.get("screen"), original_structure_dir / poscar_name)
+structure_files, screen_report = screen.files(structure_files)
+screen_report.to_csv(output_dir / "screen_report.csv", index=False)
+print(summarize(screen_report))
+t0 = time.perf_counter()
+with CHGNetPool.from_config(chgnet_cfg, opt_script) as chgnet_pool:
+    energies = chgnet_pool.relax(
+        structure_files,
+        output_dir,
+        fmax=chgnet_cfg.get("fmax", 0.01),
+        steps=chgnet_cfg.get("mlp_optstep", 1),
+        min_free_mem_gb=chgnet_cfg.get("min_free_mem_gb", 4.0),
+        save_traj=chgnet_cfg.get("save_traj", False),
+        traj_interval=chgnet_cfg.get("traj_interval", 1),
+        results_path=output_dir / "relaxed.npz",
+    )
+print(f"[TIMING] CHGNet: {time.perf_counter() - t0:.1f}s for {len(energies)} structures")
+
+if energies:
+    pd.DataFrame(energies).sort_values(by="energy").to_csv(
+        output_dir / "sorted_energies.csv", columns=["name", "energy"], index=False)
+    print(f"[MERGE] Sorted energies saved to {output_dir / 'sorted_energies.csv'}")
+else:
+    print("[MERGE] No structures were optimized.")
 # === Step 3: Compute PDM ===
-# Build the command for compute_pdm.py
-cmd_pdm = [
-    "python", str(pdm_script),
-    "--input_dir", str(output_dir),
-    "--cutoff", str(pdm_cfg["cutoff"]),
-    "--n_jobs", str(pdm_cfg["n_jobs"]),
-    "--mode"  # Add the flag first
-]
-# Split the mode string from the config and add each part as a separate argument
-modes = pdm_cfg["mode"].split()
-cmd_pdm.extend(modes)
-
-# Add the rest of the arguments
-cmd_pdm.extend([
-    "--starts_with", "POSCAR",
-    "--ends_with", "optdone",
-    "--output_csv", str(output_dir / pdm_cfg["output_csv"])
-])
-
-# Run the command
-subprocess.run(cmd_pdm, cwd=pso_dir, check=True)
+t0 = time.perf_counter()
+poscar_files = find_poscar_files(output_dir, pdm_cfg.get("starts_with", "POSCAR"),
+                                 pdm_cfg.get("ends_with", "optdone"))
+print(f"[PDM] Computing descriptors for {len(poscar_files)} structures...")
+with PDMPool(pdm_cfg["n_jobs"]) as pdm_pool:
+    pdm_df = pdm_pool.compute(poscar_files, pdm_cfg["cutoff"], str(pdm_cfg["mode"]).split(),
+                              cache_path=pdm_cfg.get("cache"),
+                              cache_max_mb=pdm_cfg.get("cache_max_mb", DEFAULT_CACHE_MB))
+pdm_df.to_csv(output_dir / pdm_cfg["output_csv"], index=False)
+print(f"[TIMING] Initial PDM: {time.perf_counter() - t0:.1f}s for {len(poscar_files)} structures")
 
 # === Step 4: Merge energy and structure info ===
 subprocess.run(["python", str(merge_script)], cwd=output_dir, check=True)
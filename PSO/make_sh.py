@@ -24,8 +24,10 @@ def get_composition_from_poscar(g):
     raise FileNotFoundError(f"No valid POSCAR file found in {poscar_dir}")
 
 def parse_args():
-    parser = argparse.ArgumentParser(description="Generate a .sh file for each line of data.")
+    parser = argparse.ArgumentParser(description="Generate the generation script for all optimized particles.")
     parser.add_argument('--g', type=int, required=True, help="The input parameter g, used to read the data file.")
+    parser.add_argument('--batch_size', type=int, default=64,
+                        help="Number of particles generated together in one mini-batch.")
     return parser.parse_args()
 
 if __name__ == "__main__":
@@ -39,26 +41,26 @@ if __name__ == "__main__":
     output_dir = os.path.join("temp", f"sh_files_{g}")
     os.makedirs(output_dir, exist_ok=True)
 
-    for idx, row in data.iterrows():
-        material_id = row['material_id']
-        element_values = row.iloc[2:-1]
-        element_values_str = ",".join(map(str, element_values))
+    # One row per particle; evaluate.py --tasks batch generates all of them
+    # with a single model load and writes eval_gen_<label>.pt for each.
+    targets = pd.DataFrame({
+        'label': data['material_id'],
+        'formula': formula,
+        'pressure': 0,
+        'element_values': [",".join(map(str, row.iloc[2:-1])) for _, row in data.iterrows()],
+    })
+    target_path = os.path.abspath(os.path.join(output_dir, f'gen_targets_{g}.csv'))
+    targets.to_csv(target_path, index=False)
 
+    sh_content = "#!/bin/bash\nCUDA_VISIBLE_DEVICES=0\n"
+    sh_content += f"python {apollox_path}/cond-cdvae/scripts/evaluate.py --model_path `pwd` --tasks batch \\\n"
+    sh_content += f"    --target_file={target_path} \\\n"
+    sh_content += f"    --batch_size={args.batch_size} \\\n"
+    sh_content += "    --num_batches_to_samples=1"
 
-        sh_content = "#!/bin/bash\nCUDA_VISIBLE_DEVICES=0\n"
-        sh_content += f"python {apollox_path}/cond-cdvae/scripts/evaluate.py --model_path `pwd` --tasks gen \\\n"
-        sh_content += f"    --formula={formula} \\\n"
-        sh_content += f"    --pressure=0 \\\n"
-        sh_content += f"    --label=\"{material_id}\" \\\n"
-        sh_content += f"    --element_values=\"{element_values_str}\" \\\n"
-        sh_content += "    --batch_size=1 \\\n"
-        sh_content += "    --num_batches_to_samples=1"
-
-        sh_path = os.path.join(output_dir, f'run_evaluation_{idx}.sh')
-        with open(sh_path, 'w') as f:
-            f.write(sh_content)
-
-        print(f"Shell script saved to {sh_path}")
-
-    print(f"All shell scripts saved to {output_dir}")
+    sh_path = os.path.join(output_dir, 'run_evaluation_batch.sh')
+    with open(sh_path, 'w') as f:
+        f.write(sh_content)
 
+    print(f"{len(targets)} targets saved to {target_path}")
+    print(f"Shell script saved to {sh_path}")
@@ -11,6 +11,7 @@ def parse_args():
     parser.add_argument('--min_bound_scale', type=float, default=0.8, help="Scaling factor for minimum bounds (default: 0.8)")
     parser.add_argument('--max_bound_scale', type=float, default=1.2, help="Scaling factor for maximum bounds (default: 1.2)")
     parser.add_argument('--max_iter', type=int, default=100, help="Maximum number of iterations (default: 100)")
+    parser.add_argument('--chunk_size', type=int, default=None, help="Particles per RBF evaluation (default: whole swarm)")
     return parser.parse_args()
 
 class EnergyInterpolator:
@@ -21,12 +22,17 @@ class EnergyInterpolator:
         """
         self.interpolator = RBFInterpolator(pdm_data, energy_data, kernel='linear')
 
-    def predict(self, x):
+    def predict(self, x, chunk_size=None):
         """
         x: Particle positions (2D array)
+        chunk_size: Evaluate at most this many particles per RBF call (default: all at once)
         Returns: Estimated energy values
         """
-        return self.interpolator(x)
+        x = np.asarray(x, dtype=float)
+        if chunk_size is None or len(x) <= chunk_size:
+            return self.interpolator(x)
+        return np.concatenate([self.interpolator(x[i:i + chunk_size])
+                               for i in range(0, len(x), chunk_size)])
 def get_composition_from_poscar(g):
     poscar_dir = f'./poscars/generation{g}/'
     for file in os.listdir(poscar_dir):
@@ -53,7 +59,8 @@ class PSO:
                  max_iter=100,
                  w=0.8,
                  c1=2.0,
-                 c2=2.0):
+                 c2=2.0,
+                 chunk_size=None):
 
         self.dim = dim
         self.x_min = x_min
@@ -64,19 +71,23 @@ class PSO:
         self.w = w
         self.c1 = c1
         self.c2 = c2
+        self.chunk_size = chunk_size
         self.X = np.random.uniform(self.x_min, self.x_max, (self.pop_size, self.dim))
         self.V = np.random.uniform(-abs(self.x_max - self.x_min), abs(self.x_max - self.x_min),
                                    (self.pop_size, self.dim))
         self.pbest = self.X.copy()
-        self.pbest_fitness = np.array([self.objective_function(x) for x in self.X])
+        self.pbest_fitness = self.evaluate(self.X)
         gbest_index = np.argmin(self.pbest_fitness)
         self.gbest = self.X[gbest_index].copy()
         self.gbest_fitness = self.pbest_fitness[gbest_index]
     def objective_function(self,x):
         return self.interpolator.predict(x.reshape(1,-1))[0]
+    def evaluate(self, X):
+        # The whole swarm in one RBF call instead of one call per particle.
+        return self.interpolator.predict(X, self.chunk_size)
     def optimize(self):
         for t in range(self.max_iter):
-            fitness = np.array([self.objective_function(x) for x in self.X])
+            fitness = self.evaluate(self.X)
             better_mask = fitness < self.pbest_fitness
             self.pbest[better_mask] = self.X[better_mask]
             self.pbest_fitness[better_mask] = fitness[better_mask]
@@ -122,7 +133,8 @@ if __name__ == "__main__":
     x_max = max_bounds.values
     interpolator = EnergyInterpolator(pdm_data.values, energy_data.values)
     # Create a PSO optimizer instance
-    pso = PSO(dim=dim, x_min=x_min, x_max=x_max, interpolator=interpolator,pop_size=target_size, max_iter=max_iter)
+    pso = PSO(dim=dim, x_min=x_min, x_max=x_max, interpolator=interpolator,pop_size=target_size, max_iter=max_iter,
+              chunk_size=args.chunk_size)
 
     # Run optimization
     final_positions = pso.optimize()
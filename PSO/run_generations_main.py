@@ -1,7 +1,10 @@
 import subprocess
+import time
 import yaml
 from pathlib import Path
 
+from submit_opt import CHGNetPool, PDMPool, load_config, run_chgnet_and_pdm
+
 def find_apollox_root(start_path="."):
     current = Path(start_path).resolve()
     for parent in [current] + list(current.parents):
@@ -23,15 +26,22 @@ def main():
     print(f"[INFO] Running initial_structures.py")
     subprocess.run(["python", str(apollox_root /"PSO"/"initial_structures.py")], check=True)
 
-    # Step 2: Loop over generations and run submit_one_gen.py and submit_opt.py
-    for g in range(1, gen_num + 1):
-        print(f"[INFO] Running generation {g}...")
-
-        # Run submit_one_gen.py --g g
-        subprocess.run(["python", str(apollox_root /"PSO"/"submit_one_gen.py"), "--g", str(g)], check=True)
-
-        # Run submit_opt.py --g g
-        subprocess.run(["python", str(apollox_root /"PSO"/"submit_opt.py"), "--g", str(g)], check=True)
+    # Step 2: Loop over generations and run submit_one_gen.py and submit_opt.py.
+    # The PDM and CHGNet workers are kept alive across generations instead of
+    # being started again for every structure folder.
+    chgnet_cfg, pdm_cfg, _ = load_config(apollox_root)
+    with PDMPool(pdm_cfg["n_jobs"]) as pdm_pool, \
+            CHGNetPool.from_config(chgnet_cfg) as chgnet_pool:
+        for g in range(1, gen_num + 1):
+            print(f"[INFO] Running generation {g}...")
+            t0 = time.perf_counter()
+
+            # Run submit_one_gen.py --g g
+            subprocess.run(["python", str(apollox_root /"PSO"/"submit_one_gen.py"), "--g", str(g)], check=True)
+
+            # Same as submit_opt.py --g g, in-process to reuse the workers
+            run_chgnet_and_pdm(g, pdm_pool=pdm_pool, chgnet_pool=chgnet_pool)
+            print(f"[TIMING] Generation {g} wall time: {time.perf_counter() - t0:.1f}s")
     print(f"\n {gen_num} generation structures have been generated.")
     print("PDMs and energies are saved in `pdm_and_energy`.")
     print("Structures are saved in `poscars`.")
@@ -2,8 +2,10 @@ import os
 import subprocess
 import argparse
 import yaml
+import pandas as pd
 from pathlib import Path
 import shutil
+import sys
 def run_cmd(command, cwd=None):
     print(f"\nRunning: {command}")
     result = subprocess.run(command, shell=True, cwd=cwd)
@@ -26,10 +28,6 @@ def get_composition_tag(g):
     raise FileNotFoundError(f"No POSCAR-XXXX file found in {gen_dir}")
 
 
-def find_latest_pt():
-    pt_files = sorted(Path(".").glob("*.pt"), key=lambda p: p.stat().st_mtime, reverse=True)
-    return pt_files[0] if pt_files else None
-
 def load_config():
     config_path = Path(__file__).parent / "config.yaml"
     with open(config_path, "r") as f:
@@ -66,7 +64,7 @@ def main():
     )
 
     run_cmd(f"python {apollox_root}/PSO/make_sh.py "
-           f"--g {g}")
+           f"--g {g} --batch_size {config.get('gen_batch_size', 64)}")
 
     # === 执行 .sh 脚本 ===
     sh_dir = Path("temp") / f"sh_files_{g}"
@@ -74,48 +72,78 @@ def main():
     
     pt_output_dir = Path("temp") / f"pt_files_{g}"
     pt_output_dir.mkdir(parents=True, exist_ok=True)
-    
-    for sh_file in sorted(sh_dir.glob("run_evaluation_*.sh")):
-        print(f"Executing {sh_file}...")
-        os.chmod(sh_file, 0o755)
-        run_cmd(str(sh_file))
-    
-        pt_file = find_latest_pt()
-        if pt_file:
-            print(f"Processing .pt file: {pt_file}")
-            run_cmd(f"python {extract_script} {pt_file}")
-    
-            result_folder = pt_file.stem
-            gen_path = Path(result_folder) / "gen"
-            if gen_path.exists():
-                print(f"Entering gen folder in {result_folder}...")
-                # run_cmd("python ../../bulk.py", cwd=gen_path)
-            else:
-                print(f"Error: gen folder not found in {result_folder}")
-    
-            
-            dest_pt = pt_output_dir / pt_file.name
-            dest_result = pt_output_dir / result_folder
-    
-            shutil.move(str(pt_file), dest_pt)
-
-            dest_result_path = Path(dest_result)
-            if dest_result_path.exists():
-                print(f"[Info] Target folder {dest_result_path} exists, removing before move.")
-                if dest_result_path.is_dir():
-                    shutil.rmtree(dest_result_path)
-                else:
-                    dest_result_path.unlink()
-            
-            if Path(result_folder).exists():
-                shutil.move(result_folder, dest_result)
-                print(f"Moved {pt_file} and folder {result_folder} to {pt_output_dir}")
-            else:
-                print(f"[Warning] Result folder {result_folder} does not exist, skipped moving.")
-        else:
-            print("Error: no .pt file found.")
-    
+
+    server = config.get("generation_server")
+    if server:
+        generate_with_server(server, apollox_root, sh_dir / f"gen_targets_{g}.csv", pt_output_dir)
         print("\nAll tasks completed.")
+        return
+
+    # One evaluate.py call generates every particle of the generation.
+    sh_file = sh_dir / "run_evaluation_batch.sh"
+    print(f"Executing {sh_file}...")
+    os.chmod(sh_file, 0o755)
+    run_cmd(str(sh_file))
+
+    labels = pd.read_csv(sh_dir / f"gen_targets_{g}.csv")["label"].astype(str)
+    pt_files = []
+    for label in labels:
+        pt_file = Path(f"eval_gen_{label}.pt")
+        if pt_file.exists():
+            pt_files.append(pt_file)
+        else:
+            print(f"Error: {pt_file} not found.")
+
+    if pt_files:
+        print(f"Processing {len(pt_files)} .pt files")
+        run_cmd(f"python {extract_script} -j {config.get('extract_jobs', 4)} "
+                + " ".join(str(f) for f in pt_files))
+    for pt_file in pt_files:
+        move_pt_results(pt_file, pt_output_dir)
+
+    print("\nAll tasks completed.")
+
+def generate_with_server(address, apollox_root, target_csv, pt_output_dir):
+    """Request the particles from a running gen_server.py instead of loading the model"""
+    sys.path.insert(0, str(apollox_root / "cond-cdvae" / "scripts"))
+    from gen_client import generate_to_files
+
+    requests = pd.read_csv(target_csv).to_dict("records")
+    written, failed = generate_to_files(
+        address, requests,
+        lambda label, i: pt_output_dir / f"eval_gen_{label}" / "gen" / f"{i}.vasp",
+    )
+    print(f"Received {written} structures from {address}")
+    if failed:
+        print(f"Error: generation failed for {len(failed)} particles: {failed}")
+
+def move_pt_results(pt_file, pt_output_dir):
+    result_folder = pt_file.stem
+    gen_path = Path(result_folder) / "gen"
+    if gen_path.exists():
+        print(f"Entering gen folder in {result_folder}...")
+        # run_cmd("python ../../bulk.py", cwd=gen_path)
+    else:
+        print(f"Error: gen folder not found in {result_folder}")
+
+    dest_pt = pt_output_dir / pt_file.name
+    dest_result = pt_output_dir / result_folder
+
+    shutil.move(str(pt_file), dest_pt)
+
+    dest_result_path = Path(dest_result)
+    if dest_result_path.exists():
+        print(f"[Info] Target folder {dest_result_path} exists, removing before move.")
+        if dest_result_path.is_dir():
+            shutil.rmtree(dest_result_path)
+        else:
+            dest_result_path.unlink()
+
+    if Path(result_folder).exists():
+        shutil.move(result_folder, dest_result)
+        print(f"Moved {pt_file} and folder {result_folder} to {pt_output_dir}")
+    else:
+        print(f"[Warning] Result folder {result_folder} does not exist, skipped moving.")
 
 if __name__ == "__main__":
     main()
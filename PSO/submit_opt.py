@@ -1,14 +1,19 @@
 import argparse
-import subprocess
 from pathlib import Path
 import sys
 import yaml
 import pandas as pd
 import os
 import shutil
-import concurrent.futures
 import time
-import psutil 
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "prepare_dataset"))
+from compute_pdm import DEFAULT_CACHE_MB, PDMPool, find_poscar_files
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "opt"))
+from chgnet_pool import CHGNetPool, default_device
+from prescreen import Screen, summarize
+
+
 def find_apollox_root():
     current = Path(__file__).resolve()
     for parent in [current]+list(current.parents):
@@ -25,6 +30,10 @@ def load_config(apollox_root):
         config = yaml.safe_load(f)
     try:
         chgnet_cfg = config["opt"]
+        chgnet_cfg.setdefault("device", default_device(config.get("opt_script")))
+        chgnet_cfg["screen"] = chgnet_cfg.get("screen") or {}
+        chgnet_cfg["screen"].setdefault("reference",
+                                        str(apollox_root / "original_structures" / config["poscar_name"]))
         pdm_cfg=config["pdm"]
         structure_num_per_gen = config["structure_num_per_gen"]
         return chgnet_cfg,pdm_cfg,structure_num_per_gen
@@ -67,46 +76,55 @@ def copy_selected_poscars(apollox_root, base_dir, g, combined_csv_path):
                 shutil.move(file_path, dest_dir / file_path.name)
                 print(f"[MOVE] Copied {file_path} to {dest_dir}")
 
-def run_task(gen_dir: Path, structure_name: str, chgnet_script: Path, chgnet_cfg: dict,
-             pdm_script: Path, pdm_cfg: dict, apollox_root: Path):
-    # 1. chgnet_gpu.py
-    cmd_chgnet = [
-        "python", str(chgnet_script),
-        "--input_pattern", structure_name,
-        "--mlp_optstep", str(chgnet_cfg.get("mlp_optstep", 1)),
-        "--fmax", str(chgnet_cfg.get("fmax", 0.01)),
-        "--output_csv", "sorted_energies.csv"
-    ]
-    print(f"[CHGNet] Running in {gen_dir} with input {structure_name}...")
-    subprocess.run(cmd_chgnet, cwd=gen_dir, check=True)
-
-    # 2. compute_pdm.py
-    cmd_pdm = [
-        "python", str(pdm_script),
-        "--input_dir", ".",
-        "--cutoff", str(pdm_cfg["cutoff"]),
-        "--n_jobs", str(pdm_cfg["n_jobs"]),
-        "--mode", pdm_cfg["mode"],
-        "--starts_with",str("POSCAR"),
-        "--ends_with",str("optdone"),
-        "--output_csv", str(pdm_cfg["output_csv"])
-    ]
-    print(f"[PDM] Running compute_pdm.py for {structure_name}...")
-    subprocess.run(cmd_pdm, cwd=gen_dir, check=True)
-    sorted_csv_path = gen_dir / "sorted_energies.csv"
-    # 3. merge1.py 
-    if sorted_csv_path.exists():
-        merge_script = apollox_root / "PSO" / "merge.py"
-        cmd_merge = ["python", str(merge_script)]
-        print(f"[MERGE] Running merge.py in {gen_dir}...")
-        subprocess.run(cmd_merge, cwd=gen_dir, check=True)
-    else:
-        print(f"[MERGE] Skipping merge.py since {sorted_csv_path} not found.")
-
-
-def run_chgnet_parallel(base_dir: Path, chgnet_script: Path, chgnet_cfg: dict,
-                        pdm_script: Path, pdm_cfg: dict, apollox_root: Path,
-                        max_workers: int = 2, min_free_mem_gb: float = 4.0):
+def run_pdm_batch(gen_dirs, pdm_cfg: dict, pdm_pool: PDMPool):
+    # 2. PDM for every optimized structure of the generation in one call
+    starts_with = pdm_cfg.get("starts_with", "POSCAR")
+    ends_with = pdm_cfg.get("ends_with", "optdone")
+    files_per_dir = [find_poscar_files(gen_dir, starts_with, ends_with) for gen_dir in gen_dirs]
+    all_files = [f for files in files_per_dir for f in files]
+    print(f"[PDM] Computing descriptors for {len(all_files)} structures in {len(gen_dirs)} folders...")
+    df = pdm_pool.compute(all_files, pdm_cfg["cutoff"], str(pdm_cfg["mode"]).split(),
+                          cache_path=pdm_cfg.get("cache"),
+                          cache_max_mb=pdm_cfg.get("cache_max_mb", DEFAULT_CACHE_MB))
+
+    start = 0
+    for gen_dir, files in zip(gen_dirs, files_per_dir):
+        part = df.iloc[start:start + len(files)]
+        start += len(files)
+        # Keep only the clusters present in this folder, as a per-folder run would.
+        keep = [c for c in part.columns[2:] if (part[c] != 0).any()]
+        part[["material_id", "cif_file"] + keep].to_csv(gen_dir / pdm_cfg["output_csv"], index=False)
+    return len(all_files)
+
+
+def run_merge(gen_dir: Path, pdm_cfg: dict, energies: pd.DataFrame):
+    # 3. same as merge.py, with the energies of this folder from memory
+    summary_csv = gen_dir / pdm_cfg["output_csv"]
+    if not summary_csv.exists():
+        print(f"[MERGE] Skipping {gen_dir} since {summary_csv} not found.")
+        return
+    all_structures_df = pd.read_csv(summary_csv)
+    energies = energies.assign(name_with_extension=energies["name"] + ".optdone")
+    merged_df = pd.merge(all_structures_df, energies[["name_with_extension", "energy"]],
+                         left_on="material_id", right_on="name_with_extension", how="left")
+    merged_df = merged_df.rename(columns={"energy": "Energy"}).drop(columns=["name_with_extension"])
+    merged_df.to_csv(gen_dir / "Merged_all_structures_with_energy.csv", index=False)
+
+
+def log_timing(generation, timings: dict, n_structures: int):
+    total = sum(timings.values())
+    stages = ", ".join(f"{k} {v:.1f}s" for k, v in timings.items())
+    print(f"[TIMING] Generation {generation}: {stages}, total {total:.1f}s for {n_structures} structures")
+
+    timing_csv = Path(os.getcwd()) / "pdm_and_energy" / "timing.csv"
+    timing_csv.parent.mkdir(parents=True, exist_ok=True)
+    row = {"generation": generation, "n_structures": n_structures,
+           **{f"{k}_s": round(v, 3) for k, v in timings.items()}, "total_s": round(total, 3)}
+    pd.DataFrame([row]).to_csv(timing_csv, mode="a", header=not timing_csv.exists(), index=False)
+
+
+def run_chgnet_parallel(base_dir: Path, chgnet_pool: CHGNetPool, chgnet_cfg: dict):
+    """Relax the structure of every eval_gen_* folder; returns the relaxed folders and their energies"""
     tasks = []
     for folder in sorted(base_dir.iterdir()):
         if folder.is_dir() and folder.name.startswith("eval_gen_"):
@@ -125,48 +143,62 @@ def run_chgnet_parallel(base_dir: Path, chgnet_script: Path, chgnet_cfg: dict,
             new_path = gen_dir / structure_name
             old_path.rename(new_path)
 
-            tasks.append((gen_dir, structure_name))
-
-    def has_enough_memory(threshold_gb):
-        mem = psutil.virtual_memory()
-        return mem.available / 1e9 >= threshold_gb
+            tasks.append(new_path)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = []
-        for gen_dir, structure_name in tasks:
-            while not has_enough_memory(min_free_mem_gb):
-                print("[MEMORY] Not enough free memory, waiting 10 seconds...")
-                time.sleep(10)
+    # drop overlapping atoms and broken cells before they take a worker
+    tasks, report = Screen.from_config(chgnet_cfg.get("screen")).files(tasks)
+    report.to_csv(base_dir / "screen_report.csv", index=False)
+    print(summarize(report))
 
-            future = executor.submit(run_task, gen_dir, structure_name,
-                                     chgnet_script, chgnet_cfg,
-                                     pdm_script, pdm_cfg, apollox_root)
-            futures.append(future)
+    print(f"[CHGNet] Optimizing {len(tasks)} structures...")
+    results = chgnet_pool.relax(tasks, fmax=chgnet_cfg.get("fmax", 0.01),
+                                steps=chgnet_cfg.get("mlp_optstep", 1),
+                                min_free_mem_gb=chgnet_cfg.get("min_free_mem_gb", 4.0),
+                                save_traj=chgnet_cfg.get("save_traj", False),
+                                traj_interval=chgnet_cfg.get("traj_interval", 1),
+                                results_path=base_dir / "relaxed.npz")
+    energies = pd.DataFrame(results, columns=["name", "energy"])
+    done_names = set(energies["name"])
+    done_dirs = [path.parent for path in tasks if path.name in done_names]
+    return sorted(done_dirs), energies
 
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                future.result()
-            except subprocess.CalledProcessError as e:
-                print(f"[CHGNet-ERROR] Failed in one task: {e}")
 
-                
-def run_chgnet_and_pdm(g: int):
+def run_chgnet_and_pdm(g: int, pdm_pool: PDMPool = None, chgnet_pool: CHGNetPool = None):
     base_dir = Path("temp") / f"pt_files_{g}"
     if not base_dir.exists():
         print(f"Error: Directory {base_dir} does not exist.")
         sys.exit(1)
 
     apollox_root = find_apollox_root()
-    chgnet_script = apollox_root / "opt" / "chgnet_gpu.py"
-    pdm_script = apollox_root / "prepare_dataset" / "compute_pdm.py"
     #pso_dir = apollox_root / "PSO"
 
     chgnet_cfg, pdm_cfg,n = load_config(apollox_root)
 
-    run_chgnet_parallel(base_dir, chgnet_script, chgnet_cfg,
-                        pdm_script, pdm_cfg, apollox_root,
-                        max_workers=chgnet_cfg.get("max_workers", 2),
-                        min_free_mem_gb=chgnet_cfg.get("min_free_mem_gb", 4.0))
+    timings = {}
+    t0 = time.perf_counter()
+    if chgnet_pool is None:
+        with CHGNetPool.from_config(chgnet_cfg) as pool:
+            done_dirs, energies = run_chgnet_parallel(base_dir, pool, chgnet_cfg)
+    else:
+        done_dirs, energies = run_chgnet_parallel(base_dir, chgnet_pool, chgnet_cfg)
+    timings["chgnet"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    if pdm_pool is None:
+        with PDMPool(pdm_cfg["n_jobs"]) as pool:
+            n_structures = run_pdm_batch(done_dirs, pdm_cfg, pool)
+    else:
+        n_structures = run_pdm_batch(done_dirs, pdm_cfg, pdm_pool)
+    timings["pdm"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for gen_dir in done_dirs:
+        try:
+            run_merge(gen_dir, pdm_cfg, energies)
+        except Exception as e:
+            print(f"[MERGE-ERROR] Failed in {gen_dir}: {e}")
+    timings["merge"] = time.perf_counter() - t0
+    log_timing(g, timings, n_structures)
 
     all_data = []
     for folder in sorted(base_dir.iterdir()):
@@ -1,7 +1,9 @@
 import copy
 import itertools
 import json
+import shutil
 import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 import networkx as nx
@@ -16,6 +18,9 @@ from pymatgen.core.lattice import Lattice
 from pymatgen.core.structure import Structure
 from sklearn.metrics import accuracy_score, precision_score, recall_score
 from torch_scatter import scatter
+from tqdm import tqdm
+
+from cdvae.pl_data.cache import CACHE_VERSION, is_cache, merge_caches, write_cache
 
 # Tensor of unit cells. Assumes 27 cells in -1, 0, 1 offsets in the x and y dimensions
 # Note that differing from OCP, we have 27 offsets here because we are in 3D
@@ -349,6 +354,23 @@ def compute_volume(batch_lattice):
     )
 
 
+def lattice_perpendicular_widths(batch_lattice):
+    """Distances between opposite faces of batched lattice matrices
+
+    batch_lattice: (N, 3, 3), returns (N, 3), one width per lattice vector
+    """
+    vector_a, vector_b, vector_c = torch.unbind(batch_lattice, dim=1)
+    face_normals = torch.stack(
+        [
+            torch.cross(vector_b, vector_c, dim=1),
+            torch.cross(vector_c, vector_a, dim=1),
+            torch.cross(vector_a, vector_b, dim=1),
+        ],
+        dim=1,
+    )
+    return compute_volume(batch_lattice)[:, None] / face_normals.norm(dim=-1)
+
+
 def lengths_angles_to_volume(lengths, angles):
     lattice = lattice_params_to_matrix_torch(lengths, angles)
     return compute_volume(lattice)
@@ -443,6 +465,19 @@ def get_pbc_distances(
     return out
 
 
+def lattice_offsets(images, lattice, crystal):
+    """Cartesian offsets of periodic images, images @ lattice[crystal]
+
+    images: (E, 3), lattice: (B, 3, 3), crystal: (E,) index into lattice
+    """
+    rows = lattice.reshape(-1, 9).index_select(0, crystal)
+    return (
+        images[:, 0:1] * rows[:, 0:3]
+        + images[:, 1:2] * rows[:, 3:6]
+        + images[:, 2:3] * rows[:, 6:9]
+    )
+
+
 def radius_graph_pbc_wrapper(data, radius, max_num_neighbors_threshold, device):
     cart_coords = frac_to_cart_coords(
         data.frac_coords, data.lengths, data.angles, data.num_atoms
@@ -470,6 +505,10 @@ def radius_graph_pbc(
 ):
     """Computes pbc graph edges under pbc.
 
+    Every pair of atoms of a crystal is compared in the periodic images that
+    can hold a neighbor within radius, so cells thinner than radius get all
+    their neighbors.
+
     topk_per_pair: (num_'atom_pairs,), select topk edges per atom pair
 
     Note: topk should take into account self-self edge for (i, i)
@@ -527,61 +566,72 @@ def radius_graph_pbc(
         + index_offset_expand
     )
     index2 = (atom_count_sqr % num_atoms_per_image_expand).long() + index_offset_expand
-    # Get the positions for each atom
-    pos1 = torch.index_select(atom_pos, 0, index1)
-    pos2 = torch.index_select(atom_pos, 0, index2)
-
-    unit_cell = torch.tensor(
-        OFFSET_LIST, device=device, dtype=torch.get_default_dtype()
-    )
-    num_cells = len(unit_cell)
-    unit_cell_per_atom = unit_cell.view(1, num_cells, 3).repeat(len(index2), 1, 1)
-    unit_cell = torch.transpose(unit_cell, 0, 1)
-    unit_cell_batch = unit_cell.view(1, 3, num_cells).expand(batch_size, -1, -1)
-
     # lattice matrix
     lattice = lattice_params_to_matrix_torch(lengths, angles)
 
-    # Compute the x, y, z positional offsets for each cell in each image
-    data_cell = torch.transpose(lattice, 1, 2)
-    pbc_offsets = torch.bmm(data_cell, unit_cell_batch)
-    pbc_offsets_per_atom = torch.repeat_interleave(
-        pbc_offsets, num_atoms_per_image_sqr, dim=0
+    # Periodic images to search for every atom pair. The distance to image n
+    # is at least |frac1 - frac2 - n| times the perpendicular width along each
+    # lattice vector, so only the n within radius / width of the fractional
+    # separation can hold a neighbor. Large cells skip most of the 27 images
+    # around the cell, cells thinner than the radius get all images they need.
+    widths = lattice_perpendicular_widths(lattice)
+    pair_crystal = torch.repeat_interleave(
+        torch.arange(batch_size, device=device), num_atoms_per_image_sqr
+    )
+    atom_crystal = torch.repeat_interleave(
+        torch.arange(batch_size, device=device), num_atoms_per_image
+    )
+    frac_coords = torch.einsum(
+        'bi,bij->bj', atom_pos, torch.linalg.pinv(lattice)[atom_crystal]
     )
+    frac_diff = frac_coords.index_select(0, index1) - frac_coords.index_select(0, index2)
+    reach = (radius / widths).index_select(0, pair_crystal)
+    image_min = torch.ceil(frac_diff - reach - EPSILON).long()
+    image_span = torch.clamp(
+        torch.floor(frac_diff + reach + EPSILON).long() - image_min + 1, min=0
+    )
+    num_images = image_span.prod(dim=1)
+
+    # Expand every atom pair into its images, in the order of OFFSET_LIST
+    pair = torch.repeat_interleave(
+        torch.arange(num_atom_pairs, device=device), num_images
+    )
+    image_count = torch.arange(len(pair), device=device) - torch.repeat_interleave(
+        torch.cumsum(num_images, dim=0) - num_images, num_images
+    )
+    span = image_span.index_select(0, pair)
+    unit_cell = image_min.index_select(0, pair) + torch.stack(
+        [
+            torch.div(image_count, span[:, 1] * span[:, 2], rounding_mode='floor'),
+            torch.div(image_count, span[:, 2], rounding_mode='floor') % span[:, 1],
+            image_count % span[:, 2],
+        ],
+        dim=1,
+    )
+    unit_cell = unit_cell.to(torch.get_default_dtype())
+    index1 = index1.index_select(0, pair)
+    index2 = index2.index_select(0, pair)
 
-    # Expand the positions and indices for the 9 cells
-    pos1 = pos1.view(-1, 3, 1).expand(-1, -1, num_cells)
-    pos2 = pos2.view(-1, 3, 1).expand(-1, -1, num_cells)
-    index1 = index1.view(-1, 1).repeat(1, num_cells).view(-1)
-    index2 = index2.view(-1, 1).repeat(1, num_cells).view(-1)
     # Add the PBC offsets for the second atom
-    pos2 = pos2 + pbc_offsets_per_atom
+    pbc_offsets = lattice_offsets(
+        unit_cell, lattice, pair_crystal.index_select(0, pair)
+    )
+    pos1 = torch.index_select(atom_pos, 0, index1)
+    pos2 = torch.index_select(atom_pos, 0, index2) + pbc_offsets
 
     # Compute the squared distance between atoms
     atom_distance_sqr = torch.sum((pos1 - pos2) ** 2, dim=1)
 
     if topk_per_pair is not None:
         assert topk_per_pair.size(0) == num_atom_pairs
-        atom_distance_sqr_sort_index = torch.argsort(atom_distance_sqr, dim=1)
-        assert atom_distance_sqr_sort_index.size() == (
-            num_atom_pairs,
-            num_cells,
-        )
-        atom_distance_sqr_sort_index = (
-            atom_distance_sqr_sort_index
-            + torch.arange(num_atom_pairs, device=device)[:, None] * num_cells
-        ).view(-1)
-        topk_mask = (
-            torch.arange(num_cells, device=device)[None, :] < topk_per_pair[:, None]
-        )
-        topk_mask = topk_mask.view(-1)
-        topk_indices = atom_distance_sqr_sort_index.masked_select(topk_mask)
-
-        topk_mask = torch.zeros(num_atom_pairs * num_cells, device=device)
-        topk_mask.scatter_(0, topk_indices, 1.0)
-        topk_mask = topk_mask.bool()
-
-    atom_distance_sqr = atom_distance_sqr.view(-1)
+        # rank the images of every atom pair by distance, the skipped images
+        # are beyond the radius and would rank after all edges kept below
+        order = torch.argsort(atom_distance_sqr, stable=True)
+        order = order[torch.argsort(pair[order], stable=True)]
+        first = torch.cumsum(num_images, dim=0) - num_images
+        rank = torch.empty_like(order)
+        rank[order] = torch.arange(len(order), device=device) - first[pair[order]]
+        topk_mask = rank < topk_per_pair[pair]
 
     # Remove pairs that are too far apart
     mask_within_radius = torch.le(atom_distance_sqr, radius * radius)
@@ -590,10 +640,7 @@ def radius_graph_pbc(
     mask = torch.logical_and(mask_within_radius, mask_not_same)
     index1 = torch.masked_select(index1, mask)
     index2 = torch.masked_select(index2, mask)
-    unit_cell = torch.masked_select(
-        unit_cell_per_atom.view(-1, 3), mask.view(-1, 1).expand(-1, 3)
-    )
-    unit_cell = unit_cell.view(-1, 3)
+    unit_cell = unit_cell[mask]
     if topk_per_pair is not None:
         topk_mask = torch.masked_select(topk_mask, mask)
 
@@ -691,6 +738,289 @@ def radius_graph_pbc(
         return edge_index, unit_cell, num_neighbors_image, topk_mask
 
 
+def closest_neighbors_mask(index1, atom_distance_sqr, num_nodes, max_num_neighbors_threshold):
+    """Mask keeping the max_num_neighbors_threshold closest edges of every target atom"""
+    keep = torch.ones_like(index1, dtype=torch.bool)
+    if max_num_neighbors_threshold <= 0 or len(index1) == 0:
+        return keep
+    num_neighbors = torch.bincount(index1, minlength=num_nodes)
+    if num_neighbors.max() <= max_num_neighbors_threshold:
+        return keep
+    order = torch.argsort(atom_distance_sqr, stable=True)
+    order = order[torch.argsort(index1[order], stable=True)]
+    first = torch.cumsum(num_neighbors, dim=0) - num_neighbors
+    rank = torch.empty_like(order)
+    rank[order] = torch.arange(len(order), device=order.device) - first[index1[order]]
+    return rank < max_num_neighbors_threshold
+
+
+def select_pbc_neighbors(
+    cart_coords,
+    lengths,
+    angles,
+    num_atoms,
+    edge_index,
+    to_jimages,
+    radius,
+    max_num_neighbors_threshold,
+):
+    """Select the edges radius_graph_pbc would return from a superset of candidates.
+
+    edge_index, to_jimages: candidate edges, e.g. radius_graph_pbc at a larger
+    radius. Edges are kept in their input order, so candidates from
+    radius_graph_pbc give the same edge order as calling it directly.
+    """
+    lattice = lattice_params_to_matrix_torch(lengths, angles)
+    atom_crystal = torch.repeat_interleave(
+        torch.arange(len(num_atoms), device=num_atoms.device), num_atoms
+    )
+    index2, index1 = edge_index
+    offsets = torch.einsum(
+        'bi,bij->bj', to_jimages.to(cart_coords.dtype), lattice[atom_crystal[index1]]
+    )
+    atom_distance_sqr = torch.sum(
+        (cart_coords[index1] - cart_coords[index2] - offsets) ** 2, dim=1
+    )
+    mask = torch.le(atom_distance_sqr, radius * radius) & torch.gt(atom_distance_sqr, 0.0001)
+    index1 = index1[mask]
+    keep = closest_neighbors_mask(
+        index1, atom_distance_sqr[mask], len(cart_coords), max_num_neighbors_threshold
+    )
+    mask[mask.clone()] = keep
+    index1 = index1[keep]
+
+    num_neighbors_image = torch.bincount(
+        atom_crystal[index1], minlength=len(num_atoms)
+    )
+    return edge_index[:, mask], to_jimages[mask], num_neighbors_image
+
+
+def radius_graph_pbc_cell_list(
+    cart_coords,
+    lengths,
+    angles,
+    num_atoms,
+    radius,
+    max_num_neighbors_threshold,
+    device,
+):
+    """Cell-list version of radius_graph_pbc, linear in the number of atoms.
+
+    Fractional coordinates are binned into cells at least `radius / 2` wide
+    (perpendicular to each lattice plane), so only atoms in the bins within
+    `radius` are compared.
+
+    Returns the same edge_index, to_jimages and num_bonds as radius_graph_pbc,
+    in the same order.
+    """
+    batch_size = len(num_atoms)
+    num_nodes = len(cart_coords)
+    lattice = lattice_params_to_matrix_torch(lengths, angles)
+    atom_crystal = torch.repeat_interleave(
+        torch.arange(batch_size, device=device), num_atoms
+    )
+
+    widths = lattice_perpendicular_widths(lattice)
+    # bins of at least radius / 2 compare fewer far pairs than radius-wide ones
+    num_bins = torch.clamp(torch.floor(2 * widths / radius), min=1).long()  # (B, 3)
+    # neighboring bins to search in each direction
+    search = torch.ceil(radius * num_bins / widths - 1e-8).long()  # (B, 3)
+
+    # bin the wrapped fractional coordinates
+    inv_lattice_nodes = torch.linalg.pinv(lattice)[atom_crystal]
+    frac_coords = torch.einsum('bi,bij->bj', cart_coords, inv_lattice_nodes)
+    wrap = torch.floor(frac_coords)
+    atom_bins = torch.floor((frac_coords - wrap) * num_bins[atom_crystal]).long()
+    atom_bins = torch.minimum(atom_bins, num_bins[atom_crystal] - 1)
+    atom_bins = torch.clamp(atom_bins, min=0)
+
+    bins_per_crystal = num_bins.prod(dim=1)
+    bin_offset = torch.cumsum(bins_per_crystal, dim=0) - bins_per_crystal
+
+    def global_bin(crystal, bins):
+        nb = num_bins[crystal]
+        return bin_offset[crystal] + (bins[:, 0] * nb[:, 1] + bins[:, 1]) * nb[:, 2] + bins[:, 2]
+
+    # atoms sorted by bin
+    atom_global_bin = global_bin(atom_crystal, atom_bins)
+    atoms_by_bin = torch.argsort(atom_global_bin, stable=True)
+    bin_count = torch.bincount(atom_global_bin, minlength=int(bins_per_crystal.sum()))
+    bin_start = torch.cumsum(bin_count, dim=0) - bin_count
+
+    # every (atom, neighboring bin) combination
+    stencil = 2 * search + 1  # (B, 3)
+    stencil_size = stencil.prod(dim=1)[atom_crystal]
+    query_atom = torch.repeat_interleave(torch.arange(num_nodes, device=device), stencil_size)
+    query_crystal = atom_crystal[query_atom]
+    query_stencil = stencil[query_crystal]
+    query_search = search[query_crystal]
+    query_idx = torch.arange(len(query_atom), device=device) - torch.repeat_interleave(
+        torch.cumsum(stencil_size, dim=0) - stencil_size, stencil_size
+    )
+    shift = torch.stack(
+        [
+            torch.div(query_idx, query_stencil[:, 1] * query_stencil[:, 2], rounding_mode='floor'),
+            torch.div(query_idx, query_stencil[:, 2], rounding_mode='floor') % query_stencil[:, 1],
+            query_idx % query_stencil[:, 2],
+        ],
+        dim=1,
+    ) - query_search
+    target = atom_bins[query_atom] + shift
+    query_nb = num_bins[query_crystal]
+    image = torch.div(target, query_nb, rounding_mode='floor')
+    target_bin = global_bin(query_crystal, target - image * query_nb)
+
+    # every atom of those bins
+    pair_count = bin_count[target_bin]
+    pair_query = torch.repeat_interleave(torch.arange(len(query_atom), device=device), pair_count)
+    pair_idx = torch.arange(len(pair_query), device=device) - torch.repeat_interleave(
+        torch.cumsum(pair_count, dim=0) - pair_count, pair_count
+    )
+    index1 = query_atom.index_select(0, pair_query)
+    index2 = atoms_by_bin.index_select(
+        0, bin_start.index_select(0, target_bin).index_select(0, pair_query) + pair_idx
+    )
+
+    # distances between wrapped positions, offsets computed once per bin query
+    wrapped_cart_coords = cart_coords - torch.einsum(
+        'bi,bij->bj', wrap, lattice[atom_crystal]
+    )
+    query_offsets = lattice_offsets(image.to(cart_coords.dtype), lattice, query_crystal)
+    distance_vec = (
+        wrapped_cart_coords.index_select(0, index1)
+        - wrapped_cart_coords.index_select(0, index2)
+        - query_offsets.index_select(0, pair_query)
+    )
+    atom_distance_sqr = (distance_vec * distance_vec).sum(dim=1)
+    mask = torch.le(atom_distance_sqr, radius * radius) & torch.gt(atom_distance_sqr, 0.0001)
+    index1, index2 = index1[mask], index2[mask]
+    atom_distance_sqr = atom_distance_sqr[mask]
+    # image of the unwrapped coordinates
+    unit_cell = image[pair_query[mask]] - wrap[index2].long() + wrap[index1].long()
+
+    # order of radius_graph_pbc: by atom pair, then OFFSET_LIST (lexicographic)
+    max_image = int(unit_cell.abs().max()) if len(unit_cell) else 0
+    span = 2 * max_image + 1
+    cell_key = ((unit_cell[:, 0] + max_image) * span + unit_cell[:, 1] + max_image) * span + (
+        unit_cell[:, 2] + max_image
+    )
+    order = torch.argsort((index1 * num_nodes + index2) * span**3 + cell_key)
+    index1, index2 = index1[order], index2[order]
+    unit_cell, atom_distance_sqr = unit_cell[order], atom_distance_sqr[order]
+
+    keep = closest_neighbors_mask(
+        index1, atom_distance_sqr, num_nodes, max_num_neighbors_threshold
+    )
+    index1, index2, unit_cell = index1[keep], index2[keep], unit_cell[keep]
+
+    num_neighbors_image = torch.bincount(atom_crystal[index1], minlength=batch_size)
+    return (
+        torch.stack((index2, index1)),
+        unit_cell.to(torch.get_default_dtype()),
+        num_neighbors_image,
+    )
+
+
+# graph builders selectable with `graph_method` of the decoder
+RADIUS_GRAPH_METHODS = {
+    'dense': radius_graph_pbc,
+    'cell_list': radius_graph_pbc_cell_list,
+}
+
+
+class VerletNeighborList:
+    """radius_graph_pbc with a Verlet skin, for repeated calls on slowly moving atoms.
+
+    Candidate edges are built once within radius + skin and reused while no
+    atom has moved more than skin / 2 since the build (atoms wrapped back
+    into the cell are followed through their periodic images); every call
+    then only recomputes distances of the candidates, see
+    select_pbc_neighbors. A change of lattice or atom counts forces a new
+    build. While atoms move too fast for a build to be reused even once
+    (high noise levels of Langevin dynamics), plain radius_graph_pbc is
+    called instead of building the larger candidate list.
+    `calls` and `builds` count how often each happened.
+    """
+
+    def __init__(self, radius, max_num_neighbors_threshold, skin, graph_method='dense'):
+        self.radius = radius
+        self.max_num_neighbors_threshold = max_num_neighbors_threshold
+        self.skin = skin
+        self.radius_graph = RADIUS_GRAPH_METHODS[graph_method]
+        self.calls = 0
+        self.builds = 0
+        self.reset()
+
+    def reset(self):
+        self.num_atoms = None
+        self.lengths = None
+        self.angles = None
+        self.ref_frac_coords = None
+        self.edge_index = None
+        self.to_jimages = None
+        self.reused = 0
+
+    def _same_cells(self, lengths, angles, num_atoms):
+        return (
+            self.num_atoms is not None
+            and self.num_atoms.shape == num_atoms.shape
+            and torch.equal(self.num_atoms, num_atoms)
+            and torch.equal(self.lengths, lengths)
+            and torch.equal(self.angles, angles)
+        )
+
+    def __call__(self, cart_coords, lengths, angles, num_atoms, device):
+        self.calls += 1
+        lattice = lattice_params_to_matrix_torch(lengths, angles)
+        lattice_nodes = torch.repeat_interleave(lattice, num_atoms, dim=0)
+        inv_lattice_nodes = torch.repeat_interleave(
+            torch.linalg.pinv(lattice), num_atoms, dim=0
+        )
+        frac_coords = torch.einsum('bi,bij->bj', cart_coords, inv_lattice_nodes)
+
+        shift = None
+        if self._same_cells(lengths, angles, num_atoms):
+            # periodic image of each atom closest to its position at the build
+            shift = torch.round(self.ref_frac_coords - frac_coords)
+            displacement = torch.einsum(
+                'bi,bij->bj', frac_coords + shift - self.ref_frac_coords, lattice_nodes
+            )
+            if displacement.norm(dim=1).max() > self.skin / 2:
+                shift = None
+
+        if shift is not None and self.edge_index is not None:
+            self.reused += 1
+            to_jimages = (
+                self.to_jimages + shift[self.edge_index[0]] - shift[self.edge_index[1]]
+            )
+            return select_pbc_neighbors(
+                cart_coords, lengths, angles, num_atoms, self.edge_index, to_jimages,
+                self.radius, self.max_num_neighbors_threshold,
+            )
+
+        self.num_atoms = num_atoms.clone()
+        self.lengths = lengths.clone()
+        self.angles = angles.clone()
+        self.ref_frac_coords = frac_coords
+        self.builds += 1
+        if shift is None and (self.edge_index is None or self.reused == 0):
+            # the last list was not reused: track positions only
+            self.edge_index = self.to_jimages = None
+            return self.radius_graph(
+                cart_coords, lengths, angles, num_atoms,
+                self.radius, self.max_num_neighbors_threshold, device,
+            )
+        self.reused = 0
+        self.edge_index, self.to_jimages, _ = self.radius_graph(
+            cart_coords, lengths, angles, num_atoms,
+            self.radius + self.skin, 0, device,
+        )
+        return select_pbc_neighbors(
+            cart_coords, lengths, angles, num_atoms, self.edge_index, self.to_jimages,
+            self.radius, self.max_num_neighbors_threshold,
+        )
+
+
 def min_distance_sqr_pbc(
     cart_coords1,
     cart_coords2,
@@ -812,9 +1142,11 @@ class StandardScalerTorch(object):
 
 
 def get_scaler_from_data_list(data_list, key):
-    targets = torch.tensor(
-        np.array([d[key] for d in data_list]), dtype=torch.get_default_dtype()
-    )
+    return get_scaler_from_values(np.array([d[key] for d in data_list]), key)
+
+
+def get_scaler_from_values(values, key):
+    targets = torch.tensor(np.asarray(values), dtype=torch.get_default_dtype())
     if key == "spgno":
         means, stds = 115.5, 115.0
         scaler = StandardScalerTorch(means, stds)
@@ -833,44 +1165,112 @@ def parse_prop(item: str | float):
         raise ValueError(f"Parse prop failed: {item}")
 
 
-def preprocess(input_file, num_workers, niggli, primitive, graph_method, prop_list):
+def read_crystal_table(input_file):
     suffix = Path(input_file).suffix
     if suffix == '.csv':
-        df = pd.read_csv(input_file)
+        return pd.read_csv(input_file)
     elif suffix == '.feather':
-        df = pd.read_feather(input_file)
+        return pd.read_feather(input_file)
+    raise ValueError(f"Unsupported dataset format: {input_file}")
+
+
+def process_row(row, niggli, primitive, graph_method, prop_list):
+    """Graph arrays and properties of one row (a dict) of the dataset table"""
+    crystal_str = row['cif']
+    crystal = build_crystal(crystal_str, niggli=niggli, primitive=primitive)
+    graph_arrays = build_crystal_graph(crystal, graph_method)
+    properties = {k: parse_prop(row[k]) for k in prop_list if k in row}
+    result_dict = {
+        'mp_id': row['material_id'],
+        'cif': crystal_str,
+        'graph_arrays': graph_arrays,
+    }
+    result_dict.update(properties)
+    return result_dict
 
-    def process_one(row, niggli, primitive, graph_method, prop_list):
-        crystal_str = row['cif']
-        crystal = build_crystal(crystal_str, niggli=niggli, primitive=primitive)
-        graph_arrays = build_crystal_graph(crystal, graph_method)
-        properties = {k: parse_prop(row[k]) for k in prop_list if k in row.keys()}
-        result_dict = {
-            'mp_id': row['material_id'],
-            'cif': crystal_str,
-            'graph_arrays': graph_arrays,
-        }
-        result_dict.update(properties)
-        return result_dict
 
-    print("num_workers: ", num_workers)
-    unordered_results = p_umap(
-        process_one,
-        [df.iloc[idx] for idx in range(len(df))],
-        [niggli] * len(df),
-        [primitive] * len(df),
-        [graph_method] * len(df),
-        [prop_list] * len(df),
-        num_cpus=num_workers,
-        ncols=79,
-    )
+def process_shard(rows, shard_path, niggli, primitive, graph_method, prop_list):
+    """Process rows in a worker process and write them as one cache"""
+    results = []
+    for row in rows:
+        try:
+            results.append(process_row(row, niggli, primitive, graph_method, prop_list))
+        except Exception as e:
+            raise ValueError(f"{row['material_id']}: {e!r}") from None
+    write_cache(shard_path, results)
+    return len(results)
 
-    mpid_to_results = {result['mp_id']: result for result in unordered_results}
-    ordered_results = [
-        mpid_to_results[df.iloc[idx]['material_id']] for idx in range(len(df))
-    ]
 
-    return ordered_results  # list of dict [{1}, {2}, ...]
+def preprocess_to_cache(
+    input_file, cache_path, num_workers, niggli, primitive, graph_method, prop_list,
+    shard_size=500, restart=False,
+):
+    """Process the crystals of input_file into the columnar cache at cache_path.
+
+    Consecutive rows are processed in shards of shard_size by a pool of
+    num_workers processes, and each shard is written as a cache of its own
+    (in <cache_path>.shards) as soon as it finishes. A later call with the
+    same input and settings only processes the shards that are missing, so
+    an interrupted run resumes instead of starting over; restart=True
+    discards them. The shards are merged in order once all are done.
+    """
+    df = read_crystal_table(input_file)
+    columns = ['material_id', 'cif'] + [k for k in prop_list if k in df.columns]
+    cache_path = Path(cache_path)
+    shard_dir = cache_path.with_name(cache_path.name + '.shards')
+    manifest_path = shard_dir / 'shards.json'
+    stat = Path(input_file).stat()
+    settings = {
+        'input_file': str(Path(input_file).resolve()),
+        'input_size': stat.st_size,
+        'input_mtime': stat.st_mtime_ns,
+        'num_rows': len(df),
+        'niggli': bool(niggli),
+        'primitive': bool(primitive),
+        'graph_method': str(graph_method),
+        'prop_list': [str(k) for k in prop_list],
+        'cache_version': CACHE_VERSION,
+    }
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else None
+    if restart or manifest is None or manifest['settings'] != settings:
+        if shard_dir.exists():
+            shutil.rmtree(shard_dir)
+        shard_dir.mkdir(parents=True)
+        manifest = {'settings': settings, 'shard_size': shard_size}
+        manifest_path.write_text(json.dumps(manifest, indent=2))
+    shard_size = manifest['shard_size']
+
+    starts = range(0, len(df), shard_size)
+    shard_paths = [shard_dir / f'{i:06d}.cache' for i in range(len(starts))]
+    todo = [i for i, shard_path in enumerate(shard_paths) if not is_cache(shard_path)]
+    print(f"[INFO] {len(df)} crystals in {len(shard_paths)} shards of {shard_size}, "
+          f"{len(shard_paths) - len(todo)} already done, {num_workers} workers", flush=True)
+
+    failed = []
+    if todo:
+        with ProcessPoolExecutor(max_workers=min(num_workers, len(todo))) as executor:
+            futures = {
+                executor.submit(
+                    process_shard,
+                    df.iloc[starts[i]:starts[i] + shard_size][columns].to_dict('records'),
+                    shard_paths[i], niggli, primitive, graph_method, prop_list,
+                ): i
+                for i in todo
+            }
+            for future in tqdm(as_completed(futures), total=len(futures), ncols=79):
+                try:
+                    future.result()
+                except Exception as e:
+                    failed.append(futures[future])
+                    print(f"[ERROR] shard {futures[future]}: {e}", flush=True)
+    if failed:
+        raise RuntimeError(
+            f"{len(failed)} of {len(shard_paths)} shards failed, the others are kept in {shard_dir}; "
+            "run again to retry the failed ones"
+        )
+
+    merge_caches(shard_paths, cache_path)
+    shutil.rmtree(shard_dir)
 
 
 def preprocess_tensors(crystal_array_list, niggli, primitive, graph_method):
@@ -922,6 +1322,14 @@ def add_scaled_lattice_prop(data_list, lattice_scale_method):
         dict['scaled_lattice'] = np.concatenate([lengths, angles])
 
 
+def scaled_lattice_array(lattice, num_atoms, lattice_scale_method):
+    """add_scaled_lattice_prop for (N, 6) lengths and angles of N crystals"""
+    lengths, angles = lattice[:, :3], lattice[:, 3:]
+    if lattice_scale_method == 'scale_length':
+        lengths = lengths / np.asarray(num_atoms, dtype=float)[:, None] ** (1 / 3)
+    return np.concatenate([lengths, angles], axis=1)
+
+
 def mard(targets, preds):
     """Mean absolute relative difference."""
     assert torch.all(targets > 0.0)
@@ -0,0 +1,278 @@
+"""Columnar cache of preprocessed crystals.
+
+`process_row` returns one dict per crystal holding its CIF string and graph
+arrays. Pickled, that list takes minutes to load for large datasets and is
+copied into every DataLoader worker. The cache keeps the same data as one
+.npy file per column, concatenated over crystals with offset indices, so a
+crystal is a slice of arrays opened with mmap_mode='r' and the workers
+share the pages of the files:
+
+    meta.json                       format version, crystal count, properties
+    lattice.npy                     (num_crystals, 6) lengths and angles
+    num_atoms.npy                   (num_crystals,)
+    atom_offsets.npy                (num_crystals + 1,) into the atom columns
+    edge_offsets.npy                (num_crystals + 1,) into the edge columns
+    frac_coords.npy                 (total_atoms, 3)
+    atom_types.npy                  (total_atoms,)
+    edge_indices.npy                (total_edges, 2), atom indices within the crystal
+    to_jimages.npy                  (total_edges, 3)
+    mp_id.npy                       (num_crystals,)
+    prop_<name>.npy                 (num_crystals, ...) one per property
+    cif.bin, cif_offsets.npy        utf-8 CIF strings, only read by `cif()`
+
+Only numpy is needed, so scripts can read a cache without torch.
+"""
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+CACHE_VERSION = 1
+# keys of the process_row dicts that are not properties
+GRAPH_KEYS = ('mp_id', 'cif', 'graph_arrays', 'scaled_lattice')
+
+
+def _offsets(counts):
+    return np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+
+
+def _ranges(starts, counts):
+    """Index of the concatenated ranges [start, start + count), a slice when contiguous"""
+    ends = starts + counts
+    if len(starts) == 0 or np.array_equal(starts[1:], ends[:-1]):
+        return slice(int(starts[0]), int(ends[-1])) if len(starts) else slice(0, 0)
+    return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+
+def _compact_int(values):
+    """Integer array in the smallest dtype that holds its values"""
+    values = np.asarray(values, dtype=np.int64)
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if len(values) == 0 or (info.min <= values.min() and values.max() <= info.max):
+            return values.astype(dtype)
+    return values
+
+
+def _start(path):
+    """Empty temporary directory the columns of `path` are written to"""
+    tmp_path = path.with_name(path.name + '.tmp')
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    tmp_path.mkdir(parents=True)
+    return tmp_path
+
+
+def _finish(tmp_path, path, num_crystals, props):
+    # meta.json last: a cache without it is incomplete
+    meta = {'version': CACHE_VERSION, 'num_crystals': num_crystals, 'props': props}
+    (tmp_path / 'meta.json').write_text(json.dumps(meta, indent=2))
+    if path.exists():
+        shutil.rmtree(path)
+    tmp_path.rename(path)
+
+
+def write_cache(path, data_list):
+    """Write the dicts of `process_row` (or `ColumnarCache.to_dict`) to `path`.
+
+    The columns are written to a temporary directory that replaces `path`
+    once complete, so an interrupted run never leaves a partial cache.
+    """
+    path = Path(path)
+    tmp_path = _start(path)
+
+    graph_arrays = [d['graph_arrays'] for d in data_list]
+    num_atoms = np.array([g[6] for g in graph_arrays], dtype=np.int64)
+    edge_indices = [np.asarray(g[4]).reshape(-1, 2) for g in graph_arrays]
+    to_jimages = [np.asarray(g[5]).reshape(-1, 3) for g in graph_arrays]
+    mp_ids = np.array([d['mp_id'] for d in data_list])
+    if mp_ids.dtype == object:
+        mp_ids = mp_ids.astype(str)
+    columns = {
+        'lattice': np.array(
+            [np.concatenate([g[2], g[3]]) for g in graph_arrays], dtype=np.float64
+        ).reshape(-1, 6),
+        'num_atoms': num_atoms,
+        'atom_offsets': _offsets(num_atoms),
+        'edge_offsets': _offsets([len(e) for e in edge_indices]),
+        'frac_coords': np.concatenate(
+            [np.zeros((0, 3))] + [np.asarray(g[0], dtype=np.float64).reshape(-1, 3) for g in graph_arrays]
+        ),
+        'atom_types': _compact_int(
+            np.concatenate([np.zeros(0, dtype=np.int64)] + [np.asarray(g[1]).reshape(-1) for g in graph_arrays])
+        ),
+        'edge_indices': _compact_int(np.concatenate([np.zeros((0, 2), dtype=np.int64)] + edge_indices)),
+        'to_jimages': _compact_int(np.concatenate([np.zeros((0, 3), dtype=np.int64)] + to_jimages)),
+        'mp_id': mp_ids,
+    }
+
+    props = [key for key in (data_list[0] if data_list else {}) if key not in GRAPH_KEYS]
+    for prop in props:
+        values = np.array([d[prop] for d in data_list])
+        if values.dtype == object:
+            raise ValueError(f"Property {prop} has values of different shapes, cannot be cached")
+        columns[f'prop_{prop}'] = values
+
+    for name, values in columns.items():
+        np.save(tmp_path / f'{name}.npy', values, allow_pickle=False)
+
+    cif_lengths = []
+    with open(tmp_path / 'cif.bin', 'wb') as f:
+        for d in data_list:
+            cif_lengths.append(f.write(d.get('cif', '').encode()))
+    np.save(tmp_path / 'cif_offsets.npy', _offsets(cif_lengths))
+    _finish(tmp_path, path, len(data_list), props)
+
+
+def merge_caches(paths, path):
+    """Concatenate the caches in `paths` (e.g. the shards of one dataset,
+    in order) into `path`, column by column without loading whole caches"""
+    path = Path(path)
+    caches = [ColumnarCache(p) for p in paths]
+    if not caches:
+        write_cache(path, [])
+        return
+    props = caches[0].props
+    for cache in caches:
+        if cache.props != props:
+            raise ValueError(f"{cache.path} has properties {cache.props}, expected {props}")
+    tmp_path = _start(path)
+
+    for name in ('atom_offsets', 'edge_offsets', 'cif_offsets'):
+        offsets = [cache._load(name) for cache in caches]
+        starts = _offsets([o[-1] for o in offsets])
+        np.save(tmp_path / f'{name}.npy', np.concatenate(
+            [[0]] + [np.asarray(o[1:]) + start for o, start in zip(offsets, starts)]
+        ).astype(np.int64))
+
+    names = ['lattice', 'num_atoms', 'frac_coords', 'atom_types', 'edge_indices', 'to_jimages', 'mp_id']
+    for name in names + [f'prop_{prop}' for prop in props]:
+        columns = [cache._load(name) for cache in caches]
+        shape = (sum(len(c) for c in columns),) + columns[0].shape[1:]
+        dtype = np.result_type(*columns)
+        if 0 in shape:
+            np.save(tmp_path / f'{name}.npy', np.zeros(shape, dtype=dtype))
+            continue
+        merged = np.lib.format.open_memmap(tmp_path / f'{name}.npy', mode='w+', dtype=dtype, shape=shape)
+        start = 0
+        for column in columns:
+            merged[start:start + len(column)] = column
+            start += len(column)
+        merged.flush()
+        del merged
+
+    with open(tmp_path / 'cif.bin', 'wb') as f:
+        for cache in caches:
+            with open(cache.path / 'cif.bin', 'rb') as shard:
+                shutil.copyfileobj(shard, f)
+    _finish(tmp_path, path, sum(len(cache) for cache in caches), props)
+
+
+def is_cache(path):
+    return (Path(path) / 'meta.json').exists()
+
+
+class ColumnarCache:
+    """Read-only, memory-mapped view of a cache written by `write_cache`"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / 'meta.json').read_text())
+        if self.meta['version'] != CACHE_VERSION:
+            raise ValueError(
+                f"{self.path} has cache version {self.meta['version']}, expected {CACHE_VERSION}; "
+                "process the dataset again with force_process=true"
+            )
+        self.props = self.meta['props']
+        self.lattice = self._load('lattice')
+        self.num_atoms = self._load('num_atoms')
+        self.atom_offsets = self._load('atom_offsets')
+        self.edge_offsets = self._load('edge_offsets')
+        self.frac_coords = self._load('frac_coords')
+        self.atom_types = self._load('atom_types')
+        self.edge_indices = self._load('edge_indices')
+        self.to_jimages = self._load('to_jimages')
+        self.mp_ids = self._load('mp_id')
+        self.prop_values = {prop: self._load(f'prop_{prop}') for prop in self.props}
+        self._cif_offsets = self._cif = None
+
+    def _load(self, name):
+        return np.load(self.path / f'{name}.npy', mmap_mode='r')
+
+    # workers started with spawn map the files again instead of receiving copies
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def __len__(self):
+        return self.meta['num_crystals']
+
+    def graph_arrays(self, index):
+        """Same tuple as build_crystal_graph"""
+        atoms = slice(self.atom_offsets[index], self.atom_offsets[index + 1])
+        edges = slice(self.edge_offsets[index], self.edge_offsets[index + 1])
+        return (
+            self.frac_coords[atoms],
+            self.atom_types[atoms].astype(np.int64),
+            self.lattice[index, :3],
+            self.lattice[index, 3:],
+            self.edge_indices[edges].astype(np.int64),
+            self.to_jimages[edges].astype(np.int64),
+            int(self.num_atoms[index]),
+        )
+
+    def batch_arrays(self, indices):
+        """graph_arrays of several crystals, concatenated over crystals:
+        frac_coords, atom_types, lengths, angles, edge_indices (still per
+        crystal), to_jimages, num_atoms, num_bonds. Consecutive indices are
+        read as slices."""
+        indices = np.asarray(indices, dtype=np.int64)
+        num_atoms = np.asarray(self.num_atoms[indices])
+        edge_starts = np.asarray(self.edge_offsets[indices])
+        num_bonds = np.asarray(self.edge_offsets[indices + 1]) - edge_starts
+        atoms = _ranges(np.asarray(self.atom_offsets[indices]), num_atoms)
+        edges = _ranges(edge_starts, num_bonds)
+        lattice = np.asarray(self.lattice[indices])
+        return (
+            np.asarray(self.frac_coords[atoms]),
+            self.atom_types[atoms].astype(np.int64),
+            lattice[:, :3],
+            lattice[:, 3:],
+            self.edge_indices[edges].astype(np.int64),
+            self.to_jimages[edges].astype(np.int64),
+            num_atoms,
+            num_bonds,
+        )
+
+    def atom_types_list(self):
+        """Atomic numbers of every crystal"""
+        atom_types = np.asarray(self.atom_types, dtype=np.int64)
+        return np.split(atom_types, self.atom_offsets[1:-1])
+
+    def mp_id(self, index):
+        return self.mp_ids[index].item()
+
+    def cif(self, index):
+        if self._cif_offsets is None:
+            self._cif_offsets = self._load('cif_offsets')
+        start, end = self._cif_offsets[index], self._cif_offsets[index + 1]
+        if start == end:
+            return ''
+        if self._cif is None:
+            self._cif = np.memmap(self.path / 'cif.bin', dtype=np.uint8, mode='r')
+        return bytes(self._cif[start:end]).decode()
+
+    def to_dict(self, index):
+        """The dict `process_row` returned for this crystal"""
+        result = {
+            'mp_id': self.mp_id(index),
+            'cif': self.cif(index),
+            'graph_arrays': tuple(
+                np.array(a) if isinstance(a, np.ndarray) else a for a in self.graph_arrays(index)
+            ),
+        }
+        result.update({prop: self.prop_values[prop][index].tolist() for prop in self.props})
+        return result
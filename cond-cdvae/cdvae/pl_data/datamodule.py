@@ -8,11 +8,11 @@ import omegaconf
 import pytorch_lightning as pl
 import torch
 from omegaconf import DictConfig
-from torch.utils.data import Dataset
-from torch_geometric.loader import DataLoader
+from torch.utils.data import DataLoader, Dataset
 
-from cdvae.common.data_utils import get_scaler_from_data_list
+from cdvae.common.data_utils import get_scaler_from_values
 from cdvae.common.utils import PROJECT_ROOT
+from cdvae.pl_data.dataset import collate_batch
 
 
 def worker_init_fn(id: int):
@@ -64,12 +64,13 @@ class CrystDataModule(pl.LightningDataModule):
     def get_scaler(self, scaler_path):
         # Load once to compute property scaler
         if scaler_path is None:
-            train_dataset = hydra.utils.instantiate(self.datasets.train)
-            self.lattice_scaler = get_scaler_from_data_list(
-                train_dataset.cached_data, key='scaled_lattice')
+            # reused by setup, the cache is memory-mapped
+            self.train_dataset = hydra.utils.instantiate(self.datasets.train)
+            self.lattice_scaler = get_scaler_from_values(
+                self.train_dataset.column('scaled_lattice'), key='scaled_lattice')
             self.prop_scalers = [
-                get_scaler_from_data_list(train_dataset.cached_data, key=p)
-                for p in train_dataset.prop
+                get_scaler_from_values(self.train_dataset.column(p), key=p)
+                for p in self.train_dataset.prop
             ]
         else:
             self.lattice_scaler = torch.load(
@@ -112,6 +113,7 @@ class CrystDataModule(pl.LightningDataModule):
             batch_size=self.train_batch_size,
             num_workers=self.num_workers.train,
             worker_init_fn=worker_init_fn,
+            collate_fn=collate_batch,
         )
 
     def val_dataloader(self) -> Sequence[DataLoader]:
@@ -122,6 +124,7 @@ class CrystDataModule(pl.LightningDataModule):
                 batch_size=self.val_batch_size,
                 num_workers=self.num_workers.val,
                 worker_init_fn=worker_init_fn,
+                collate_fn=collate_batch,
             ) for dataset in self.val_datasets
         ]
 
@@ -133,6 +136,7 @@ class CrystDataModule(pl.LightningDataModule):
                 batch_size=self.test_batch_size,
                 num_workers=self.num_workers.test,
                 worker_init_fn=worker_init_fn,
+                collate_fn=collate_batch,
             ) for dataset in self.test_datasets
         ]
 
@@ -8,14 +8,16 @@ import pandas as pd
 import torch
 from omegaconf import ValueNode
 from torch.utils.data import Dataset
-from torch_geometric.data import Data
+from torch_geometric.data import Batch, Data
 
 from cdvae.common.data_utils import (
     add_scaled_lattice_prop,
-    preprocess,
     preprocess_tensors,
+    preprocess_to_cache,
+    scaled_lattice_array,
 )
 from cdvae.common.utils import PROJECT_ROOT
+from cdvae.pl_data.cache import ColumnarCache, is_cache, write_cache
 
 
 class CrystDataset(Dataset):
@@ -43,45 +45,79 @@ class CrystDataset(Dataset):
         self.primitive = primitive
         self.graph_method = graph_method
         self.lattice_scale_method = lattice_scale_method
-        pkl_path = Path(path).with_suffix(".pkl")  # processed pkl path
-
-        if self.force_process or not pkl_path.exists():
-            hydra.utils.log.info(f"Dumping into {pkl_path} ...")
-            self.cached_data = preprocess(
-                self.path,
-                preprocess_workers,
-                niggli=self.niggli,
-                primitive=self.primitive,
-                graph_method=self.graph_method,
-                prop_list=prop,
-            )
-            pickle.dump(self.cached_data, open(pkl_path, 'wb'))
-        else:
-            hydra.utils.log.info(f"Loading from {pkl_path} ...")
-            self.cached_data = pickle.load(open(pkl_path, 'rb'))
+        self.cache_path = Path(path).with_suffix(".cache")  # processed columnar cache
+        pkl_path = Path(path).with_suffix(".pkl")  # processed pkl of earlier versions
 
-        add_scaled_lattice_prop(self.cached_data, lattice_scale_method)
+        if self.force_process or not is_cache(self.cache_path):
+            if not self.force_process and pkl_path.exists():
+                hydra.utils.log.info(f"Converting {pkl_path} into {self.cache_path} ...")
+                write_cache(self.cache_path, pickle.load(open(pkl_path, 'rb')))
+            else:
+                hydra.utils.log.info(f"Dumping into {self.cache_path} ...")
+                preprocess_to_cache(
+                    self.path,
+                    self.cache_path,
+                    preprocess_workers,
+                    niggli=self.niggli,
+                    primitive=self.primitive,
+                    graph_method=self.graph_method,
+                    prop_list=prop,
+                    restart=self.force_process,
+                )
+        hydra.utils.log.info(f"Loading from {self.cache_path} ...")
+        self.cached_data = ColumnarCache(self.cache_path)
+        missing = [p for p in self.prop if p not in self.cached_data.props]
+        if missing:
+            raise KeyError(
+                f"{self.cache_path} has no {missing}, process it again with force_process=true"
+            )
+        self.scaled_lattice = scaled_lattice_array(
+            self.cached_data.lattice, self.cached_data.num_atoms, lattice_scale_method
+        )
 
         self.lattice_scaler = None
-        self.prop_scalers: list = None  # list of prop_scaler
+        self.prop_scalers = None  # list of prop_scaler
         if lattice_scaler_path is not None:
             self.lattice_scaler = torch.load(lattice_scaler_path)
         if prop_scalers_path is not None:
             self.prop_scalers = torch.load(prop_scalers_path)
 
+    @property
+    def prop_scalers(self):
+        return self._prop_scalers
+
+    @prop_scalers.setter
+    def prop_scalers(self, prop_scalers):
+        self._prop_scalers = prop_scalers
+        self._scaled_props = None
+
+    def scaled_props(self):
+        """Every property column transformed by its scaler, computed once
+        (per DataLoader worker) instead of once per item"""
+        if self._scaled_props is None:
+            self._scaled_props = {
+                p: prop_scaler.transform(
+                    torch.tensor(
+                        self.cached_data.prop_values[p], dtype=torch.get_default_dtype()
+                    ).reshape(len(self), -1)
+                )
+                for p, prop_scaler in zip(self.prop, self.prop_scalers, strict=True)
+            }
+        return self._scaled_props
+
     def __len__(self) -> int:
         return len(self.cached_data)
 
-    def __getitem__(self, index) -> Data:
-        data_dict = self.cached_data[index]
-        # {'mp_id', 'cif', 'graph_array' **prop}
+    def column(self, key):
+        """Values of `key` for every crystal: 'scaled_lattice' or a property"""
+        if key == 'scaled_lattice':
+            return self.scaled_lattice
+        return self.cached_data.prop_values[key]
 
+    def __getitem__(self, index) -> Data:
         # scaler is set in DataModule set stage
         p_dict = {
-            p: prop_scaler.transform(
-                torch.tensor(data_dict[p], dtype=torch.get_default_dtype()).view(1, -1)
-            )
-            for p, prop_scaler in zip(self.prop, self.prop_scalers, strict=True)
+            p: values[index].view(1, -1).clone() for p, values in self.scaled_props().items()
         }
 
         (
@@ -92,7 +128,7 @@ class CrystDataset(Dataset):
             edge_indices,
             to_jimages,
             num_atoms,
-        ) = data_dict['graph_arrays']
+        ) = self.cached_data.graph_arrays(index)
 
         # atom_coords are fractional coordinates
         # edge_index is incremented during batching
@@ -108,13 +144,90 @@ class CrystDataset(Dataset):
             num_atoms=num_atoms,
             num_bonds=edge_indices.shape[0],
             num_nodes=num_atoms,  # special attribute used for batching in pyg
-            mp_id=data_dict['mp_id'],
+            mp_id=self.cached_data.mp_id(index),
             **p_dict,
         )
         return data
 
+    def __getitems__(self, indices) -> Batch:
+        """The batch Batch.from_data_list would build from the items, sliced
+        from the cache in one step. DataLoader calls it with the indices of
+        each batch; use collate_batch as its collate_fn."""
+        (
+            frac_coords,
+            atom_types,
+            lengths,
+            angles,
+            edge_indices,
+            to_jimages,
+            num_atoms,
+            num_bonds,
+        ) = self.cached_data.batch_arrays(indices)
+        num_graphs = len(num_atoms)
+        num_atoms = torch.from_numpy(num_atoms)
+        num_bonds = torch.from_numpy(num_bonds)
+        ptr = torch.zeros(num_graphs + 1, dtype=torch.int64)
+        torch.cumsum(num_atoms, dim=0, out=ptr[1:])
+        edge_ptr = torch.zeros(num_graphs + 1, dtype=torch.int64)
+        torch.cumsum(num_bonds, dim=0, out=edge_ptr[1:])
+        graph_ptr = torch.arange(num_graphs + 1)
+
+        # edge indices of each crystal are incremented by its first atom
+        edge_index = torch.from_numpy(edge_indices.T) + torch.repeat_interleave(
+            ptr[:-1], num_bonds
+        )
+        indices = torch.as_tensor(indices, dtype=torch.int64)
+        p_dict = {
+            p: values.index_select(0, indices) for p, values in self.scaled_props().items()
+        }
+        batch = Batch(
+            frac_coords=torch.tensor(frac_coords, dtype=torch.get_default_dtype()),
+            atom_types=torch.from_numpy(atom_types),
+            lengths=torch.tensor(lengths, dtype=torch.get_default_dtype()),
+            angles=torch.tensor(angles, dtype=torch.get_default_dtype()),
+            edge_index=edge_index.contiguous(),
+            to_jimages=torch.from_numpy(to_jimages),
+            num_atoms=num_atoms,
+            num_bonds=num_bonds,
+            num_nodes=int(ptr[-1]),
+            mp_id=self.cached_data.mp_ids[indices.numpy()].tolist(),
+            batch=torch.repeat_interleave(torch.arange(num_graphs), num_atoms),
+            ptr=ptr,
+            **p_dict,
+        )
+        # what Batch.from_data_list records, for to_data_list and indexing
+        batch._num_graphs = num_graphs
+        batch._num_nodes = num_atoms.tolist()
+        batch._slice_dict = {
+            'frac_coords': ptr,
+            'atom_types': ptr,
+            'lengths': graph_ptr,
+            'angles': graph_ptr,
+            'edge_index': edge_ptr,
+            'to_jimages': edge_ptr,
+            'num_atoms': graph_ptr,
+            'num_bonds': graph_ptr,
+            'mp_id': graph_ptr,
+            **{p: graph_ptr for p in p_dict},
+        }
+        # zero increments for every tensor, None for lists such as mp_id
+        zero_inc = torch.zeros(num_graphs, dtype=torch.int64)
+        batch._inc_dict = {key: zero_inc for key in batch._slice_dict}
+        batch._inc_dict['mp_id'] = None
+        batch._inc_dict['edge_index'] = ptr[:-1]
+        return batch
+
     def __repr__(self) -> str:
-        return f"CrystDataset({self.name=}, {self.path=}, {self.save_path=})"
+        return f"CrystDataset({self.name=}, {self.path=}, {self.cache_path=})"
+
+
+def collate_batch(data):
+    """collate_fn for CrystDataset: batches come whole from __getitems__,
+    lists of items (DataLoaders without __getitems__ support) are collated
+    as the torch_geometric DataLoader does"""
+    if isinstance(data, Batch):
+        return data
+    return Batch.from_data_list(data)
 
 
 # Warning: Never used, do not use
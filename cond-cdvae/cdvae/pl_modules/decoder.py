@@ -28,6 +28,7 @@ class GemNetTDecoder(nn.Module):
         max_neighbors=20,
         radius=6.,
         scale_file=None,
+        graph_method='dense',
     ):
         super(GemNetTDecoder, self).__init__()
         self.cutoff = radius
@@ -43,10 +44,19 @@ class GemNetTDecoder(nn.Module):
             cutoff=self.cutoff,
             max_neighbors=self.max_num_neighbors,
             otf_graph=True,
+            graph_method=graph_method,
             scale_file=scale_file,
         )
         self.fc_atom = nn.Linear(hidden_dim, MAX_ATOMIC_NUM)
 
+    def enable_neighbor_list(self, skin):
+        """Reuse neighbor lists across calls (e.g. Langevin steps) with a Verlet skin"""
+        return self.gemnet.enable_neighbor_list(skin)
+
+    def disable_neighbor_list(self):
+        """Back to building the graph on every call; returns the used VerletNeighborList"""
+        return self.gemnet.disable_neighbor_list()
+
     def forward(self, z, pred_frac_coords, pred_atom_types, num_atoms,
                 lengths, angles):
         """
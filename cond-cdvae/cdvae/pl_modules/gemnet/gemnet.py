@@ -13,8 +13,8 @@ from typing import Optional
 import numpy as np
 import torch
 import torch.nn as nn
-from cdvae.common.data_utils import (frac_to_cart_coords, get_pbc_distances,
-                                     radius_graph_pbc)
+from cdvae.common.data_utils import (RADIUS_GRAPH_METHODS, VerletNeighborList,
+                                     frac_to_cart_coords, get_pbc_distances)
 from torch_scatter import scatter
 from torch_sparse import SparseTensor
 
@@ -116,6 +116,7 @@ class GemNetT(torch.nn.Module):
         envelope: dict = {"name": "polynomial", "exponent": 5},
         cbf: dict = {"name": "spherical_harmonics"},
         otf_graph: bool = False,
+        graph_method: str = "dense",
         output_init: str = "HeOrthogonal",
         activation: str = "swish",
         scale_file: Optional[str] = None,
@@ -133,6 +134,12 @@ class GemNetT(torch.nn.Module):
 
         self.regress_forces = regress_forces
         self.otf_graph = otf_graph
+        # key of RADIUS_GRAPH_METHODS used for otf graphs
+        if graph_method not in RADIUS_GRAPH_METHODS:
+            raise ValueError(f"graph_method must be one of {list(RADIUS_GRAPH_METHODS)}")
+        self.graph_method = graph_method
+        # set by enable_neighbor_list() while sampling, see VerletNeighborList
+        self.neighbor_list = None
 
         AutomaticFit.reset()  # make sure that queue is empty (avoid potential error)
 
@@ -242,6 +249,17 @@ class GemNetT(torch.nn.Module):
             (self.mlp_rbf_out, self.num_blocks + 1),
         ]
 
+    def enable_neighbor_list(self, skin):
+        """Reuse otf graphs across calls with a Verlet skin (Angstrom)"""
+        self.neighbor_list = VerletNeighborList(
+            self.cutoff, self.max_neighbors, skin, self.graph_method
+        )
+        return self.neighbor_list
+
+    def disable_neighbor_list(self):
+        neighbor_list, self.neighbor_list = self.neighbor_list, None
+        return neighbor_list
+
     def get_triplets(self, edge_index, num_atoms):
         """
         Get all b->a for each edge c->a.
@@ -410,8 +428,11 @@ class GemNetT(torch.nn.Module):
                                    num_atoms, edge_index, to_jimages,
                                    num_bonds):
 
-        if self.otf_graph:
-            edge_index, to_jimages, num_bonds = radius_graph_pbc(
+        if self.otf_graph and self.neighbor_list is not None:
+            edge_index, to_jimages, num_bonds = self.neighbor_list(
+                cart_coords, lengths, angles, num_atoms, device=num_atoms.device)
+        elif self.otf_graph:
+            edge_index, to_jimages, num_bonds = RADIUS_GRAPH_METHODS[self.graph_method](
                 cart_coords, lengths, angles, num_atoms, self.cutoff, self.max_neighbors,
                 device=num_atoms.device)
 
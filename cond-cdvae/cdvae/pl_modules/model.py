@@ -216,6 +216,18 @@ class CDVAE(BaseModule):
             angles,
         )
 
+    def langevin_step_schedule(self, n_step_each, n_step_min=None):
+        """number of steps at each sigma level (highest sigma first)
+
+        Without n_step_min every level runs n_step_each steps, otherwise the
+        count grows linearly from n_step_min at the highest sigma to
+        n_step_each at the lowest one.
+        """
+        num_levels = self.sigmas.size(0)
+        if n_step_min is None or num_levels == 1:
+            return [n_step_each] * num_levels
+        return np.rint(np.linspace(n_step_min, n_step_each, num_levels)).astype(int).tolist()
+
     @torch.no_grad()
     def langevin_dynamics(self, cond_z, ld_kwargs, gt_num_atoms, gt_atom_types):
         """
@@ -226,9 +238,37 @@ class CDVAE(BaseModule):
             min_sigma:    minimum sigma to use in annealed langevin dynamics.
             save_traj:    if <True>, save the entire LD trajectory.
             disable_bar:  disable the progress bar of langevin dynamics.
+          optional:
+            n_step_min:   steps at the highest sigma level, growing linearly
+                          to n_step_each at the lowest (default: n_step_each).
+            adaptive:     if <True>, a crystal leaves the batch for the rest of
+                          a sigma level once the RMS of its drift
+                          (step_size * score, in Angstrom) stayed below
+                          conv_tol for conv_patience consecutive steps.
+            conv_tol:     default 1e-3.
+            conv_patience: default 5.
+            verlet_skin:  if > 0, the decoder reuses its neighbor lists while
+                          no atom moved more than verlet_skin / 2 Angstrom.
         gt_num_atoms: if not <None>, use the ground truth number of atoms.
         gt_atom_types: if not <None>, use the ground truth atom types.
+
+        output_dict['num_steps'] holds the decoder steps run for each crystal,
+        'graph_builds' the number of neighbor list builds.
         """
+        adaptive = getattr(ld_kwargs, 'adaptive', False)
+        conv_tol = getattr(ld_kwargs, 'conv_tol', 1e-3)
+        conv_patience = getattr(ld_kwargs, 'conv_patience', 5)
+        step_schedule = self.langevin_step_schedule(
+            ld_kwargs.n_step_each, getattr(ld_kwargs, 'n_step_min', None)
+        )
+        if adaptive and gt_atom_types is None:
+            raise ValueError("adaptive langevin dynamics needs gt_atom_types")
+        verlet_skin = getattr(ld_kwargs, 'verlet_skin', 0)
+        # drop a list left over from an interrupted run
+        self.decoder.disable_neighbor_list()
+        if verlet_skin > 0:
+            self.decoder.enable_neighbor_list(verlet_skin)
+
         if ld_kwargs.save_traj:
             all_frac_coords = []
             all_pred_cart_coord_diff = []
@@ -253,9 +293,15 @@ class CDVAE(BaseModule):
         # init coords.
         cur_frac_coords = torch.rand((num_atoms.sum(), 3), device=cond_z.device)
 
+        batch_size = num_atoms.size(0)
+        atom_crystal = torch.repeat_interleave(
+            torch.arange(batch_size, device=cond_z.device), num_atoms
+        )
+        num_steps = torch.zeros(batch_size, dtype=torch.long, device=cond_z.device)
+
         # annealed langevin dynamics.
-        for sigma in tqdm(
-            self.sigmas,
+        for sigma, n_step in tqdm(
+            zip(self.sigmas, step_schedule),
             total=self.sigmas.size(0),
             disable=ld_kwargs.disable_bar,
             mininterval=10,
@@ -264,45 +310,90 @@ class CDVAE(BaseModule):
             if sigma < ld_kwargs.min_sigma:
                 break
             step_size = ld_kwargs.step_lr * (sigma / self.sigmas[-1]) ** 2
-
-            for step in range(ld_kwargs.n_step_each):
-                noise_cart = torch.randn_like(cur_frac_coords) * torch.sqrt(
+            # every crystal takes part again at a new sigma level
+            active = torch.ones(batch_size, dtype=torch.bool, device=cond_z.device)
+            quiet = torch.zeros(batch_size, dtype=torch.long, device=cond_z.device)
+
+            for step in range(n_step):
+                if active.all():
+                    crystals, atoms = slice(None), slice(None)
+                else:
+                    crystals, atoms = active, active[atom_crystal]
+                num_steps += active.long()
+                step_num_atoms = num_atoms[crystals]
+                step_lengths, step_angles = lengths[crystals], angles[crystals]
+                step_frac_coords = cur_frac_coords[atoms]
+
+                noise_cart = torch.randn_like(step_frac_coords) * torch.sqrt(
                     step_size * 2
                 )
                 pred_cart_coord_diff, pred_atom_types = self.decoder(
-                    cond_z,
-                    cur_frac_coords,
-                    cur_atom_types,
-                    num_atoms,
-                    lengths,
-                    angles,
+                    cond_z[crystals],
+                    step_frac_coords,
+                    cur_atom_types[atoms],
+                    step_num_atoms,
+                    step_lengths,
+                    step_angles,
                 )
                 cur_cart_coords = frac_to_cart_coords(
-                    cur_frac_coords, lengths, angles, num_atoms
+                    step_frac_coords, step_lengths, step_angles, step_num_atoms
                 )
                 pred_cart_coord_diff = pred_cart_coord_diff / sigma
                 cur_cart_coords = (
                     cur_cart_coords + step_size * pred_cart_coord_diff + noise_cart
                 )
-                cur_frac_coords = cart_to_frac_coords(
-                    cur_cart_coords, lengths, angles, num_atoms
+                step_frac_coords = cart_to_frac_coords(
+                    cur_cart_coords, step_lengths, step_angles, step_num_atoms
                 )
+                if isinstance(atoms, slice):
+                    cur_frac_coords = step_frac_coords
+                else:
+                    cur_frac_coords = cur_frac_coords.clone()
+                    cur_frac_coords[atoms] = step_frac_coords
 
                 if gt_atom_types is None:  # never used
                     cur_atom_types = torch.argmax(pred_atom_types, dim=1) + 1
 
+                if adaptive:
+                    drift = scatter(
+                        (step_size * pred_cart_coord_diff).pow(2).sum(dim=1),
+                        atom_crystal[atoms],
+                        dim=0,
+                        dim_size=batch_size,
+                        reduce='mean',
+                    ).sqrt()
+                    quiet = torch.where(active & (drift < conv_tol), quiet + 1, 0)
+                    active = active & (quiet < conv_patience)
+
                 if ld_kwargs.save_traj:
+                    if not isinstance(atoms, slice):
+                        # frozen crystals did not move in this step
+                        pred_cart_coord_diff = torch.zeros_like(cur_frac_coords).index_put_(
+                            (atoms.nonzero(as_tuple=True)[0],), pred_cart_coord_diff
+                        )
+                        noise_cart = torch.zeros_like(cur_frac_coords).index_put_(
+                            (atoms.nonzero(as_tuple=True)[0],), noise_cart
+                        )
                     all_frac_coords.append(cur_frac_coords)
                     all_pred_cart_coord_diff.append(step_size * pred_cart_coord_diff)
                     all_noise_cart.append(noise_cart)
                     all_atom_types.append(cur_atom_types)
 
+                if not active.any():
+                    break
+
+        graph_builds = None
+        if verlet_skin > 0:
+            graph_builds = self.decoder.disable_neighbor_list().builds
+
         output_dict = {
             'num_atoms': num_atoms,
             'lengths': lengths,
             'angles': angles,
             'frac_coords': cur_frac_coords,
             'atom_types': cur_atom_types,
+            'num_steps': num_steps,
+            'graph_builds': graph_builds,
             'is_traj': False,
         }
 
@@ -0,0 +1,109 @@
+"""Time loading a preprocessed dataset item by item (torch_geometric
+DataLoader) against whole batches sliced from the columnar cache."""
+import argparse
+import time
+
+import torch
+from torch.utils.data import DataLoader, Dataset
+from torch_geometric.data import Batch
+from torch_geometric.loader import DataLoader as PyGDataLoader
+
+from cdvae.common.data_utils import get_scaler_from_values
+from cdvae.pl_data.dataset import CrystDataset, collate_batch
+
+
+class PerItem(Dataset):
+    """The dataset without __getitems__, as DataLoaders used to see it"""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        return self.dataset[index]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark per-item vs batched data loading")
+    parser.add_argument('--data_path', required=True,
+                        help="train.feather of a dataset whose train.cache (or train.pkl) exists")
+    parser.add_argument('--prop', nargs='*', help="Properties to load (default: all in the cache)")
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--num_workers', type=int, default=0)
+    parser.add_argument('--num_batches', type=int, default=200, help="Batches to time per loader")
+    parser.add_argument('--lattice_scale_method', default='scale_length')
+    return parser.parse_args()
+
+
+def same_data(a, b):
+    # Data.keys is a property in torch_geometric 2.3
+    for key in a.keys:
+        x, y = a[key], b[key]
+        if torch.is_tensor(x):
+            if x.dtype != y.dtype or x.shape != y.shape or not torch.equal(x, y):
+                return False
+        elif x != y:
+            return False
+    return set(a.keys) == set(b.keys)
+
+
+def same_batch(a, b):
+    """Same attributes, and the same crystals back from to_data_list"""
+    return (
+        same_data(a, b)
+        and a.num_graphs == b.num_graphs
+        and all(same_data(x, y) for x, y in zip(a.to_data_list(), b.to_data_list()))
+    )
+
+
+def time_loader(loader, num_batches):
+    samples = 0
+    start = time.perf_counter()
+    for i, batch in enumerate(loader):
+        samples += batch.num_graphs
+        if i + 1 == num_batches:
+            break
+    return samples / (time.perf_counter() - start)
+
+
+def main():
+    args = parse_args()
+    dataset = CrystDataset(
+        name='benchmark',
+        path=args.data_path,
+        force_process=False,
+        prop=args.prop or [],
+        niggli=True,
+        primitive=False,
+        graph_method='crystalnn',
+        preprocess_workers=1,
+        lattice_scale_method=args.lattice_scale_method,
+    )
+    if args.prop is None:
+        dataset.prop = dataset.cached_data.props
+    dataset.prop_scalers = [get_scaler_from_values(dataset.column(p), key=p) for p in dataset.prop]
+    print(f"[INFO] {len(dataset)} crystals, properties {dataset.prop}")
+
+    loaders = {
+        'per item': PyGDataLoader(PerItem(dataset), batch_size=args.batch_size, shuffle=True,
+                                  num_workers=args.num_workers),
+        'batched': DataLoader(dataset, batch_size=args.batch_size, shuffle=True,
+                              num_workers=args.num_workers, collate_fn=collate_batch),
+    }
+    first = [
+        next(iter(PyGDataLoader(PerItem(dataset), batch_size=args.batch_size))),
+        next(iter(DataLoader(dataset, batch_size=args.batch_size, collate_fn=collate_batch))),
+    ]
+    print(f"[INFO] first batches identical: {same_batch(*first)}")
+    round_trip = same_batch(Batch.from_data_list(first[1].to_data_list()), first[1])
+    print(f"[INFO] batch round-trips through to_data_list: {round_trip}")
+    rates = {name: time_loader(loader, args.num_batches) for name, loader in loaders.items()}
+    for name, rate in rates.items():
+        print(f"[TIMING] {name:>8}: {rate:10.0f} samples/s")
+    print(f"[TIMING] speedup {rates['batched'] / rates['per item']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
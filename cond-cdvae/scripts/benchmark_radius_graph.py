@@ -0,0 +1,147 @@
+"""Time and compare the dense and cell-list versions of radius_graph_pbc.
+
+Without the neighbor cap, both graphs are also checked against
+pymatgen's get_neighbor_list, including a thin triclinic cell narrower
+than the cutoff, which needs periodic images beyond the 27 around the cell.
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+from cdvae.common.data_utils import (
+    frac_to_cart_coords,
+    lattice_params_to_matrix_torch,
+    radius_graph_pbc,
+    radius_graph_pbc_cell_list,
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark dense vs cell-list radius_graph_pbc")
+    parser.add_argument('--num_atoms', type=int, nargs='+', default=[50, 200, 1000, 4000],
+                        help="Atoms per cell to time")
+    parser.add_argument('--density', type=float, default=0.085,
+                        help="Atoms per cubic Angstrom, sets the cell size (default: 0.085, metallic)")
+    parser.add_argument('--radius', type=float, default=7.0, help="Cutoff (default: 7, as model.radius)")
+    parser.add_argument('--max_neighbors', type=int, default=20, help="As model.max_neighbors (default: 20)")
+    parser.add_argument('--repeats', type=int, default=3, help="Timed calls per method (default: 3)")
+    parser.add_argument('--max_dense_atoms', type=int, default=2000,
+                        help="Skip the dense version above this size, it needs O(N^2) memory")
+    parser.add_argument('--no_check', action='store_true', help="Skip the comparison with pymatgen")
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+CELL_SHAPES = {
+    # angles, length ratios
+    'cubic': ([90.0, 90.0, 90.0], [1.0, 1.0, 1.0]),
+    'triclinic': ([75.0, 100.0, 110.0], [0.9, 1.0, 1.15]),
+    'thin': ([70.0, 110.0, 65.0], [3.0, 3.0, 0.1]),
+}
+
+
+def random_cell(num_atoms, density, device, shape='cubic'):
+    volume = num_atoms / density
+    angles, ratios = CELL_SHAPES[shape]
+    angles = torch.tensor([angles], device=device)
+    ratios = torch.tensor([ratios], device=device)
+    # scale the lengths to the target volume
+    cosines = torch.cos(torch.deg2rad(angles[0]))
+    shape_factor = torch.sqrt(
+        1 - (cosines ** 2).sum() + 2 * cosines.prod()
+    ) * ratios.prod()
+    lengths = ratios * (volume / shape_factor) ** (1 / 3)
+    num_atoms = torch.tensor([num_atoms], device=device)
+    frac_coords = torch.rand((int(num_atoms.sum()), 3), device=device)
+    cart_coords = frac_to_cart_coords(frac_coords, lengths, angles, num_atoms)
+    return cart_coords, lengths, angles, num_atoms
+
+
+def time_calls(func, args, repeats, device):
+    best = float('inf')
+    for _ in range(repeats):
+        if device != 'cpu':
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        result = func(*args)
+        if device != 'cpu':
+            torch.cuda.synchronize()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def edge_distances(cart_coords, lengths, angles, graph):
+    """Sorted distances of the edges of every atom"""
+    (index2, index1), to_jimages = graph[0].cpu(), graph[1].cpu().double()
+    lattice = lattice_params_to_matrix_torch(lengths, angles)[0].cpu().double()
+    cart_coords = cart_coords.cpu().double()
+    distances = torch.norm(cart_coords[index1] - cart_coords[index2] - to_jimages @ lattice, dim=1)
+    order = np.lexsort((distances.numpy().round(4), index1.numpy()))
+    return index1.numpy()[order], distances.numpy().round(4)[order]
+
+
+def same_graph(a, b, cell):
+    """True, 'ties' when only equidistant neighbors were capped differently, or False"""
+    if all(x.shape == y.shape and torch.equal(x, y) for x, y in zip(a, b)):
+        return 'True'
+    cart_coords, lengths, angles, _ = cell
+    a_atoms, a_dist = edge_distances(cart_coords, lengths, angles, a)
+    b_atoms, b_dist = edge_distances(cart_coords, lengths, angles, b)
+    if np.array_equal(a_atoms, b_atoms) and np.array_equal(a_dist, b_dist):
+        return 'ties'
+    return 'False'
+
+
+def edge_set(graph):
+    (index2, index1), to_jimages = graph[0].cpu(), graph[1].cpu().long()
+    return set(zip(index1.tolist(), index2.tolist(), map(tuple, to_jimages.tolist())))
+
+
+def pymatgen_edges(cell, radius):
+    """All neighbors within radius, by pymatgen"""
+    from pymatgen.core.lattice import Lattice
+    from pymatgen.core.structure import Structure
+
+    cart_coords, lengths, angles, num_atoms = cell
+    lattice = Lattice(lattice_params_to_matrix_torch(lengths, angles)[0].cpu().double().numpy())
+    structure = Structure(
+        lattice, ['H'] * int(num_atoms[0]), cart_coords.cpu().double().numpy(), coords_are_cartesian=True
+    )
+    center, neighbor, images, distances = structure.get_neighbor_list(radius)
+    keep = distances > 0.01  # as radius_graph_pbc, without the atom itself
+    return set(zip(center[keep].tolist(), neighbor[keep].tolist(), map(tuple, images[keep].astype(int).tolist())))
+
+
+def main():
+    args = parse_args()
+    torch.manual_seed(args.seed)
+    print(f"{'atoms':>6} {'cell':>10} {'edges':>8} {'dense':>10} {'cell list':>10} {'speedup':>8} "
+          f"{'identical':>9} {'pymatgen':>8}")
+    for num_atoms in args.num_atoms:
+        for shape in CELL_SHAPES:
+            cell = random_cell(num_atoms, args.density, args.device, shape)
+            graph_args = (*cell, args.radius, args.max_neighbors, args.device)
+            t_cell, graph = time_calls(radius_graph_pbc_cell_list, graph_args, args.repeats, args.device)
+            pymatgen = "-"
+            if num_atoms <= args.max_dense_atoms:
+                t_dense, dense_graph = time_calls(radius_graph_pbc, graph_args, args.repeats, args.device)
+                dense = f"{t_dense:>9.4f}s"
+                speedup = f"{t_dense / t_cell:>7.1f}x"
+                identical = same_graph(dense_graph, graph, cell)
+                if not args.no_check:
+                    uncapped_args = (*cell, args.radius, 0, args.device)
+                    reference = pymatgen_edges(cell, args.radius)
+                    pymatgen = str(
+                        edge_set(radius_graph_pbc(*uncapped_args)) == reference
+                        and edge_set(radius_graph_pbc_cell_list(*uncapped_args)) == reference
+                    )
+            else:
+                dense, speedup, identical = f"{'skipped':>10}", f"{'':>8}", "-"
+            print(f"{num_atoms:>6} {shape:>10} {graph[0].size(1):>8} "
+                  f"{dense} {t_cell:>9.4f}s {speedup} {identical:>9} {pymatgen:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import argparse
 import pickle
 import random
 import re
+import resource
 import time
 from collections import Counter
 from itertools import chain, zip_longest
@@ -11,6 +12,7 @@ from types import SimpleNamespace
 import numpy as np
 import pandas as pd
 import torch
+from cdvae.pl_data.cache import ColumnarCache, is_cache
 from eval_utils import composition2atom_types, load_model
 from pymatgen.core.composition import Composition, Element
 from torch.optim import Adam
@@ -209,6 +211,93 @@ def sample_formula_range(string: str, *, hydride=False):
     return result_string
 
 
+def pack_by_atom_pairs(num_atoms, max_pairs=None, max_size=512):
+    """split structures into batches for Langevin sampling
+
+    Without max_pairs the structures are cut into consecutive batches of
+    max_size. Otherwise they are sorted by atom count (largest first) and
+    packed greedily so that each batch holds at most max_size structures
+    and sum(num_atoms**2) <= max_pairs, the quantity the dense pair
+    tensors of radius_graph_pbc scale with. A structure larger than the
+    budget gets a batch of its own.
+    Returns a list of index arrays.
+    """
+    num_atoms = np.asarray(num_atoms, dtype=np.int64)
+    if max_pairs is None:
+        return np.array_split(np.arange(len(num_atoms)), range(max_size, len(num_atoms), max_size))
+    batches, current, pairs = [], [], 0
+    for idx in np.argsort(-num_atoms, kind="stable"):
+        npairs = int(num_atoms[idx]) ** 2
+        if current and (pairs + npairs > max_pairs or len(current) >= max_size):
+            batches.append(np.array(current))
+            current, pairs = [], 0
+        if npairs > max_pairs:
+            print(f"[WARNING] structure {idx} with {num_atoms[idx]} atoms exceeds max_batch_pairs={max_pairs}")
+        current.append(idx)
+        pairs += npairs
+    if current:
+        batches.append(np.array(current))
+    return batches
+
+
+def reset_memory_high_water(device):
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+
+
+def memory_high_water(device):
+    """peak memory in MB: allocated tensors on cuda since the last reset,
+    otherwise the peak RSS of the process"""
+    if device.type == "cuda":
+        return torch.cuda.max_memory_allocated(device) / 2**20
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def log_batch(batch_idx, nbatches, batch_num_atoms, device, start_time, num_steps=None, graph_builds=None):
+    batch_num_atoms = np.asarray(batch_num_atoms)
+    print(
+        f"[MEM] batch {batch_idx + 1}/{nbatches}: {len(batch_num_atoms)} structures, "
+        f"{batch_num_atoms.sum()} atoms, {int((batch_num_atoms ** 2).sum())} pairs, "
+        f"peak {memory_high_water(device):.0f} MB, {time.time() - start_time:.1f}s"
+    )
+    if num_steps is not None:
+        num_steps = num_steps.float()
+        print(
+            f"[LD] batch {batch_idx + 1}/{nbatches}: Langevin steps per structure "
+            f"mean {num_steps.mean():.0f}, min {num_steps.min():.0f}, max {num_steps.max():.0f}"
+            + (f", {graph_builds} neighbor list builds" if graph_builds is not None else "")
+        )
+
+
+def sample_compositions(num, formula=None, hydride=False, train_data=None):
+    """atom type lists of `num` compositions, sampled from a formula
+    (ranges allowed) or from the compositions of cached training data"""
+    if not (formula is None) ^ (train_data is None):
+        raise Exception("formula and train_data should only specify one")
+    elif formula is not None:
+        return [
+            composition2atom_types(Composition(sample_formula_range(formula, hydride=hydride)))
+            for _ in range(num)
+        ]
+    if is_cache(train_data):
+        atom_types_list = ColumnarCache(train_data).atom_types_list()
+    else:
+        cached_data = pickle.load(open(train_data, 'rb'))
+        atom_types_list = [sample["graph_arrays"][1] for sample in cached_data]
+    comp_counts = dict(
+        Counter(
+            Composition(dict(Counter(atom_types.tolist())))
+            for atom_types in atom_types_list  # [atomic_number list]
+        )
+    )
+    sampled_comps = random.choices(
+        population=list(comp_counts.keys()),
+        weights=list(comp_counts.values()),
+        k=num,
+    )
+    return [composition2atom_types(comp) for comp in sampled_comps]
+
+
 def generation(
     model,
     ld_kwargs,
@@ -219,8 +308,15 @@ def generation(
     formula=None,
     hydride=False,
     train_data=None,
+    max_batch_pairs=None,
     **norm_target_props,
 ):
+    """generate num_batches_to_sample * batch_size structures
+
+    With max_batch_pairs the sampled compositions are regrouped by
+    pack_by_atom_pairs, so small and large cells can be mixed in one run
+    without sizing batch_size for the largest one.
+    """
     all_frac_coords_stack = []
     all_atom_types_stack = []
     frac_coords = []
@@ -229,53 +325,25 @@ def generation(
     lengths = []
     angles = []
 
-    formulabak = formula  # a backup
-    for batch_idx in range(num_batches_to_sample):
-        print(f"generate on batch {batch_idx}/{num_batches_to_sample}")
-        # init args for this batch
-        if not (formulabak is None) ^ (train_data is None):
-            raise Exception("formula and train_data should only specify one")
-        elif formulabak is not None:
-            formula_list = [
-                sample_formula_range(formulabak, hydride=hydride)
-                for _ in range(batch_size)
-            ]
-            sampled_num_atoms = []
-            sampled_atom_types = []
-            for formula in formula_list:
-                comp = Composition(formula)
-                specified_atom_types = torch.tensor(composition2atom_types(comp))
-                sampled_num_atoms.append(len(specified_atom_types))
-                sampled_atom_types.append(specified_atom_types)
-            sampled_num_atoms = torch.tensor(sampled_num_atoms, device=model.device)
-            sampled_atom_types = torch.hstack(sampled_atom_types)
-            sampled_atom_types = sampled_atom_types.to(model.device)
-        elif train_data is not None:  # load cached data
-            cached_data = pickle.load(open(train_data, 'rb'))
-
-            comp_counts = dict(
-                Counter(
-                    Composition(dict(Counter(sample["graph_arrays"][1])))
-                    for sample in cached_data  # [atomic_number list]
-                )
-            )
-            sampled_comps = random.choices(
-                population=list(comp_counts.keys()),
-                weights=list(comp_counts.values()),
-                k=batch_size,
-            )
-            sampled_atom_types = list(
-                chain.from_iterable(
-                    composition2atom_types(comp) for comp in sampled_comps
-                )
-            )
-            sampled_num_atoms = [comp.num_atoms for comp in sampled_comps]
-            sampled_atom_types = torch.tensor(sampled_atom_types, device=model.device)
-            sampled_num_atoms = torch.tensor(sampled_num_atoms, device=model.device)
+    # same random stream as sampling batch by batch
+    compositions = sample_compositions(
+        num_batches_to_sample * batch_size, formula, hydride, train_data
+    )
+    batches = pack_by_atom_pairs(
+        [len(comp) for comp in compositions], max_batch_pairs, batch_size
+    )
+    for batch_idx, batch_indices in enumerate(batches):
+        print(f"generate on batch {batch_idx}/{len(batches)}")
+        start_time = time.time()
+        reset_memory_high_water(model.device)
+        real_batch_size = len(batch_indices)
+        batch_comps = [compositions[i] for i in batch_indices]
+        sampled_num_atoms = torch.tensor([len(comp) for comp in batch_comps], device=model.device)
+        sampled_atom_types = torch.tensor(list(chain.from_iterable(batch_comps)), device=model.device)
         # return `sampled_atom_types` and `sampled_num_atoms`
         conditions = {}
         for k, v in norm_target_props.items():
-            val = [v] * batch_size
+            val = [v] * real_batch_size
             val =torch.tensor(val, device=model.device, dtype=torch.get_default_dtype())
             if val.dim() == 1:
                 val = val.unsqueeze(1)
@@ -287,10 +355,12 @@ def generation(
         batch_all_atom_types = []
         batch_frac_coords, batch_num_atoms, batch_atom_types = [], [], []
         batch_lengths, batch_angles = [], []
+        batch_num_steps = []
+        batch_graph_builds = []
 
         # z & cond z
         c_dict = model.multiemb(conditions)
-        z = torch.randn(batch_size, model.hparams.latent_dim, device=model.device)
+        z = torch.randn(real_batch_size, model.hparams.latent_dim, device=model.device)
         # conditional z
         cond_z = model.zgivenc(z, c_dict)  # z (B, *)
 
@@ -305,6 +375,9 @@ def generation(
             batch_atom_types.append(samples['atom_types'].detach().cpu())
             batch_lengths.append(samples['lengths'].detach().cpu())
             batch_angles.append(samples['angles'].detach().cpu())
+            batch_num_steps.append(samples['num_steps'].detach().cpu())
+            if samples['graph_builds'] is not None:
+                batch_graph_builds.append(samples['graph_builds'])
             if ld_kwargs.save_traj:
                 batch_all_frac_coords.append(
                     samples['all_frac_coords'][::down_sample_traj_step].detach().cpu()
@@ -322,6 +395,10 @@ def generation(
         if ld_kwargs.save_traj:
             all_frac_coords_stack.append(torch.stack(batch_all_frac_coords, dim=0))
             all_atom_types_stack.append(torch.stack(batch_all_atom_types, dim=0))
+        log_batch(
+            batch_idx, len(batches), sampled_num_atoms.cpu().numpy(), model.device, start_time,
+            torch.stack(batch_num_steps), sum(batch_graph_builds) if batch_graph_builds else None,
+        )
 
     frac_coords = torch.cat(frac_coords, dim=1)
     num_atoms = torch.cat(num_atoms, dim=1)
@@ -342,6 +419,53 @@ def generation(
     )
 
 
+def build_target_conditions(model, target_dict, prop_scalers=None, verbose=True):
+    """conditions of one batch of target rows
+
+    target_dict maps column names to per-row value lists and must contain
+    `formula`; columns in prop_scalers are normalized from absolute values.
+    Returns (conditions, sampled_num_atoms, sampled_atom_types).
+    """
+    prop_scalers = prop_scalers or {}
+    conditions = {}
+    for key, val_list in target_dict.items():
+        if key == "formula":
+            sampled_num_atoms = [None] * len(val_list)
+            sampled_atom_types = [None] * len(val_list)
+            for j, formula in enumerate(val_list):
+                comp = Composition(formula)
+                specified_atom_types = torch.tensor(composition2atom_types(comp))
+                sampled_num_atoms[j] = len(specified_atom_types)
+                sampled_atom_types[j] = specified_atom_types
+            sampled_num_atoms = torch.tensor(sampled_num_atoms, device=model.device)
+            sampled_atom_types = torch.hstack(sampled_atom_types)
+            sampled_atom_types = sampled_atom_types.to(model.device)
+            conditions["composition"] = (sampled_atom_types, sampled_num_atoms)
+            if verbose:
+                print("Add key composition")
+        else:
+            if key in prop_scalers:
+                scaler = prop_scalers[key]
+                val_list = [
+                    (val - scaler.means.item()) / scaler.stds.item()
+                    for val in val_list
+                ]
+            try:
+                cond_value = torch.tensor(
+                    [parse_vector(val) for val in val_list],
+                    device=model.device,
+                    dtype=torch.get_default_dtype()
+                ).view(len(val_list), -1)
+            except Exception:
+                if verbose:
+                    print(f"Key {key} failed to build target, skip")
+            else:
+                conditions[key] = cond_value
+                if verbose:
+                    print(f"Add key {key}")
+    return conditions, sampled_num_atoms, sampled_atom_types
+
+
 def target_generation(
     model,
     ld_kwargs,
@@ -350,7 +474,22 @@ def target_generation(
     target_file: str,
     batch_size=512,
     down_sample_traj_step=1,
+    prop_scalers=None,
+    default_props=None,
+    max_batch_pairs=None,
 ):
+    """generate structures for each row of a target csv/parquet file
+
+    Columns: `formula` and the condition values of each row, e.g. `pressure`
+    or `element_values` (a "v1,v2,..." vector per row). Optional
+    `material_id` and `label` columns are returned as lists in the order of
+    the generated samples.
+
+    prop_scalers maps condition names to scalers; those columns hold absolute
+    values and are normalized like the 'gen' task does. default_props gives
+    condition values for keys missing from the file, shared by all rows.
+    max_batch_pairs groups rows by atom count, see pack_by_atom_pairs.
+    """
     all_frac_coords_stack = []
     all_atom_types_stack = []
     frac_coords = []
@@ -359,6 +498,9 @@ def target_generation(
     lengths = []
     angles = []
     material_id_list = []
+    label_list = []
+    prop_scalers = prop_scalers or {}
+    default_props = default_props or {}
 
     target_file = Path(target_file)
     if not target_file.is_absolute():
@@ -367,18 +509,26 @@ def target_generation(
         raise FileNotFoundError(f"{target_file}")
     elif target_file.suffix == ".csv":
         target_df = pd.read_csv(target_file)
+    elif target_file.suffix == ".parquet":
+        target_df = pd.read_parquet(target_file)
     else:
-        raise FileExistsError("target_file must be a csv")
+        raise FileExistsError("target_file must be a csv or parquet")
 
     for key in ["formula", "pressure"]:
         if key not in target_df.columns:
             raise ValueError(f"{key} must be in target csv file")
 
-    groups = pd.Index(range(len(target_df))) // batch_size
-    nbatches = np.ceil(len(target_df) / batch_size)
+    row_num_atoms = np.zeros(len(target_df), dtype=int)
+    if max_batch_pairs is not None:
+        row_num_atoms = [int(Composition(formula).num_atoms) for formula in target_df["formula"]]
+    batches = pack_by_atom_pairs(row_num_atoms, max_batch_pairs, batch_size)
+    nbatches = len(batches)
     for repeat_idx in range(num_batches_to_samples):
-        for batch_idx, batch_df in target_df.groupby(groups):
+        for batch_idx, batch_indices in enumerate(batches):
             print(f"generate on {repeat_idx=}/{num_batches_to_samples} , {batch_idx=}/{nbatches}")
+            start_time = time.time()
+            reset_memory_high_water(model.device)
+            batch_df = target_df.iloc[batch_indices]
             real_batch_size = len(batch_df)
             target_dict = batch_df.to_dict("list")
 
@@ -386,39 +536,26 @@ def target_generation(
             if batch_material_id is not None:
                 batch_material_id = batch_material_id * num_samples_per_z
                 material_id_list += batch_material_id
-
-            conditions = {}
-            for key, val_list in target_dict.items():
-                if key == "formula":
-                    sampled_num_atoms = [None] * len(val_list)
-                    sampled_atom_types = [None] * len(val_list)
-                    for j, formula in enumerate(val_list):
-                        comp = Composition(formula)
-                        specified_atom_types = torch.tensor(composition2atom_types(comp))
-                        sampled_num_atoms[j] = len(specified_atom_types)
-                        sampled_atom_types[j] = specified_atom_types
-                    sampled_num_atoms = torch.tensor(sampled_num_atoms, device=model.device)
-                    sampled_atom_types = torch.hstack(sampled_atom_types)
-                    sampled_atom_types = sampled_atom_types.to(model.device)
-                    conditions["composition"] = (sampled_atom_types, sampled_num_atoms)
-                    print("Add key composition")
-                else:
-                    try:
-                        cond_value = torch.tensor(
-                            val_list,
-                            device=model.device,
-                            dtype=torch.get_default_dtype()
-                        ).view(-1, 1)
-                    except Exception:
-                        print(f"Key {key} failed to build target, skip")
-                    else:
-                        conditions[key] = cond_value
-                        print(f"Add key {key}")
+            batch_label = target_dict.pop("label", None)
+            if batch_label is not None:
+                # one entry per structure along dim 1 of the outputs; the
+                # num_samples_per_z evaluations are stacked along dim 0
+                label_list += [str(label) for label in batch_label]
+
+            for key, val in default_props.items():
+                if key not in target_dict:
+                    target_dict[key] = [val] * real_batch_size
+
+            conditions, sampled_num_atoms, sampled_atom_types = build_target_conditions(
+                model, target_dict, prop_scalers
+            )
 
             batch_all_frac_coords = []
             batch_all_atom_types = []
             batch_frac_coords, batch_num_atoms, batch_atom_types = [], [], []
             batch_lengths, batch_angles = [], []
+            batch_num_steps = []
+            batch_graph_builds = []
 
             # z & cond z
             c_dict = model.multiemb(conditions)
@@ -437,6 +574,9 @@ def target_generation(
                 batch_atom_types.append(samples['atom_types'].detach().cpu())
                 batch_lengths.append(samples['lengths'].detach().cpu())
                 batch_angles.append(samples['angles'].detach().cpu())
+                batch_num_steps.append(samples['num_steps'].detach().cpu())
+                if samples['graph_builds'] is not None:
+                    batch_graph_builds.append(samples['graph_builds'])
                 if ld_kwargs.save_traj:
                     batch_all_frac_coords.append(
                         samples['all_frac_coords'][::down_sample_traj_step].detach().cpu()
@@ -454,6 +594,10 @@ def target_generation(
             if ld_kwargs.save_traj:
                 all_frac_coords_stack.append(torch.stack(batch_all_frac_coords, dim=0))
                 all_atom_types_stack.append(torch.stack(batch_all_atom_types, dim=0))
+            log_batch(
+                batch_idx, nbatches, sampled_num_atoms.cpu().numpy(), model.device, start_time,
+                torch.stack(batch_num_steps), sum(batch_graph_builds) if batch_graph_builds else None,
+            )
 
     frac_coords = torch.cat(frac_coords, dim=1)
     num_atoms = torch.cat(num_atoms, dim=1)
@@ -472,8 +616,48 @@ def target_generation(
         all_frac_coords_stack,
         all_atom_types_stack,
         material_id_list,
+        label_list,
     )
 
+
+def parse_vector(val):
+    """"1.0,2.0" / "[1.0, 2.0]" / list -> list of float, scalars unchanged"""
+    if isinstance(val, str):
+        return [float(v) for v in val.strip("[] ").split(",") if v.strip()]
+    if isinstance(val, (list, tuple, np.ndarray)):
+        return [float(v) for v in val]
+    return val
+
+
+def split_by_label(label_list, frac_coords, num_atoms, atom_types, lengths, angles,
+                   all_frac_coords_stack, all_atom_types_stack):
+    """split generated samples into one dict per label, samples in the same
+    layout as the 'gen' task output (num_evals, samples, ...)"""
+    atom_end = torch.cumsum(num_atoms[0], dim=0)
+    atom_start = atom_end - num_atoms[0]
+    labels = np.array(label_list)
+    outputs = {}
+    for label in dict.fromkeys(label_list):
+        idx = torch.as_tensor(np.flatnonzero(labels == label))
+        atom_idx = torch.cat(
+            [torch.arange(atom_start[i], atom_end[i]) for i in idx.tolist()]
+        )
+        out = {
+            'frac_coords': frac_coords[:, atom_idx],
+            'num_atoms': num_atoms[:, idx],
+            'atom_types': atom_types[:, atom_idx],
+            'lengths': lengths[:, idx],
+            'angles': angles[:, idx],
+            'all_frac_coords_stack': [],
+            'all_atom_types_stack': [],
+        }
+        if len(all_frac_coords_stack):
+            out['all_frac_coords_stack'] = all_frac_coords_stack[:, :, atom_idx]
+            out['all_atom_types_stack'] = all_atom_types_stack[:, :, atom_idx]
+        outputs[label] = out
+    return outputs
+
+
 def optimization(
     model,
     ld_kwargs,
@@ -544,8 +728,16 @@ def main(args):
         min_sigma=args.min_sigma,
         save_traj=args.save_traj,
         disable_bar=args.disable_bar,
+        n_step_min=args.n_step_min,
+        adaptive=args.adaptive_ld,
+        conv_tol=args.conv_tol,
+        conv_patience=args.conv_patience,
+        verlet_skin=args.verlet_skin,
     )
 
+    if args.graph_method is not None:
+        model.decoder.gemnet.graph_method = args.graph_method
+
     if torch.cuda.is_available():
         model.to('cuda')
 
@@ -612,6 +804,7 @@ def main(args):
             args.formula,
             args.hydride,
             args.train_data,
+            args.max_batch_pairs,
             **{
                 'energy_per_atom': args.energy_per_atom,
                 'energy': args.energy,
@@ -660,6 +853,7 @@ def main(args):
             all_frac_coords_stack,
             all_atom_types_stack,
             material_id_list,
+            _,
         ) = target_generation(
             model=model,
             ld_kwargs=ld_kwargs,
@@ -668,6 +862,7 @@ def main(args):
             target_file=args.target_file,
             batch_size=args.batch_size,
             down_sample_traj_step=args.down_sample_traj_step,
+            max_batch_pairs=args.max_batch_pairs,
         )
 
         if args.label == '':
@@ -695,6 +890,63 @@ def main(args):
             model_path / gen_out_name,
         )
 
+    if "batch" in args.tasks:
+        print('Evaluate model on the batched multi-condition generation task.')
+        start_time = time.time()
+
+        (
+            frac_coords,
+            num_atoms,
+            atom_types,
+            lengths,
+            angles,
+            all_frac_coords_stack,
+            all_atom_types_stack,
+            _,
+            label_list,
+        ) = target_generation(
+            model=model,
+            ld_kwargs=ld_kwargs,
+            num_samples_per_z=args.num_evals,
+            num_batches_to_samples=args.num_batches_to_samples,
+            target_file=args.target_file,
+            batch_size=args.batch_size,
+            down_sample_traj_step=args.down_sample_traj_step,
+            max_batch_pairs=args.max_batch_pairs,
+            # absolute values as in task 'gen'
+            prop_scalers={
+                key: scaler
+                for key, scaler in zip(cfg.data.prop, prop_scalers)
+                if key in ("pressure", "spgno")
+            },
+            default_props={
+                'energy_per_atom': args.energy_per_atom,
+                'energy': args.energy,
+                'enthalpy_per_atom': args.enthalpy_per_atom,
+                'enthalpy': args.enthalpy,
+                'pressure': args.pressure,
+                'spgno': args.spgno,
+            },
+        )
+        if not label_list:
+            raise ValueError("task 'batch' needs a label column in target_file")
+
+        elapsed = time.time() - start_time
+        per_label = split_by_label(
+            label_list, frac_coords, num_atoms, atom_types, lengths, angles,
+            all_frac_coords_stack, all_atom_types_stack,
+        )
+        for label, out in per_label.items():
+            gen_out_name = f'eval_gen_{label}.pt'
+            i = 1
+            while Path(model_path / gen_out_name).exists():
+                gen_out_name = Path(gen_out_name).stem + f".pt{i}"
+                i += 1
+            out['eval_setting'] = args
+            out['time'] = elapsed / len(per_label)
+            torch.save(out, model_path / gen_out_name)
+        print(f"Saved {len(per_label)} labels to {model_path}")
+
     if 'opt' in args.tasks:
         print("Unable to do 'opt', skip")
         # print('Evaluate model on the property optimization task.')
@@ -722,20 +974,36 @@ if __name__ == '__main__':
     parser.add_argument('--n_step_each', default=100, type=int)
     parser.add_argument('--step_lr', default=1e-4, type=float)
     parser.add_argument('--min_sigma', default=0, type=float)
+    parser.add_argument('--n_step_min', default=None, type=int,
+                        help="steps at the highest sigma level, growing linearly to n_step_each at the lowest")
+    parser.add_argument('--adaptive_ld', action='store_true',
+                        help="drop converged crystals from the batch for the rest of each sigma level")
+    parser.add_argument('--conv_tol', default=1e-3, type=float,
+                        help="RMS drift per step (Angstrom) below which a crystal counts as converged")
+    parser.add_argument('--conv_patience', default=5, type=int,
+                        help="consecutive converged steps before a crystal leaves the batch")
+    parser.add_argument('--verlet_skin', default=0, type=float,
+                        help="reuse decoder neighbor lists until an atom moved verlet_skin/2 Angstrom; 0 rebuilds every step")
+    parser.add_argument('--graph_method', choices=['dense', 'cell_list'],
+                        help="neighbor search of the decoder, overrides decoder.graph_method of the model config")
     parser.add_argument('--save_traj', default=False, type=bool)
     parser.add_argument('--disable_bar', default=False, type=bool)
     parser.add_argument('--num_evals', default=1, type=int)
     parser.add_argument('--num_batches_to_samples', default=20, type=int)
     parser.add_argument('--start_from', default='data', type=str)
     parser.add_argument('--batch_size', default=500, type=int)
+    parser.add_argument('--max_batch_pairs', default=None, type=int,
+                        help="pack structures by atom count so that sum(num_atoms**2) of a batch stays "
+                        "below this budget; batch_size still caps the structures per batch")
     parser.add_argument('--force_num_atoms', action='store_true')
     parser.add_argument('--force_atom_types', action='store_true')
     parser.add_argument('--down_sample_traj_step', default=10, type=int)
     parser.add_argument('--label', default='')
     parser.add_argument('--formula', help="formula to generate, range is acceptable")
     parser.add_argument('--hydride', action="store_true", help="generate hydride, formula be like (H3-6M0-3M0-3M0-3)1-4")
-    parser.add_argument('--train_data', help="sample from trn_cached_data(pkl)")
-    parser.add_argument('--target_file', default="target.csv", help="target csv file for task 'target'")
+    parser.add_argument('--train_data', help="sample from trn_cached_data (train.cache or pkl)")
+    parser.add_argument('--target_file', default="target.csv",
+                        help="target csv/parquet file for tasks 'target' and 'batch'")
     parser.add_argument(
         '--placeholder',
         help="The above are relative target to std value."
@@ -0,0 +1,163 @@
+"""Client of gen_server.py.
+
+Only needs the standard library (plus ase to write structures), so
+orchestration scripts can request structures from a resident model without
+importing torch or loading a checkpoint themselves.
+"""
+import argparse
+import json
+import socket
+from pathlib import Path
+
+DEFAULT_ADDRESS = "/tmp/cdvae_gen.sock"
+
+
+def parse_address(address):
+    """'host:port' -> TCP, anything else is a Unix socket path"""
+    address = str(address)
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    return socket.AF_UNIX, address
+
+
+def _to_json(obj):
+    if hasattr(obj, "item"):  # numpy scalars from pandas rows
+        return obj.item()
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"{type(obj)} is not JSON serializable")
+
+
+class GenerationClient:
+    """Line-delimited JSON connection to a running gen_server.py
+
+    Each request is a dict with `label`, `formula`, optional `num_samples`
+    (default 1) and condition values such as `pressure` (absolute, as in
+    evaluate.py --tasks gen) or `element_values`. Structures are streamed
+    back as soon as their mini-batch finishes.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=None):
+        family, addr = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(addr)
+        self.rfile = self.sock.makefile("r", encoding="utf-8")
+        self.wfile = self.sock.makefile("w", encoding="utf-8")
+
+    def _send(self, obj):
+        self.wfile.write(json.dumps(obj, default=_to_json) + "\n")
+
+    def _receive(self):
+        line = self.rfile.readline()
+        if not line:
+            raise ConnectionError("generation server closed the connection")
+        return json.loads(line)
+
+    def ping(self):
+        self._send({"command": "ping"})
+        self.wfile.flush()
+        return self._receive()
+
+    def generate(self, requests):
+        """Send all requests and yield the server replies:
+
+        {"id", "label", "index", "atom_types", "frac_coords", "lengths", "angles"}
+            one generated structure
+        {"id", "label", "done": true, "count"}
+            all structures of a request were sent
+        {"id", "label", "error"}
+            the request failed
+        """
+        pending = set()
+        for i, request in enumerate(requests):
+            request = dict(request, id=i)
+            pending.add(i)
+            self._send(request)
+        self.wfile.flush()
+        while pending:
+            reply = self._receive()
+            if reply.get("done") or "error" in reply:
+                pending.discard(reply["id"])
+            yield reply
+
+    def close(self):
+        for f in (self.rfile, self.wfile):
+            try:
+                f.close()
+            except OSError:
+                pass
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_vasp(structure, path):
+    """Write one streamed structure like extract_gen.py does"""
+    from ase import Atoms
+    from ase.io import write
+
+    atoms = Atoms(
+        structure["atom_types"],
+        scaled_positions=structure["frac_coords"],
+        cell=list(structure["lengths"]) + list(structure["angles"]),
+    )
+    write(str(path), atoms, format="vasp", direct=True)
+
+
+def generate_to_files(address, requests, path_for):
+    """Request structures and write structure `index` of `label` to
+    path_for(label, index). Returns (structures written, labels that failed)."""
+    written, failed = 0, []
+    with GenerationClient(address) as client:
+        for reply in client.generate(requests):
+            if "error" in reply:
+                print(f"[ERROR] {reply['label']}: {reply['error']}")
+                failed.append(reply["label"])
+            elif not reply.get("done"):
+                path = Path(path_for(reply["label"], reply["index"]))
+                path.parent.mkdir(parents=True, exist_ok=True)
+                write_vasp(reply, path)
+                written += 1
+    return written, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Request structures from a running gen_server.py")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, help="Unix socket path or host:port of the server")
+    parser.add_argument("--ping", action="store_true", help="Only check that the server is up")
+    parser.add_argument("--target_file", help="csv/parquet with label, formula and condition columns")
+    parser.add_argument("--num_samples", type=int, default=1, help="Structures per row")
+    parser.add_argument("--output_dir", default=".",
+                        help="Structures go to OUTPUT_DIR/eval_gen_<label>/gen/<i>.vasp")
+    args = parser.parse_args()
+
+    if args.ping:
+        with GenerationClient(args.address) as client:
+            print(client.ping())
+        return
+
+    import pandas as pd
+
+    target_file = Path(args.target_file)
+    if target_file.suffix == ".parquet":
+        target_df = pd.read_parquet(target_file)
+    else:
+        target_df = pd.read_csv(target_file)
+    requests = [dict(row, num_samples=args.num_samples) for row in target_df.to_dict("records")]
+    output_dir = Path(args.output_dir)
+    written, failed = generate_to_files(
+        args.address, requests, lambda label, i: output_dir / f"eval_gen_{label}" / "gen" / f"{i}.vasp"
+    )
+    print(f"[INFO] Wrote {written} structures for {len(requests) - len(failed)} labels to {output_dir}")
+    if failed:
+        print(f"[WARNING] {len(failed)} labels failed: {failed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""Generation daemon: load a CDVAE once and serve generation requests.
+
+Clients (gen_client.py) send line-delimited JSON requests over a Unix socket
+or localhost TCP. Every requested structure becomes one row in a queue; a
+single worker thread coalesces queued rows with the same condition keys into
+mini-batches bounded by total atom count and runs them through
+`CDVAE.langevin_dynamics`. Structures are streamed back to the requesting
+connection as soon as their batch finishes.
+"""
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+import traceback
+from pathlib import Path
+from types import SimpleNamespace
+
+import torch
+from eval_utils import load_model
+from evaluate import build_target_conditions
+from gen_client import DEFAULT_ADDRESS, parse_address
+from pymatgen.core.composition import Composition
+
+# request fields that are not model conditions
+META_KEYS = ("id", "label", "num_samples", "command", "material_id", "cif_file")
+
+
+class Job:
+    """One client request: num_samples rows that share a reply channel"""
+
+    def __init__(self, connection, request):
+        self.connection = connection
+        self.id = request.get("id")
+        self.label = str(request.get("label", self.id))
+        self.total = int(request.get("num_samples", 1))
+        self.remaining = self.total
+        self.failed = False
+
+    def reply(self, obj):
+        self.connection.send(dict(obj, id=self.id, label=self.label))
+
+
+class Row:
+    def __init__(self, job, index, values, num_atoms):
+        self.job = job
+        self.index = index
+        self.values = values
+        self.num_atoms = num_atoms
+        self.keys = tuple(sorted(values))
+
+
+class GenerationServer:
+    def __init__(self, model_path, ld_kwargs, max_batch_atoms=4096, max_batch_size=256, max_wait=0.05):
+        self.model, _, cfg = load_model(Path(model_path))
+        if torch.cuda.is_available():
+            self.model.to("cuda")
+        self.model.eval()
+        self.model_path = str(model_path)
+        self.ld_kwargs = ld_kwargs
+        self.max_batch_atoms = max_batch_atoms
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        # absolute values as in `evaluate.py --tasks gen`
+        self.prop_scalers = {
+            key: scaler
+            for key, scaler in zip(cfg.data.prop, self.model.prop_scalers)
+            if key in ("pressure", "spgno")
+        }
+        self.default_props = {
+            'energy_per_atom': -1.0,
+            'energy': -1.0,
+            'enthalpy_per_atom': -1.0,
+            'enthalpy': -1.0,
+            'pressure': 0.0,
+            'spgno': 1,
+        }
+        self.rows = queue.Queue()
+        self.generated = 0
+        self.batches = 0
+
+    def submit(self, connection, request):
+        job = Job(connection, request)
+        values = {k: v for k, v in request.items() if k not in META_KEYS}
+        for key, val in self.default_props.items():
+            values.setdefault(key, val)
+        try:
+            num_atoms = int(Composition(values["formula"]).num_atoms)
+        except Exception as e:
+            job.reply({"error": f"bad formula: {e}"})
+            return job
+        if job.remaining <= 0:
+            job.reply({"done": True, "count": 0})
+            return job
+        connection.add_pending(job.remaining)
+        for index in range(job.remaining):
+            self.rows.put(Row(job, index, values, num_atoms))
+        return job
+
+    def next_batch(self, carry):
+        """Rows for the next mini-batch and the row that did not fit"""
+        first = carry if carry is not None else self.rows.get()
+        batch, atoms = [first], first.num_atoms
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                row = self.rows.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if row.keys != first.keys or atoms + row.num_atoms > self.max_batch_atoms:
+                return batch, row
+            batch.append(row)
+            atoms += row.num_atoms
+        return batch, None
+
+    def generate(self, batch):
+        target_dict = {key: [row.values[key] for row in batch] for key in batch[0].keys}
+        with torch.no_grad():
+            conditions, num_atoms, atom_types = build_target_conditions(
+                self.model, target_dict, self.prop_scalers, verbose=False
+            )
+            c_dict = self.model.multiemb(conditions)
+            z = torch.randn(len(batch), self.model.hparams.latent_dim, device=self.model.device)
+            cond_z = self.model.zgivenc(z, c_dict)
+            samples = self.model.langevin_dynamics(cond_z, self.ld_kwargs, num_atoms, atom_types)
+
+        frac_coords = samples['frac_coords'].detach().cpu()
+        atom_types = samples['atom_types'].detach().cpu()
+        lengths = samples['lengths'].detach().cpu()
+        angles = samples['angles'].detach().cpu()
+        ends = torch.cumsum(samples['num_atoms'].detach().cpu(), dim=0).tolist()
+        start = 0
+        for i, (row, end) in enumerate(zip(batch, ends)):
+            row.job.reply({
+                "index": row.index,
+                "atom_types": atom_types[start:end].tolist(),
+                "frac_coords": frac_coords[start:end].tolist(),
+                "lengths": lengths[i].tolist(),
+                "angles": angles[i].tolist(),
+            })
+            start = end
+
+    def finish(self, batch, error=None):
+        for row in batch:
+            job = row.job
+            job.remaining -= 1
+            if error is not None and not job.failed:
+                job.failed = True
+                job.reply({"error": error})
+            elif job.remaining == 0 and not job.failed:
+                job.reply({"done": True, "count": job.total})
+            job.connection.done_pending(1)
+
+    def run_batch(self, batch):
+        try:
+            self.generate(batch)
+        except Exception as e:
+            traceback.print_exc()
+            error = repr(e)
+        else:
+            self.finish(batch)
+            return
+        jobs = list(dict.fromkeys(row.job for row in batch))
+        if len(jobs) == 1:
+            self.finish(batch, error=error)
+            return
+        # only fail the request that broke the batch
+        for job in jobs:
+            self.run_batch([row for row in batch if row.job is job])
+
+    def worker(self):
+        carry = None
+        while True:
+            batch, carry = self.next_batch(carry)
+            # rows of failed requests or closed connections are skipped
+            self.finish([row for row in batch if row.job.failed or not row.job.connection.alive])
+            batch = [row for row in batch if not row.job.failed and row.job.connection.alive]
+            if not batch:
+                continue
+            start = time.time()
+            self.run_batch(batch)
+            self.batches += 1
+            self.generated += len(batch)
+            print(f"[GEN] batch {self.batches}: {len(batch)} structures, "
+                  f"{sum(row.num_atoms for row in batch)} atoms in {time.time() - start:.1f}s "
+                  f"({self.rows.qsize()} queued)", flush=True)
+
+
+class Connection:
+    """Reply channel of one client connection; replies may come from the worker thread"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.idle = threading.Condition(self.lock)
+        self.alive = True
+
+    def send(self, obj):
+        with self.lock:
+            if not self.alive:
+                return
+            try:
+                self.wfile.write((json.dumps(obj) + "\n").encode())
+                self.wfile.flush()
+            except OSError:
+                self.alive = False
+
+    def add_pending(self, n):
+        with self.lock:
+            self.pending += n
+
+    def done_pending(self, n):
+        with self.lock:
+            self.pending -= n
+            if self.pending <= 0:
+                self.idle.notify_all()
+
+    def wait_idle(self):
+        with self.lock:
+            while self.pending > 0 and self.alive:
+                self.idle.wait(timeout=1.0)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server.generation
+        connection = Connection(self.wfile)
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                connection.send({"error": f"bad request: {e}"})
+                continue
+            command = request.get("command")
+            if command == "ping":
+                connection.send({
+                    "ok": True,
+                    "model_path": server.model_path,
+                    "queued": server.rows.qsize(),
+                    "generated": server.generated,
+                })
+            elif command == "shutdown":
+                connection.send({"ok": True})
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+            else:
+                server.submit(connection, request)
+        # keep the connection open until its structures are sent
+        connection.wait_idle()
+        connection.alive = False
+
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(generation, address):
+    family, addr = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(addr):
+            os.remove(addr)
+        server = ThreadingUnixServer(addr, RequestHandler)
+    else:
+        server = ThreadingTCPServer(addr, RequestHandler)
+    server.generation = generation
+    threading.Thread(target=generation.worker, daemon=True).start()
+    print(f"[INFO] Serving {generation.model_path} on {address}", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if family == socket.AF_UNIX and os.path.exists(addr):
+            os.remove(addr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep a CDVAE model loaded and serve generation requests")
+    parser.add_argument('--model_path', required=True)
+    parser.add_argument('--address', default=DEFAULT_ADDRESS, help="Unix socket path or host:port")
+    parser.add_argument('--max_batch_atoms', default=4096, type=int,
+                        help="upper bound on the total atoms of one mini-batch")
+    parser.add_argument('--max_batch_size', default=256, type=int, help="upper bound on structures per mini-batch")
+    parser.add_argument('--max_wait', default=0.05, type=float,
+                        help="seconds to wait for more requests before starting a batch")
+    parser.add_argument('--n_step_each', default=100, type=int)
+    parser.add_argument('--step_lr', default=1e-4, type=float)
+    parser.add_argument('--min_sigma', default=0, type=float)
+    parser.add_argument('--n_step_min', default=None, type=int)
+    parser.add_argument('--adaptive_ld', action='store_true')
+    parser.add_argument('--conv_tol', default=1e-3, type=float)
+    parser.add_argument('--conv_patience', default=5, type=int)
+    parser.add_argument('--verlet_skin', default=0, type=float)
+    parser.add_argument('--graph_method', choices=['dense', 'cell_list'])
+    args = parser.parse_args()
+
+    ld_kwargs = SimpleNamespace(
+        n_step_each=args.n_step_each,
+        step_lr=args.step_lr,
+        min_sigma=args.min_sigma,
+        save_traj=False,
+        disable_bar=True,
+        n_step_min=args.n_step_min,
+        adaptive=args.adaptive_ld,
+        conv_tol=args.conv_tol,
+        conv_patience=args.conv_patience,
+        verlet_skin=args.verlet_skin,
+    )
+    generation = GenerationServer(
+        Path(args.model_path).resolve(), ld_kwargs,
+        max_batch_atoms=args.max_batch_atoms,
+        max_batch_size=args.max_batch_size,
+        max_wait=args.max_wait,
+    )
+    if args.graph_method is not None:
+        generation.model.decoder.gemnet.graph_method = args.graph_method
+    serve(generation, args.address)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,9 +4,10 @@ from types import SimpleNamespace
 
 import click
 import torch
+from cdvae.pl_data.dataset import collate_batch
 from eval_utils import load_custom_dataset, load_model
 from evaluate import reconstruction
-from torch_geometric.loader import DataLoader
+from torch.utils.data import DataLoader
 
 
 def custom_reconstruction(
@@ -45,7 +46,7 @@ def main(model_path, data_path, batch_size, label=""):
     model, _, cfg = load_model(model_path)
     custom_dataset = load_custom_dataset(model_path, data_path)
 
-    loader = DataLoader(custom_dataset, batch_size)
+    loader = DataLoader(custom_dataset, batch_size, collate_fn=collate_batch)
     start_time = time.time()
     (
         frac_coords,
@@ -1,7 +1,22 @@
-import random
 import argparse
 import os
 import shutil
+import sys
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent / "prepare_dataset"))
+from compute_pdm import descriptors_to_frame
+from pdm_kernels import FixedLatticeSRO
+from poscar_io import StructureBatch, read_poscar_arrays
+from structure_archive import StructureArchive
+
+# Structures generated per permutation chunk.
+ARCHIVE_CHUNK = 1000
+
+
 def extract_composition_string(file_path):
     with open(file_path, 'r') as f:
         lines = f.readlines()
@@ -16,38 +31,132 @@ def extract_composition_string(file_path):
     ]
     return "_".join(composition_parts)
 
-def shuffle_poscar_lines(file_path, num_files, out_dir,output_name):
+def find_coordinate_line_index(lines):
+    for i, line in enumerate(lines):
+        if "Direct" in line or "Cartesian" in line:
+            return i
+    raise ValueError("Error: 'Direct' or 'Cartesian' not found in the file.")
+
+def _permutation_chunk(task):
+    start, stop, num_atoms, seed_seq = task
+    rng = np.random.default_rng(seed_seq)
+    return start, rng.permuted(np.tile(np.arange(num_atoms), (stop - start, 1)), axis=1)
+
+def _chunk_tasks(num_files, num_atoms, seed, chunk_size):
+    starts = list(range(0, num_files, chunk_size))
+    children = np.random.SeedSequence(seed).spawn(len(starts))
+    return [(start, min(start + chunk_size, num_files), num_atoms, child)
+            for start, child in zip(starts, children)]
+
+def _run_chunks(func, tasks, n_jobs, initializer=None, initargs=()):
+    if n_jobs == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        yield from map(func, tasks)
+    else:
+        with Pool(n_jobs, initializer, initargs) as pool:
+            yield from pool.imap(func, tasks)
+
+def permutation_chunks(num_files, num_atoms, seed=None, chunk_size=ARCHIVE_CHUNK, n_jobs=1):
+    """
+    Yield (start, perms) in order, perms being a (chunk, num_atoms) array of
+    atom orders for structures start, start + 1, ...  Chunk k draws from the
+    k-th child of SeedSequence(seed), so a given seed produces the same
+    structures whatever n_jobs is.
+    """
+    yield from _run_chunks(_permutation_chunk, _chunk_tasks(num_files, num_atoms, seed, chunk_size), n_jobs)
+
+def iter_shuffled_batches(file_path, num_files, seed=None, chunk_size=ARCHIVE_CHUNK, n_jobs=1):
+    """
+    Yield the shuffled structures as StructureBatch chunks built directly from
+    the permutation arrays; the template is parsed once and nothing is written
+    to disk.
+    """
+    composition_str = extract_composition_string(file_path)
+    element_types, element_counts, frac, coords, lattice = read_poscar_arrays(file_path)
+    template = StructureBatch.from_arrays(["template"], [(element_types, element_counts, frac, coords, lattice)])
+    num_atoms = len(frac)
+
+    for start, perms in permutation_chunks(num_files, num_atoms, seed, chunk_size, n_jobs):
+        m = len(perms)
+        yield StructureBatch(
+            [f"POSCAR-{composition_str}-{n+1}" for n in range(start, start + m)],
+            template.symbols,
+            np.broadcast_to(lattice, (m, 3, 3)),
+            frac[perms].reshape(-1, 3),
+            coords[perms].reshape(-1, 3),
+            np.tile(template.species, m),
+            np.arange(m + 1) * num_atoms,
+        )
+
+def shuffle_poscar_lines(file_path, num_files, out_dir, output_name, seed=None, n_jobs=1):
     poscar_dir = os.path.join(out_dir,output_name)
     if os.path.exists(poscar_dir):
         shutil.rmtree(poscar_dir)
     os.makedirs(poscar_dir)
 
     composition_str = extract_composition_string(file_path)
+    with open(file_path, 'r') as file:
+        lines = file.readlines()
+    direct_index = find_coordinate_line_index(lines)
+    num_atoms = sum(int(c) for c in lines[6].split())
+    header = lines[:direct_index + 1]
+    atom_lines = lines[direct_index + 1:direct_index + 1 + num_atoms]
+    tail = lines[direct_index + 1 + num_atoms:]
 
-    for n in range(num_files):
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-
+    for start, perms in permutation_chunks(num_files, num_atoms, seed, n_jobs=n_jobs):
+        for n, perm in enumerate(perms, start):
+            new_file_path = os.path.join(poscar_dir, f"POSCAR-{composition_str}-{n+1}")
+            with open(new_file_path, 'w') as new_file:
+                new_file.writelines(header + [atom_lines[j] for j in perm] + tail)
+        print(f"Generated: {start + len(perms)}/{num_files} structures in {poscar_dir}")
 
-        for i, line in enumerate(lines):
-            if "Direct" in line or "Cartesian" in line:
-                direct_index = i
-                break
-        else:
-            raise ValueError("Error: 'Direct' or 'Cartesian' not found in the file.")
+def shuffle_to_archive(file_path, num_files, archive_path, seed=None, n_jobs=1):
+    """
+    Same structures as shuffle_poscar_lines for the same seed, appended to a
+    StructureArchive instead of one POSCAR file each.
+    """
+    with StructureArchive(archive_path, 'w') as archive:
+        for batch in iter_shuffled_batches(file_path, num_files, seed, n_jobs=n_jobs):
+            archive.append_batch(batch)
+            print(f"Generated: {len(archive)}/{num_files} structures in {archive_path}")
 
-        content_to_shuffle = lines[direct_index + 1:]
-        random.shuffle(content_to_shuffle)
-        new_content = lines[:direct_index + 1] + content_to_shuffle
+_pdm_worker = {}
 
+def _init_pdm_worker(coords, lattice, cutoff, modes, species, symbols):
+    _pdm_worker['sro'] = FixedLatticeSRO(coords, lattice, cutoff, modes)
+    _pdm_worker['species'] = species
+    _pdm_worker['symbols'] = symbols
 
-        new_file_name = f"POSCAR-{composition_str}-{n+1}"
-        new_file_path = os.path.join(poscar_dir, new_file_name)
+def _pdm_chunk(task):
+    start, perms = _permutation_chunk(task)
+    # Atom k of the shuffled structure sits on template site perms[:, k].
+    codes = np.empty_like(perms)
+    np.put_along_axis(codes, perms, np.broadcast_to(_pdm_worker['species'], perms.shape), axis=1)
+    return start, _pdm_worker['sro'].descriptors(codes, _pdm_worker['symbols'])
 
-        with open(new_file_path, 'w') as new_file:
-            new_file.writelines(new_content)
+def shuffle_to_pdm(file_path, num_files, output_csv, cutoff=5.0, modes=('pair',), seed=None, n_jobs=1):
+    """
+    PDM descriptors of the same structures as shuffle_poscar_lines for the
+    same seed, without building or writing the structures.  All shuffles
+    share the template's sites, so its neighbor clusters are found once and
+    only the species on them are counted per shuffle.  Rows are in
+    generation order.
+    """
+    composition_str = extract_composition_string(file_path)
+    element_types, element_counts, frac, coords, lattice = read_poscar_arrays(file_path)
+    template = StructureBatch.from_arrays(["template"], [(element_types, element_counts, frac, coords, lattice)])
+    num_atoms = len(frac)
 
-        print(f"Generated: {new_file_path}")
+    results = []
+    tasks = _chunk_tasks(num_files, num_atoms, seed, ARCHIVE_CHUNK)
+    initargs = (coords, lattice, cutoff, list(modes), template.species, template.symbols)
+    for start, descriptors in _run_chunks(_pdm_chunk, tasks, n_jobs, _init_pdm_worker, initargs):
+        results.extend((f"POSCAR-{composition_str}-{n+1}", desc)
+                       for n, desc in enumerate(descriptors, start))
+        print(f"Computed PDM: {len(results)}/{num_files} structures")
+    descriptors_to_frame(results).to_csv(output_csv, index=False)
+    print(f"✅ Done. Output saved to {output_csv}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Shuffle atomic positions in POSCAR format.")
@@ -55,5 +164,19 @@ if __name__ == "__main__":
     parser.add_argument("--num", type=int, default=10, help="Number of shuffled files to generate.")
     parser.add_argument("--outdir", type=str, default="shuffled_poscars", help="Directory to save shuffled POSCAR files.")
     parser.add_argument("--output_name", type=str, default="poscar", help="name of the folder of random structures")
+    parser.add_argument("--archive", type=str, default=None,
+                        help="Write all structures to this structure archive instead of a POSCAR folder.")
+    parser.add_argument("--pdm_csv", type=str, default=None,
+                        help="Write only the PDM descriptors of the structures to this CSV, no structure files.")
+    parser.add_argument("--cutoff", type=float, default=5.0, help="Distance cutoff for --pdm_csv")
+    parser.add_argument("--mode", nargs="+", choices=["pair", "triple", "quadruple"], default=["pair"],
+                        help="SRO modes for --pdm_csv")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed; the same seed gives the same structures.")
+    parser.add_argument("--n_jobs", type=int, default=1, help="Number of worker processes.")
     args = parser.parse_args()
-    shuffle_poscar_lines(args.input, args.num, args.outdir,args.output_name)
+    if args.pdm_csv:
+        shuffle_to_pdm(args.input, args.num, args.pdm_csv, args.cutoff, args.mode, args.seed, args.n_jobs)
+    elif args.archive:
+        shuffle_to_archive(args.input, args.num, args.archive, args.seed, args.n_jobs)
+    else:
+        shuffle_poscar_lines(args.input, args.num, args.outdir, args.output_name, args.seed, args.n_jobs)
@@ -2,6 +2,17 @@ import os
 import random
 import argparse
 import shutil
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent / "prepare_dataset"))
+from poscar_io import StructureBatch, read_poscar_arrays
+from structure_archive import StructureArchive
+
+# Structures buffered in memory before each archive append.
+ARCHIVE_CHUNK = 1000
+
+
 def generate_random_numbers(total, count):
     while True:
         numbers = [random.randint(1, total - (count - 1)) for _ in range(count - 1)]
@@ -67,12 +78,37 @@ def modify_element_counts(file_path, file_id, poscar_dir):
 
     print(f"Generated: {new_file_path}")
 
+def shuffle_to_archive(original_path, num_files, archive_path):
+    """
+    Same structures as shuffle_and_save_poscar, appended to a StructureArchive
+    instead of one POSCAR file each.  The template is parsed once.
+    """
+    elements, element_counts, frac, coords, lattice = read_poscar_arrays(original_path)
+    total_atoms = sum(element_counts)
+
+    with StructureArchive(archive_path, 'w') as archive:
+        for start in range(0, num_files, ARCHIVE_CHUNK):
+            names, arrays = [], []
+            for i in range(start, min(start + ARCHIVE_CHUNK, num_files)):
+                order = list(range(len(frac)))
+                random.shuffle(order)
+                new_counts = generate_random_numbers(total_atoms, len(element_counts))
+                names.append(f'POSCAR-{"_".join(f"{elem}{count}" for elem, count in zip(elements, new_counts))}-{i + 1}')
+                arrays.append((elements, new_counts, frac[order], coords[order], lattice))
+            archive.append_batch(StructureBatch.from_arrays(names, arrays))
+            print(f"Generated: {start + len(names)}/{num_files} structures in {archive_path}")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Shuffle POSCAR atom positions and modify element counts.")
     parser.add_argument("--input", type=str, required=True, help="Original POSCAR file path")
     parser.add_argument("--outdir", type=str, default="./", help="Output directory")
     parser.add_argument("--num", type=int, default=10, help="Number of shuffled files to generate")
     parser.add_argument("--output_name", type=str, default="poscar", help="name of the folder of random structures")
+    parser.add_argument("--archive", type=str, default=None,
+                        help="Write all structures to this structure archive instead of a POSCAR folder.")
     args = parser.parse_args()
 
-    shuffle_and_save_poscar(args.input, args.outdir, args.num,args.output_name)
+    if args.archive:
+        shuffle_to_archive(args.input, args.num, args.archive)
+    else:
+        shuffle_and_save_poscar(args.input, args.outdir, args.num,args.output_name)
@@ -0,0 +1,93 @@
+"""Time relaxing structures with one chgnet_cpu.py subprocess per structure
+(as the PSO drivers used to) against a CHGNetPool, and compare the energies."""
+import argparse
+import shutil
+import subprocess
+import sys
+import time
+import concurrent.futures
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from ase.io import read, write
+
+from chgnet_pool import CHGNetPool
+
+OPT_DIR = Path(__file__).resolve().parent
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark per-structure subprocesses vs a CHGNet worker pool")
+    parser.add_argument('--poscar', default=str(OPT_DIR.parent / "original_structures" / "POSCAR"),
+                        help="Structure to rattle into the benchmark set")
+    parser.add_argument('--num_structures', type=int, default=200)
+    parser.add_argument('--rattle', type=float, default=0.05, help="Std of the displacements in Angstrom")
+    parser.add_argument('--mlp_optstep', type=int, default=1, help="As opt.mlp_optstep (default: 1)")
+    parser.add_argument('--fmax', type=float, default=0.02, help="As opt.fmax (default: 0.02)")
+    parser.add_argument('--max_workers', type=int, default=2, help="As opt.max_workers (default: 2)")
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--max_batch_atoms', type=int, default=256)
+    parser.add_argument('--skip_subprocess', action='store_true', help="Only time the pool")
+    parser.add_argument('--work_dir', default="benchmark_chgnet_pool")
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def run_subprocess(structure_file, args):
+    """One structure as PSO/initial_structures.py used to relax it"""
+    subfolder = structure_file.parent / "subprocess" / (structure_file.stem + "_dir")
+    subfolder.mkdir(parents=True, exist_ok=True)
+    shutil.copy(structure_file, subfolder / structure_file.name)
+    subprocess.run([
+        sys.executable, str(OPT_DIR / "chgnet_cpu.py"),
+        "--input_pattern", structure_file.name,
+        "--mlp_optstep", str(args.mlp_optstep),
+        "--fmax", str(args.fmax),
+        "--output_csv", "sorted_energies.csv",
+    ], cwd=subfolder, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return pd.read_csv(subfolder / "sorted_energies.csv")
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    work_dir = Path(args.work_dir)
+    if work_dir.exists():
+        shutil.rmtree(work_dir)
+    work_dir.mkdir(parents=True)
+    template = read(args.poscar)
+    files = []
+    for i in range(args.num_structures):
+        atoms = template.copy()
+        atoms.positions += rng.normal(0, args.rattle, atoms.positions.shape)
+        files.append(work_dir / f"POSCAR_{i}")
+        write(files[-1], atoms, format='vasp')
+    print(f"[INFO] {args.num_structures} structures of {len(template)} atoms, "
+          f"{args.mlp_optstep} steps, {args.max_workers} workers")
+
+    pool_dir = work_dir / "pool"
+    pool_dir.mkdir()
+    start = time.perf_counter()
+    with CHGNetPool(args.max_workers, batch_size=args.batch_size,
+                    max_batch_atoms=args.max_batch_atoms) as pool:
+        pool_energies = pd.DataFrame(pool.relax(files, pool_dir, fmax=args.fmax, steps=args.mlp_optstep))
+    t_pool = time.perf_counter() - start
+    print(f"[TIMING] pool:        {t_pool:8.1f}s  {len(pool_energies) / t_pool * 3600:10.0f} structures/hour")
+
+    if args.skip_subprocess:
+        return
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        subprocess_energies = pd.concat(executor.map(lambda f: run_subprocess(f, args), files), ignore_index=True)
+    t_sub = time.perf_counter() - start
+    print(f"[TIMING] subprocesses: {t_sub:8.1f}s  {len(subprocess_energies) / t_sub * 3600:10.0f} structures/hour")
+    print(f"[TIMING] speedup {t_sub / t_pool:.1f}x")
+
+    merged = pool_energies.merge(subprocess_energies, on="name", suffixes=("_pool", "_subprocess"))
+    diff = (merged["energy_pool"] - merged["energy_subprocess"]).abs().max()
+    print(f"[INFO] {len(merged)} structures in both, max |energy difference| {diff:.2e} eV")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""Relax many structures at once with CHGNet.
+
+chgnet_cpu.py and chgnet_gpu.py relax one structure at a time, so every
+FIRE step is a CHGNet forward over a single small crystal. Here every
+structure keeps its own UnitCellFilter and FIRE state, exactly as in
+`run_opt`, but each step evaluates all structures that have not converged
+yet in batched CHGNet forwards, and converged structures leave the batch.
+
+As a library:
+
+    relaxer = BatchRelaxer(device="cpu", batch_size=32)
+    results = relaxer.relax(atoms_list, fmax=0.01, steps=200)
+
+As a script it takes the arguments and writes the outputs of chgnet_cpu.py.
+"""
+import sys
+import time
+import argparse
+import warnings
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+from ase import units
+from ase.calculators.singlepoint import SinglePointCalculator
+from ase.io import read, write
+from ase.io.trajectory import Trajectory
+from ase.optimize import FIRE
+from ase.stress import full_3x3_to_voigt_6_stress
+from pymatgen.io.ase import AseAtomsAdaptor
+
+try:
+    from ase.filters import UnitCellFilter
+except ImportError:
+    from ase.constraints import UnitCellFilter
+
+from chgnet.model import CHGNet
+
+from prescreen import min_distance
+from relaxed import save_relaxed
+
+
+class Relaxation:
+    """FIRE state of one structure"""
+
+    def __init__(self, index, atoms, aim_stress, trajectory=None):
+        self.index = index
+        self.atoms = atoms
+        self.ucf = UnitCellFilter(atoms, scalar_pressure=aim_stress)
+        self.opt = FIRE(self.ucf, logfile=None)
+        self.trajectory = trajectory
+        self._traj_mode = "w"
+
+    def converged(self, fmax):
+        # Optimizer.converged, which takes different arguments across ASE versions
+        forces = self.ucf.get_forces()
+        return (forces ** 2).sum(axis=1).max() < fmax ** 2
+
+    def write_trajectory(self):
+        # opened per frame: a file held open per structure runs out of
+        # descriptors for folders of more than about 1000 structures
+        with Trajectory(str(self.trajectory), self._traj_mode, self.atoms) as traj:
+            traj.write()
+        self._traj_mode = "a"
+
+
+class BatchRelaxer:
+    """CHGNet model that relaxes lists of structures in lockstep"""
+
+    def __init__(self, model=None, device="cpu", batch_size=32, max_batch_atoms=256, stress_weight=units.GPa):
+        """
+        Args:
+            model (CHGNet): Loaded model, or None to load the pretrained one.
+            device (str): Torch device of the model.
+            batch_size (int): Maximum structures per CHGNet forward.
+            max_batch_atoms (int): Maximum total atoms per CHGNet forward; the
+                                   memory of the force and stress gradients
+                                   grows with it. A larger structure is
+                                   evaluated on its own.
+            stress_weight (float): GPa to eV/Å^3, as CHGNetCalculator.
+        """
+        if model is None:
+            model = CHGNet.load()
+        self.model = model.to(device)
+        # as CHGNetCalculator: structures with isolated atoms get no bonds instead of an error
+        self.model.graph_converter.set_isolated_atom_response("warn")
+        self.batch_size = batch_size
+        self.max_batch_atoms = max_batch_atoms
+        self.stress_weight = stress_weight
+
+    def batches(self, atoms_list):
+        """Indices of consecutive structures within batch_size and max_batch_atoms"""
+        batches, batch, batch_atoms = [], [], 0
+        for i, atoms in enumerate(atoms_list):
+            if batch and (len(batch) == self.batch_size or batch_atoms + len(atoms) > self.max_batch_atoms):
+                batches.append(batch)
+                batch, batch_atoms = [], 0
+            batch.append(i)
+            batch_atoms += len(atoms)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def predict(self, atoms_list):
+        """Energy (eV), forces (eV/Å) and Voigt stress (eV/Å^3) of every Atoms"""
+        graphs = [self.model.graph_converter(AseAtomsAdaptor.get_structure(atoms)) for atoms in atoms_list]
+        predictions = []
+        for batch in self.batches(atoms_list):
+            prediction = self.model.predict_graph([graphs[i] for i in batch], task="efs", batch_size=len(batch))
+            predictions.extend([prediction] if isinstance(prediction, dict) else prediction)
+        results = []
+        for atoms, prediction in zip(atoms_list, predictions):
+            energy = float(prediction["e"]) * (len(atoms) if self.model.is_intensive else 1)
+            results.append({
+                "energy": energy,
+                "free_energy": energy,
+                "forces": prediction["f"],
+                "stress": full_3x3_to_voigt_6_stress(prediction["s"] * self.stress_weight),
+            })
+        return results
+
+    def relax(self, atoms_list, fmax=0.01, steps=200, pstress=0.0, trajectories=None, traj_interval=1,
+              verbose=False):
+        """
+        Relax structures in place, each as `run_opt` does with FIRE and UnitCellFilter.
+
+        Args:
+            atoms_list (list of Atoms): Structures to relax.
+            fmax (float): Force convergence criterion in eV/Å.
+            steps (int): Maximum number of optimization steps per structure.
+            pstress (float): Pressure in GPa.
+            trajectories (list of Path): Trajectory file of each structure, or None.
+            traj_interval (int): Write every traj_interval-th step to the
+                                 trajectories, and always the last one;
+                                 0 writes no trajectories.
+            verbose (bool): Print the number of structures left after every step.
+
+        Returns:
+            list of dict: Final energy (eV), steps taken and convergence of
+                          each structure, and its final numbers, positions,
+                          cell, forces and stress as arrays.
+        """
+        if traj_interval <= 0:
+            trajectories = None
+        # Convert pressure from GPa to eV/Å^3
+        aim_stress = pstress * 0.006242
+        active = [
+            Relaxation(i, atoms, aim_stress, trajectories[i] if trajectories is not None else None)
+            for i, atoms in enumerate(atoms_list)
+        ]
+        results = [None] * len(atoms_list)
+        while active:
+            predictions = self.predict([relaxation.atoms for relaxation in active])
+            remaining = []
+            for relaxation, prediction in zip(active, predictions):
+                atoms = relaxation.atoms
+                atoms.calc = SinglePointCalculator(atoms, **prediction)
+                converged = relaxation.converged(fmax)
+                done = converged or relaxation.opt.nsteps >= steps
+                if relaxation.trajectory is not None and (done or relaxation.opt.nsteps % traj_interval == 0):
+                    relaxation.write_trajectory()
+                if done:
+                    results[relaxation.index] = {
+                        "energy": prediction["energy"],
+                        "steps": relaxation.opt.nsteps,
+                        "converged": bool(converged),
+                        "numbers": atoms.numbers.copy(),
+                        "positions": atoms.positions.copy(),
+                        "cell": atoms.cell.array.copy(),
+                        "forces": np.asarray(prediction["forces"]),
+                        "stress": np.asarray(prediction["stress"]),
+                    }
+                else:
+                    relaxation.opt.step()
+                    relaxation.opt.nsteps += 1
+                    remaining.append(relaxation)
+            active = remaining
+            if verbose and active:
+                print(f"[OPT] {len(active)} of {len(atoms_list)} structures still relaxing", flush=True)
+        return results
+
+    def relax_files(self, input_files, output_dir=None, fmax=0.01, steps=200, pstress=0.0, save_traj=True,
+                    traj_interval=1, write_optdone=True, verbose=True):
+        """
+        Relax structure files and write `<name>.optdone` (and `<stem>.traj`) to
+        output_dir, or next to each input file when output_dir is None.
+
+        With save_traj=False and write_optdone=False nothing is written;
+        the returned arrays can be saved with relaxed.save_relaxed.
+
+        Returns:
+            list of dict: Name and the results of `relax` of each relaxed
+                          structure; structures with atoms closer than
+                          0.6 Å are skipped.
+        """
+        names, atoms_list = [], []
+        for name in input_files:
+            atoms = read(name)
+            min_dis = min_distance(atoms, 0.6)
+            if min_dis > 0.6:
+                names.append(Path(name))
+                atoms_list.append(atoms)
+            else:
+                warnings.warn(f"The minimum distance of two atoms in {Path(name).name} is {min_dis}, "
+                              "which is too close. Skipping.")
+        out_dirs = [Path(output_dir) if output_dir is not None else name.parent for name in names]
+        trajectories = None
+        if save_traj and traj_interval > 0:
+            trajectories = [d / f"{name.stem}.traj" for d, name in zip(out_dirs, names)]
+        results = self.relax(atoms_list, fmax=fmax, steps=steps, pstress=pstress,
+                             trajectories=trajectories, traj_interval=traj_interval, verbose=verbose)
+        if write_optdone:
+            for d, name, atoms in zip(out_dirs, names, atoms_list):
+                write(d / f"{name.name}.optdone", atoms, format='vasp')
+        return [{"name": name.name, **result} for name, result in zip(names, results)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Optimize many structures at once using batched CHGNet.")
+    parser.add_argument("--input_pattern", type=str, default="POSCAR*",
+                        help="Glob pattern to match input structure files.")
+    parser.add_argument("--mlp_optstep", type=int, default=200,
+                        help="Maximum number of optimization steps.")
+    parser.add_argument("--fmax", type=float, default=0.01,
+                        help="Force convergence criterion in eV/Å.")
+    parser.add_argument("--pstress", type=float, default=0.0,
+                        help="Pressure in GPa.")
+    parser.add_argument("--batch_size", type=int, default=32,
+                        help="Maximum structures per CHGNet forward.")
+    parser.add_argument("--max_batch_atoms", type=int, default=256,
+                        help="Maximum total atoms per CHGNet forward.")
+    parser.add_argument("--device", type=str, default="cpu",
+                        help="Torch device, e.g. cpu or cuda:0.")
+    parser.add_argument("--no_traj", action="store_true",
+                        help="Do not write a trajectory per structure.")
+    parser.add_argument("--traj_interval", type=int, default=1,
+                        help="Write every n-th optimization step to the trajectories; 0 writes none.")
+    parser.add_argument("--output_npz", type=str, default=None,
+                        help="Also save the final structures, forces and stresses to one .npz file.")
+    parser.add_argument("--output_csv", type=str, default="sorted_energies.csv",
+                        help="Path to save the sorted energies CSV.")
+    parser.add_argument("--output_dir", type=str, default=".",
+                        help="Directory to save optimized structures and trajectories.")
+    args = parser.parse_args()
+
+    input_files = sorted([f for f in Path().glob(args.input_pattern) if not f.name.endswith(".optdone")])
+    if not input_files:
+        print(f"No files matched the input pattern: '{args.input_pattern}'")
+        sys.exit(1)
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    print("Loading CHGNet model...")
+    relaxer = BatchRelaxer(device=args.device, batch_size=args.batch_size, max_batch_atoms=args.max_batch_atoms)
+    print(f"Model loaded. Optimizing {len(input_files)} structures on {args.device}.")
+    start = time.time()
+    results = relaxer.relax_files(input_files, output_dir, fmax=args.fmax, steps=args.mlp_optstep,
+                                  pstress=args.pstress, save_traj=not args.no_traj,
+                                  traj_interval=args.traj_interval)
+    print(f"[TIMING] {len(results)} structures optimized in {time.time() - start:.2f} seconds.")
+
+    if results:
+        df = pd.DataFrame(results)
+        df_sorted = df.sort_values(by='energy')
+        df_sorted.to_csv(args.output_csv, columns=['name', 'energy'], index=False)
+        print(f"\nEnergy summary saved to {args.output_csv}")
+        if args.output_npz:
+            save_relaxed(args.output_npz, results)
+            print(f"Final structures saved to {args.output_npz}")
+    else:
+        print("⚠️ No valid results were generated to save.")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,8 +9,8 @@ import contextlib
 from pathlib import Path
 
 import pandas as pd
-import numpy as np
 from ase.io import read, write
+from ase.io.trajectory import Trajectory
 from ase.optimize import FIRE
 
 try:
@@ -21,8 +21,11 @@ except ImportError:
 from chgnet.model import CHGNet
 from chgnet.model import CHGNetCalculator as MLP
 
+from prescreen import min_distance
+from relaxed import save_relaxed
 
-def run_opt(name, pstress, model_name, mlp_trajname, fmax, mlp_optstep, calc, output_dir):
+
+def run_opt(name, pstress, model_name, mlp_trajname, fmax, mlp_optstep, calc, output_dir, traj_interval=1):
     verbose = True
     stream = sys.stdout if verbose else io.StringIO()
     with contextlib.redirect_stdout(stream):
@@ -31,18 +34,25 @@ def run_opt(name, pstress, model_name, mlp_trajname, fmax, mlp_optstep, calc, ou
 
         atoms = read(name)
 
-        dis_mtx = atoms.get_all_distances(mic=True)
-        row, col = np.diag_indices_from(dis_mtx)
-        dis_mtx[row, col] = np.nan
-        min_dis = np.nanmin(dis_mtx)
+        # Check for atoms that are too close to each other
+        min_dis = min_distance(atoms, 0.6)
 
         if min_dis > 0.6:
             atoms.calc = calc
             aim_stress = pstress * 0.006242
             ucf = UnitCellFilter(atoms, scalar_pressure=aim_stress)
 
-            opt = FIRE(ucf, trajectory=mlp_trajname)
-            opt.run(fmax=fmax, steps=mlp_optstep)
+            opt = FIRE(ucf)
+            # every traj_interval-th step; 0 keeps no trajectory
+            traj = Trajectory(str(mlp_trajname), "w", atoms) if traj_interval > 0 else None
+            if traj is not None:
+                opt.attach(traj.write, interval=traj_interval)
+            converged = opt.run(fmax=fmax, steps=mlp_optstep)
+            if traj is not None:
+                # the last step, if the interval skipped it
+                if opt.nsteps % traj_interval != 0:
+                    traj.write()
+                traj.close()
 
             energy = float(atoms.get_potential_energy())
 
@@ -51,7 +61,10 @@ def run_opt(name, pstress, model_name, mlp_trajname, fmax, mlp_optstep, calc, ou
             write(output_file, atoms, format='vasp')
 
             print(f"Optimization done! Cost {time.time() - start:.2f} seconds.")
-            return {"name": name.name, "energy": energy}
+            return {"name": name.name, "energy": energy, "steps": opt.nsteps, "converged": bool(converged),
+                    "numbers": atoms.numbers.copy(), "positions": atoms.positions.copy(),
+                    "cell": atoms.cell.array.copy(), "forces": atoms.get_forces(),
+                    "stress": atoms.get_stress()}
         else:
             warnings.warn(f"The minimum distance of two atoms is {min_dis}, too close.")
             return None
@@ -69,6 +82,10 @@ def main():
                         help="Path to save the sorted energies CSV.")
     parser.add_argument("--output_dir", type=str, default=".",
                         help="Directory to save optimized structures and trajectories.")
+    parser.add_argument("--traj_interval", type=int, default=1,
+                        help="Write every n-th optimization step to the trajectory; 0 writes none.")
+    parser.add_argument("--output_npz", type=str, default=None,
+                        help="Also save the final structures, forces and stresses to one .npz file.")
     args = parser.parse_args()
 
     input_files = sorted([f for f in Path().glob(args.input_pattern) if not f.name.endswith(".optdone")])
@@ -95,6 +112,7 @@ def main():
             mlp_optstep=args.mlp_optstep,
             calc=calc,
             output_dir=output_dir,
+            traj_interval=args.traj_interval,
         )
         if result:
             results.append(result)
@@ -104,6 +122,9 @@ def main():
         df_sorted = df.sort_values(by='energy')
         df_sorted.to_csv(args.output_csv, columns=['name', 'energy'], index=False)
         print(f"Energy summary saved to {args.output_csv}")
+        if args.output_npz:
+            save_relaxed(args.output_npz, results)
+            print(f"Final structures saved to {args.output_npz}")
     else:
         print("⚠️  No valid results to save.")
 
@@ -0,0 +1,390 @@
+"""Long-lived CHGNet worker processes.
+
+The PSO drivers used to relax every structure in a directory of its own
+with a fresh `python chgnet_cpu.py`, which imports torch and loads CHGNet
+again for each structure; for short relaxations (`mlp_optstep: 1`) that
+start-up is most of the cost. A CHGNetPool starts its workers once, each
+loads the model once with its share of the CPU threads, and relax() hands
+them jobs, chunks of structure files that they relax together with
+chgnet_batch.BatchRelaxer. Energies and final structures come back in
+memory, and can be saved to one file per call (see relaxed.py) instead of
+trajectories and .optdone files per structure.
+
+The jobs are admitted by a scheduler rather than queued up front. The
+peak memory of a worker grows with the atoms of its largest CHGNet
+forward, so each job is estimated from its atom counts with a MemoryModel
+that is calibrated against the peak RSS the workers measure. A job starts
+while the estimates of the running jobs plus its own fit the memory
+budget and the live RSS of the workers and the free memory of the node
+leave room for it; otherwise the scheduler waits for a job to finish.
+The CPU thread budget bounds the number of workers.
+
+torch and CHGNet are only imported in the workers, so forking them from a
+driver is safe.
+"""
+import os
+import time
+import ctypes
+import math
+import threading
+import collections
+import concurrent.futures
+import multiprocessing
+from concurrent.futures.process import BrokenProcessPool
+
+import psutil
+from ase.io import read
+
+from relaxed import save_relaxed
+
+MB = 1024 ** 2
+
+_relaxer = None
+_monitor = None
+_libc = None
+
+
+class RSSMonitor(threading.Thread):
+    """Peak RSS of this process in MB, sampled in the background"""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.process = psutil.Process()
+        self.interval = interval
+        self.base_mb = self.peak_mb = self.rss_mb()
+
+    def rss_mb(self):
+        return self.process.memory_info().rss / MB
+
+    def reset(self):
+        self.peak_mb = self.rss_mb()
+
+    def run(self):
+        while True:
+            self.peak_mb = max(self.peak_mb, self.rss_mb())
+            time.sleep(self.interval)
+
+
+def _init_worker(device, threads, batch_size, max_batch_atoms):
+    global _relaxer, _monitor, _libc
+    import torch
+    from chgnet_batch import BatchRelaxer
+
+    torch.set_num_threads(threads)
+    _relaxer = BatchRelaxer(device=device, batch_size=batch_size, max_batch_atoms=max_batch_atoms)
+    try:
+        _libc = ctypes.CDLL("libc.so.6")
+        _libc.malloc_trim
+    except (OSError, AttributeError):
+        _libc = None
+    # RSS with the model loaded
+    _monitor = RSSMonitor()
+    _monitor.start()
+
+
+def _relax_chunk(input_files, output_dir, fmax, steps, pstress, save_traj, traj_interval, write_optdone):
+    _monitor.reset()
+    results = _relaxer.relax_files(input_files, output_dir, fmax=fmax, steps=steps, pstress=pstress,
+                                   save_traj=save_traj, traj_interval=traj_interval,
+                                   write_optdone=write_optdone, verbose=False)
+    peak_mb = max(_monitor.peak_mb, _monitor.rss_mb())
+    # glibc keeps the freed gradient buffers of the batch; return them, so an
+    # idle worker holds about base_mb again
+    if _libc is not None:
+        _libc.malloc_trim(0)
+    return results, {"base_mb": _monitor.base_mb, "peak_mb": peak_mb}
+
+
+def default_device(opt_script):
+    """Device of the chgnet_*.py script named by `opt_script` in PSO/config.yaml"""
+    return "cuda:0" if opt_script == "chgnet_gpu.py" else "cpu"
+
+
+class MemoryModel:
+    """
+    Peak RSS in MB of a worker running a job:
+    base_mb + mb_per_atom * atoms of the largest CHGNet forward of the job.
+
+    The defaults were measured for 120-atom oxides on CPU. Once jobs finish,
+    mb_per_atom is the largest per-atom cost of the last `window` jobs, so
+    it follows the structures at hand but errs on the high side.
+    """
+
+    def __init__(self, base_mb=700.0, mb_per_atom=10.0, window=20):
+        self.base_mb = base_mb
+        self.mb_per_atom = mb_per_atom
+        self.calibrated = False
+        self._observed = collections.deque(maxlen=window)
+
+    def estimate(self, forward_atoms):
+        return self.base_mb + self.mb_per_atom * forward_atoms
+
+    def update(self, forward_atoms, base_mb, peak_mb):
+        self.base_mb = max(self.base_mb, base_mb) if self.calibrated else base_mb
+        self._observed.append(max(peak_mb - base_mb, 0.0) / max(forward_atoms, 1))
+        self.mb_per_atom = max(self._observed)
+        self.calibrated = True
+
+    def inflate(self, factor=1.5):
+        """Raise the estimates after a worker died, most likely for memory"""
+        self.mb_per_atom *= factor
+        self._observed = collections.deque((x * factor for x in self._observed), maxlen=self._observed.maxlen)
+
+
+class Job:
+    """Chunk of structure files relaxed by one worker"""
+
+    def __init__(self, files, sizes, forward_atoms):
+        self.files = files
+        self.sizes = sizes
+        self.forward_atoms = forward_atoms
+        self.attempts = 0
+        self.estimate_mb = 0.0
+
+
+class CHGNetPool:
+    """
+    Worker processes that each hold one CHGNet model for their lifetime.
+
+    Args:
+        n_workers (int): Maximum number of worker processes.
+        device (str): Torch device of the models, e.g. cpu or cuda:0.
+        threads (int): Torch intra-op threads per worker; by default the
+                       CPU thread budget is split evenly between the workers.
+        batch_size (int): Maximum structures per CHGNet forward in a worker.
+        max_batch_atoms (int): Maximum total atoms per CHGNet forward in a worker.
+        memory_budget_gb (float): Memory the workers may use together; by
+                                  default what they use plus what is
+                                  available when relax() starts.
+        cpu_threads (int): CPU threads the workers may use together, by
+                           default all; at most cpu_threads // threads
+                           workers are started.
+        report_interval (float): Seconds between [SCHED] lines in relax().
+    """
+
+    def __init__(self, n_workers=2, device="cpu", threads=None, batch_size=32, max_batch_atoms=256,
+                 memory_budget_gb=None, cpu_threads=None, report_interval=30.0):
+        cpu_threads = cpu_threads or os.cpu_count() or 1
+        if threads is None:
+            threads = max(1, cpu_threads // n_workers)
+        self.n_workers = max(1, min(n_workers, cpu_threads // threads))
+        if self.n_workers < n_workers:
+            print(f"[SCHED] {cpu_threads} CPU threads fit {self.n_workers} of {n_workers} workers "
+                  f"with {threads} threads each")
+        self.device = device
+        self.threads = threads
+        self.batch_size = batch_size
+        self.max_batch_atoms = max_batch_atoms
+        self.memory_budget_gb = memory_budget_gb
+        self.report_interval = report_interval
+        self.memory = MemoryModel()
+        self.counts = {"queued": 0, "running": 0, "finished": 0, "failed": 0}
+        self._estimated_mb = 0.0
+        self._budget_mb = 0.0
+        self._executor = self._start_executor()
+
+    @classmethod
+    def from_config(cls, chgnet_cfg, opt_script=None):
+        """Pool set up by the opt section of PSO/config.yaml"""
+        return cls(
+            chgnet_cfg.get("max_workers", 2),
+            device=chgnet_cfg.get("device", default_device(opt_script)),
+            batch_size=chgnet_cfg.get("batch_size", 32),
+            max_batch_atoms=chgnet_cfg.get("max_batch_atoms", 256),
+            memory_budget_gb=chgnet_cfg.get("memory_budget_gb"),
+            cpu_threads=chgnet_cfg.get("cpu_threads"),
+        )
+
+    def _start_executor(self):
+        # Forked workers inherit the loaded modules; spawned ones would
+        # re-import the calling script, as for PDMPool.
+        context = None
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.n_workers, mp_context=context,
+            initializer=_init_worker, initargs=(self.device, self.threads, self.batch_size, self.max_batch_atoms),
+        )
+
+    def workers_rss_mb(self):
+        """Live RSS of the worker processes in MB"""
+        total = 0.0
+        # ProcessPoolExecutor keeps its processes by pid
+        for pid in list(getattr(self._executor, "_processes", None) or {}):
+            try:
+                total += psutil.Process(pid).memory_info().rss / MB
+            except psutil.Error:
+                pass
+        return total
+
+    def metrics(self):
+        """Job counts and memory (MB) of the current or last relax()"""
+        return dict(
+            self.counts,
+            estimated_mb=round(self._estimated_mb),
+            workers_rss_mb=round(self.workers_rss_mb()),
+            budget_mb=round(self._budget_mb),
+            mb_per_atom=round(self.memory.mb_per_atom, 2),
+            base_mb=round(self.memory.base_mb),
+        )
+
+    def report(self):
+        m = self.metrics()
+        print(f"[SCHED] queued {m['queued']}, running {m['running']}, finished {m['finished']}, "
+              f"failed {m['failed']}; estimated {m['estimated_mb'] / 1024:.1f} GB, "
+              f"workers {m['workers_rss_mb'] / 1024:.1f} GB, budget {m['budget_mb'] / 1024:.1f} GB; "
+              f"{m['mb_per_atom']} MB/atom over {m['base_mb']} MB", flush=True)
+
+    def make_jobs(self, input_files):
+        """Chunks of at most batch_size files, spread over the workers"""
+        sizes = [len(read(f)) for f in input_files]
+        chunk_size = min(self.batch_size, math.ceil(len(input_files) / self.n_workers))
+        jobs = []
+        for i in range(0, len(input_files), chunk_size):
+            chunk = sizes[i:i + chunk_size]
+            # largest forward of BatchRelaxer.batches
+            forward_atoms = min(sum(chunk), max(self.max_batch_atoms, max(chunk)))
+            jobs.append(Job(input_files[i:i + chunk_size], chunk, forward_atoms))
+        return jobs
+
+    def admit(self, job, reserve_mb, idle=False):
+        """
+        Whether a job can start now.
+
+        Returns:
+            str: "yes"; "wait" while the running jobs or other processes
+                 leave too little memory; "never" when the job alone is
+                 estimated over the budget. With idle=True no job is
+                 running, so the live RSS of the workers is not checked.
+        """
+        estimate = self.memory.estimate(job.forward_atoms)
+        if estimate > self._budget_mb:
+            return "never"
+        # an idle worker already holds base_mb
+        growth = estimate - self.memory.base_mb
+        if self._estimated_mb + estimate > self._budget_mb:
+            return "wait"
+        if not idle and self.workers_rss_mb() + growth > self._budget_mb:
+            return "wait"
+        if psutil.virtual_memory().available / MB - growth < reserve_mb:
+            return "wait"
+        return "yes"
+
+    def _submit(self, job, running, args):
+        job.estimate_mb = self.memory.estimate(job.forward_atoms)
+        job.attempts += 1
+        self._estimated_mb += job.estimate_mb
+        running[self._executor.submit(_relax_chunk, job.files, *args)] = job
+
+    def _restart(self, running, pending):
+        """Start new workers after one died and requeue the jobs it took with it"""
+        for job in running.values():
+            pending.appendleft(job)
+        running.clear()
+        self._estimated_mb = 0.0
+        self.memory.inflate()
+        print(f"[MEMORY] A CHGNet worker died, restarting the workers and estimating "
+              f"{self.memory.mb_per_atom:.1f} MB/atom")
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._start_executor()
+
+    def relax(self, input_files, output_dir=None, fmax=0.01, steps=200, pstress=0.0,
+              save_traj=False, min_free_mem_gb=0.0, traj_interval=1, write_optdone=True, results_path=None):
+        """
+        Relax structure files, writing `<name>.optdone` to output_dir, or
+        next to each input file when output_dir is None. With
+        write_optdone=False and save_traj=False the workers write nothing;
+        results_path saves the final structures of all files in one .npz.
+
+        Jobs start as admit() allows; min_free_mem_gb of the node's memory
+        is kept free on top of the budget. A job whose worker dies is retried
+        once with higher estimates.
+
+        Returns:
+            list of dict: Name, final energy and final arrays (see
+                          BatchRelaxer.relax) of each relaxed structure, in
+                          the order of input_files. Structures that were
+                          skipped or whose job failed are missing.
+        """
+        input_files = list(input_files)
+        if not input_files:
+            return []
+        reserve_mb = min_free_mem_gb * 1024
+        if self.memory_budget_gb is not None:
+            self._budget_mb = self.memory_budget_gb * 1024
+        else:
+            self._budget_mb = self.workers_rss_mb() + psutil.virtual_memory().available / MB - reserve_mb
+        args = (output_dir, fmax, steps, pstress, save_traj, traj_interval, write_optdone)
+        pending = collections.deque(self.make_jobs(input_files))
+        running = {}
+        results = {}
+        self.counts = {"queued": len(pending), "running": 0, "finished": 0, "failed": 0}
+        self._estimated_mb = 0.0
+        last_report = time.monotonic()
+
+        while pending or running:
+            # first fit: a smaller job may pass one that waits for memory
+            for job in list(pending):
+                if len(running) >= self.n_workers:
+                    break
+                admitted = self.admit(job, reserve_mb, idle=not running)
+                if admitted == "never" and not running:
+                    print(f"[WARNING] A job of {sum(job.sizes)} atoms is estimated at "
+                          f"{self.memory.estimate(job.forward_atoms) / 1024:.1f} GB, over the memory "
+                          f"budget; running it alone")
+                elif admitted != "yes":
+                    continue
+                pending.remove(job)
+                self._submit(job, running, args)
+            self.counts.update(queued=len(pending), running=len(running))
+            if not running:
+                print("[MEMORY] Not enough free memory, waiting 10 seconds...")
+                time.sleep(10)
+                continue
+
+            done, _ = concurrent.futures.wait(running, timeout=1.0,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                job = running.pop(future)
+                self._estimated_mb -= job.estimate_mb
+                try:
+                    job_results, stats = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    if job.attempts < 2:
+                        pending.appendleft(job)
+                        continue
+                    print(f"[CHGNet-ERROR] A worker died twice relaxing {len(job.files)} structures "
+                          f"from {job.files[0]}")
+                    self.counts["failed"] += 1
+                except Exception as e:
+                    print(f"[CHGNet-ERROR] Failed to relax {len(job.files)} structures from {job.files[0]}: {e!r}")
+                    self.counts["failed"] += 1
+                else:
+                    self.memory.update(job.forward_atoms, stats["base_mb"], stats["peak_mb"])
+                    results.update((r["name"], r) for r in job_results)
+                    self.counts["finished"] += 1
+            if broken:
+                self._restart(running, pending)
+            self.counts.update(queued=len(pending), running=len(running))
+
+            if time.monotonic() - last_report >= self.report_interval:
+                self.report()
+                last_report = time.monotonic()
+
+        self.report()
+        names = [os.path.basename(f) for f in input_files]
+        results = [results[name] for name in names if name in results]
+        if results_path is not None:
+            save_relaxed(results_path, results)
+        return results
+
+    def close(self):
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""Cheap checks of structures before they are relaxed.
+
+Generated structures often have overlapping atoms or collapsed or blown-up
+cells. `run_opt` only found the overlaps once a CHGNet worker had the
+structure, and with a dense distance matrix. A Screen reads all candidates
+up front and drops those that fail, checks cheapest first:
+
+    cell          non-finite positions or a cell without volume
+    composition   elements that are not in the reference structure
+    volume        volume per atom outside volume_ratio times the reference's
+    density       density outside the bounds in g/cm^3
+    overlap       two atoms closer than min_dist Å, from a neighbor list
+
+As a script it screens the files of a folder and writes the report:
+
+    python prescreen.py --input_pattern "POSCAR*" --reference ../original_structures/POSCAR
+"""
+import sys
+import argparse
+import collections
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from ase.io import read
+from ase.neighborlist import neighbor_list
+
+# g/cm^3 of one amu per Å^3
+AMU_PER_A3 = 1.66053906660
+
+REASONS = ("unreadable", "cell", "composition", "volume", "density", "overlap")
+
+
+def min_distance(atoms, cutoff=3.0):
+    """Smallest distance between two atoms, with periodic images; inf if
+    none are within cutoff Å"""
+    distances = neighbor_list("d", atoms, cutoff)
+    return float(distances.min()) if len(distances) else np.inf
+
+
+class Screen:
+    """
+    Args:
+        min_dist (float): Smallest allowed distance between two atoms in Å;
+                          unchecked when None.
+        volume_ratio (tuple): Allowed volume per atom relative to the
+                              reference structure; unchecked without one.
+        density (tuple): Allowed density in g/cm^3; unchecked when None.
+        same_elements (bool): Only allow the elements of the reference structure.
+        reference (Atoms or str): Reference structure or its file.
+    """
+
+    def __init__(self, min_dist=0.6, volume_ratio=(0.5, 2.0), density=(0.5, 25.0), same_elements=True,
+                 reference=None):
+        self.min_dist = min_dist
+        self.volume_ratio = volume_ratio
+        self.density = density
+        self.same_elements = same_elements
+        self.reference_volume = self.reference_numbers = None
+        if reference is not None:
+            if not hasattr(reference, "get_volume"):
+                reference = read(reference)
+            self.reference_volume = reference.get_volume() / len(reference)
+            self.reference_numbers = np.unique(reference.numbers)
+
+    @classmethod
+    def from_config(cls, screen_cfg=None, reference=None):
+        """Screen set up by the opt.screen section of PSO/config.yaml;
+        its `reference` takes precedence over the argument"""
+        screen_cfg = screen_cfg or {}
+        return cls(
+            min_dist=screen_cfg.get("min_dist", 0.6),
+            volume_ratio=screen_cfg.get("volume_ratio", (0.5, 2.0)),
+            density=screen_cfg.get("density", (0.5, 25.0)),
+            same_elements=screen_cfg.get("same_elements", True),
+            reference=screen_cfg.get("reference", reference),
+        )
+
+    def files(self, input_files):
+        """
+        Screen structure files.
+
+        Returns:
+            tuple: The files that pass, in order, and a DataFrame with the
+                   name, number of atoms, volume per atom, density, smallest
+                   distance (when below min_dist) and reason of each file;
+                   the reason is empty for files that pass.
+        """
+        input_files = list(input_files)
+        atoms_list, reason = [], np.full(len(input_files), "", dtype=object)
+        for i, name in enumerate(input_files):
+            try:
+                atoms_list.append(read(name))
+            except Exception:
+                atoms_list.append(None)
+                reason[i] = "unreadable"
+
+        n = len(input_files)
+        n_atoms = np.array([len(a) if a is not None else 0 for a in atoms_list])
+        volume = np.array([a.cell.volume if a is not None else np.nan for a in atoms_list])
+        mass = np.array([a.get_masses().sum() if a is not None else np.nan for a in atoms_list])
+        finite = np.array([a is not None and np.isfinite(a.positions).all() for a in atoms_list], dtype=bool)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            volume_per_atom = volume / n_atoms
+            density = AMU_PER_A3 * mass / volume
+
+        def drop(mask, why):
+            reason[(reason == "") & mask] = why
+
+        drop(~finite | ~(volume > 1e-6) | (n_atoms == 0), "cell")
+        if self.same_elements and self.reference_numbers is not None:
+            foreign = np.array([a is not None and not np.isin(a.numbers, self.reference_numbers).all()
+                                for a in atoms_list], dtype=bool)
+            drop(foreign, "composition")
+        if self.volume_ratio is not None and self.reference_volume is not None:
+            ratio = volume_per_atom / self.reference_volume
+            drop((ratio < self.volume_ratio[0]) | (ratio > self.volume_ratio[1]), "volume")
+        if self.density is not None:
+            drop((density < self.density[0]) | (density > self.density[1]), "density")
+
+        # the neighbor list only for what is left, and only up to min_dist
+        min_dist = np.full(n, np.nan)
+        if self.min_dist is not None:
+            for i in np.flatnonzero(reason == ""):
+                d = min_distance(atoms_list[i], self.min_dist)
+                if d < self.min_dist:
+                    min_dist[i] = d
+                    reason[i] = "overlap"
+
+        report = pd.DataFrame({
+            "name": [Path(f).name for f in input_files],
+            "n_atoms": n_atoms,
+            "volume_per_atom": volume_per_atom,
+            "density": density,
+            "min_dist": min_dist,
+            "reason": reason,
+        })
+        kept = [f for f, r in zip(input_files, reason) if r == ""]
+        return kept, report
+
+
+def summarize(report):
+    """One [SCREEN] line: how many passed and why the others were dropped"""
+    counts = collections.Counter(r for r in report["reason"] if r)
+    dropped = ", ".join(f"{r} {counts[r]}" for r in REASONS if counts[r])
+    line = f"[SCREEN] {len(report) - sum(counts.values())} of {len(report)} structures pass"
+    return line + (f"; dropped {dropped}" if dropped else "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drop structures that are not worth relaxing.")
+    parser.add_argument("--input_pattern", type=str, default="POSCAR*",
+                        help="Glob pattern to match input structure files.")
+    parser.add_argument("--reference", type=str, default=None,
+                        help="Structure the elements and volume per atom are compared to.")
+    parser.add_argument("--min_dist", type=float, default=0.6,
+                        help="Smallest allowed distance between two atoms in Å.")
+    parser.add_argument("--volume_ratio", type=float, nargs=2, default=(0.5, 2.0),
+                        help="Allowed volume per atom relative to the reference.")
+    parser.add_argument("--density", type=float, nargs=2, default=(0.5, 25.0),
+                        help="Allowed density in g/cm^3.")
+    parser.add_argument("--any_elements", action="store_true",
+                        help="Allow elements that are not in the reference.")
+    parser.add_argument("--report", type=str, default="screen_report.csv",
+                        help="Path to save the report CSV.")
+    args = parser.parse_args()
+
+    input_files = sorted([f for f in Path().glob(args.input_pattern) if not f.name.endswith(".optdone")])
+    if not input_files:
+        print(f"No files matched the input pattern: '{args.input_pattern}'")
+        sys.exit(1)
+
+    screen = Screen(args.min_dist, args.volume_ratio, args.density, not args.any_elements, args.reference)
+    kept, report = screen.files(input_files)
+    report.to_csv(args.report, index=False)
+    print(summarize(report))
+    print(f"Report saved to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
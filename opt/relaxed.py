@@ -0,0 +1,64 @@
+"""Relaxed structures of a generation in one columnar file.
+
+The relaxers return the final state of every structure as arrays; instead
+of one file per structure (and per step, with trajectories) they can be
+kept in a single .npz, concatenated over structures with offsets as in
+the cond-cdvae dataset cache:
+
+    name            (n,) file names
+    energy          (n,) eV
+    steps           (n,) FIRE steps taken
+    converged       (n,)
+    cell            (n, 3, 3) Å
+    stress          (n, 6) Voigt, eV/Å^3
+    atom_offsets    (n + 1,) into the atom columns
+    numbers         (total_atoms,)
+    positions       (total_atoms, 3) Å
+    forces          (total_atoms, 3) eV/Å
+
+Only numpy and ASE are needed, so drivers can read it without torch.
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+from ase import Atoms
+from ase.calculators.singlepoint import SinglePointCalculator
+
+
+def save_relaxed(path, results):
+    """Write the result dicts of BatchRelaxer.relax_files or run_opt to `path`"""
+    path = Path(path)
+    n_atoms = [len(r["numbers"]) for r in results]
+    columns = {
+        "name": np.array([r["name"] for r in results], dtype=str),
+        "energy": np.array([r["energy"] for r in results], dtype=np.float64),
+        "steps": np.array([r["steps"] for r in results], dtype=np.int64),
+        "converged": np.array([r["converged"] for r in results], dtype=bool),
+        "cell": np.array([r["cell"] for r in results], dtype=np.float64).reshape(-1, 3, 3),
+        "stress": np.array([r["stress"] for r in results], dtype=np.float64).reshape(-1, 6),
+        "atom_offsets": np.concatenate([[0], np.cumsum(n_atoms, dtype=np.int64)]),
+        "numbers": np.concatenate([np.zeros(0, dtype=np.int64)] + [r["numbers"] for r in results]),
+        "positions": np.concatenate([np.zeros((0, 3))] + [r["positions"] for r in results]),
+        "forces": np.concatenate([np.zeros((0, 3))] + [r["forces"] for r in results]),
+    }
+    # np.savez adds .npz to names without it
+    tmp_path = path.with_name(path.name + ".tmp.npz")
+    np.savez(tmp_path, **columns)
+    os.replace(tmp_path, path)
+
+
+def load_relaxed(path):
+    """Columns of a file written by save_relaxed"""
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def relaxed_atoms(data, index):
+    """Atoms of one structure of load_relaxed, with its energy, forces and stress"""
+    atoms_slice = slice(data["atom_offsets"][index], data["atom_offsets"][index + 1])
+    atoms = Atoms(numbers=data["numbers"][atoms_slice], positions=data["positions"][atoms_slice],
+                  cell=data["cell"][index], pbc=True)
+    atoms.calc = SinglePointCalculator(atoms, energy=float(data["energy"][index]),
+                                       forces=data["forces"][atoms_slice], stress=data["stress"][index])
+    return atoms
@@ -11,11 +11,14 @@ def read_cif_content(file_name, cif_directory):
     except FileNotFoundError:
         return 'File not found'
 
-def process_file(input_csv, output_csv, cif_directory):
+def process_file(input_csv, output_csv, cif_directory=None, cif_table=None):
     data = pd.read_csv(input_csv)
 
     # Add .cif file content
-    data['cif_file'] = data.apply(lambda row: read_cif_content(row['material_id'], cif_directory), axis=1)
+    if cif_table is not None:
+        data['cif_file'] = data['material_id'].map(cif_table).fillna('File not found')
+    else:
+        data['cif_file'] = data.apply(lambda row: read_cif_content(row['material_id'], cif_directory), axis=1)
 
     # Convert interaction columns (skip first two columns)
     interaction_columns = data.columns[2:]
@@ -28,7 +31,9 @@ def main():
     parser = argparse.ArgumentParser(description="Append .cif content and element values to dataset.")
     parser.add_argument('--input_csvs', nargs='+', required=True, help="List of input CSV files")
     parser.add_argument('--output_names', nargs='+', required=True, help="List of output CSV names (without extension)")
-    parser.add_argument('--cif_dir', required=True, help="Directory containing .cif files")
+    cif_source = parser.add_mutually_exclusive_group(required=True)
+    cif_source.add_argument('--cif_dir', help="Directory containing .cif files")
+    cif_source.add_argument('--cif_table', help="cif.csv (material_id, cif) written by transfer_POSCAR_to_cif.py --archive")
     parser.add_argument('--output_dir', default='.', help="Directory to save output files")
 
     args = parser.parse_args()
@@ -36,9 +41,14 @@ def main():
     if len(args.input_csvs) != len(args.output_names):
         raise ValueError("The number of input CSVs and output names must match.")
 
+    cif_table = None
+    if args.cif_table:
+        table = pd.read_csv(args.cif_table)
+        cif_table = dict(zip(table['material_id'], table['cif']))
+
     for input_file, out_name in zip(args.input_csvs, args.output_names):
         output_path = os.path.join(args.output_dir, f"with_cif_{out_name}.csv")
-        process_file(input_file, output_path, args.cif_dir)
+        process_file(input_file, output_path, args.cif_dir, cif_table)
 
 if __name__ == "__main__":
     main()
@@ -1,102 +1,231 @@
 import os
 import argparse
+import concurrent.futures
+import multiprocessing
+from contextlib import contextmanager
+from itertools import repeat
 import numpy as np
 import pandas as pd
-from itertools import combinations
-from scipy.spatial.distance import pdist, squareform
 from joblib import Parallel, delayed
 
+from pdm_cache import DEFAULT_CACHE_MB, PDMCache, cached_sro, chunks, flush_cache
+from pdm_kernels import FixedLatticeSRO
+from poscar_io import load_structure_dir, read_poscar
+from structure_archive import StructureArchive
 
-def read_poscar(poscar_path):
-    with open(poscar_path, 'r') as file:
-        lines = file.readlines()
 
-    scale = float(lines[1].strip())
-    lattice = np.array([list(map(float, lines[i].split())) for i in range(2, 5)]) * scale
-    element_types = lines[5].split()
-    element_counts = list(map(int, lines[6].split()))
-    coord_type_line = lines[7].strip().lower()
-    coord_type = 'direct' if 'direct' in coord_type_line else 'cartesian'
-    total_atoms = sum(element_counts)
-    coords = np.array([list(map(float, line.split()[:3])) for line in lines[8:8 + total_atoms]])
+def process_file(filepath, cutoff, modes, cache_path=None):
+    try:
+        _, _, coords, atom_types, lattice = read_poscar(filepath)
+        descriptors = cached_sro(coords, atom_types, lattice, cutoff, modes, cache_path)
+        return os.path.basename(filepath), descriptors
+    except Exception as e:
+        print(f"[ERROR] {filepath}: {e}")
+        return os.path.basename(filepath), {}
 
-    if coord_type == 'direct':
-        coords = coords @ lattice
 
-    atom_types = []
-    for el, count in zip(element_types, element_counts):
-        atom_types.extend([el] * count)
+def process_structure(name, coords, atom_types, lattice, cutoff, modes, cache_path=None):
+    try:
+        return name, cached_sro(coords, atom_types, lattice, cutoff, modes, cache_path)
+    except Exception as e:
+        print(f"[ERROR] {name}: {e}")
+        return name, {}
+
 
-    return element_types, element_counts, coords, atom_types, lattice
+def process_files(filepaths, cutoff, modes, cache_path=None):
+    results = [process_file(f, cutoff, modes, cache_path) for f in filepaths]
+    flush_cache(cache_path)
+    return results
 
 
-def calculate_distances(positions, lattice_vectors):
-    distances = squareform(pdist(positions))
-    num_atoms = len(positions)
-    inv_lattice = np.linalg.inv(lattice_vectors)
+def process_structures(structures, cutoff, modes, cache_path=None):
+    results = [process_structure(*structure, cutoff, modes, cache_path) for structure in structures]
+    flush_cache(cache_path)
+    return results
 
-    for i in range(num_atoms):
-        for j in range(i + 1, num_atoms):
-            vec = positions[j] - positions[i]
-            vec -= np.round(vec @ inv_lattice) @ lattice_vectors
-            d = np.linalg.norm(vec)
-            distances[i, j] = distances[j, i] = d
-    return distances
 
+def find_poscar_files(input_dir, starts_with='', ends_with=''):
+    return [
+        os.path.join(input_dir, f)
+        for f in os.listdir(input_dir)
+        if f.startswith(starts_with) and f.endswith(ends_with)
+    ]
+
+
+def descriptors_to_frame(results):
+    all_keys = set()
+    for _, desc in results:
+        all_keys.update(desc.keys())
+    all_keys = sorted(all_keys)
+
+    rows = []
+    for fname, desc in results:
+        row = [fname, fname + '.cif'] + [desc.get(k, 0) for k in all_keys]
+        rows.append(row)
 
-def get_neighbors(distances, cutoff):
-    return {
-        i: [j for j in range(len(distances)) if i != j and distances[i, j] < cutoff]
-        for i in range(len(distances))
-    }
+    return pd.DataFrame(rows, columns=['material_id', 'cif_file'] + all_keys)
 
 
-def update_descriptor(descriptor_dict, atoms, label):
-    key = ''.join(sorted(atoms))
-    descriptor_dict[key] = descriptor_dict.get(key, 0) + 1
+class PDMPool:
+    """
+    Long-lived worker processes for PDM extraction.
 
+    Workers are started once and reused by every compute() call, so a driver
+    that extracts descriptors once per PSO generation pays the interpreter,
+    import and spawn cost only once instead of once per structure directory.
+    """
 
-def calculate_sro(distances, atom_types, cutoff, modes):
-    descriptors = {}
-    neighbors = get_neighbors(distances, cutoff)
-    n = len(atom_types)
+    def __init__(self, n_jobs=4):
+        self.n_jobs = n_jobs
+        # Forked workers inherit the loaded modules; spawned ones would
+        # re-import the calling script, which for driver scripts without a
+        # __main__ guard (initial_structures.py) means re-running it.
+        context = None
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs, mp_context=context)
 
-    for i in range(n):
-        ni = neighbors[i]
+    def map(self, poscar_files, cutoff, modes, cache_path=None):
+        chunked = self._executor.map(process_files, chunks(poscar_files, self.n_jobs), repeat(cutoff),
+                                     repeat(list(modes)), repeat(cache_path))
+        return [result for chunk in chunked for result in chunk]
 
-        if 'pair' in modes:
-            for j in ni:
-                if j > i:
-                    update_descriptor(descriptors, [atom_types[i], atom_types[j]], 'pair')
+    def compute(self, poscar_files, cutoff=5.0, modes=('pair',), cache_path=None,
+                cache_max_mb=DEFAULT_CACHE_MB):
+        return compute_pdm(poscar_files, cutoff, modes, pool=self,
+                           cache_path=cache_path, cache_max_mb=cache_max_mb)
 
-        if 'triple' in modes:
-            for j, k in combinations(ni, 2):
-                if j > i and k > i and distances[j, k] < cutoff:
-                    update_descriptor(descriptors, [atom_types[i], atom_types[j], atom_types[k]], 'triple')
+    def close(self):
+        self._executor.shutdown()
 
-        if 'quadruple' in modes:
-            for j, k, l in combinations(ni, 3):
-                if j > i and k > i and l > i:
-                    if all(distances[x, y] < cutoff for x, y in combinations([j, k, l], 2)):
-                        update_descriptor(descriptors, [atom_types[i], atom_types[j], atom_types[k], atom_types[l]], 'quadruple')
+    def __enter__(self):
+        return self
 
-    return descriptors
+    def __exit__(self, *exc):
+        self.close()
 
 
-def process_file(filepath, cutoff, modes):
+@contextmanager
+def _cache_session(cache_path, cache_max_mb):
+    if not cache_path:
+        yield
+        return
+    # Create the tables once before the workers race to open the file.  The
+    # connection is closed again so that PDMPool workers, forked on their
+    # first task, do not inherit it: SQLite connections must not cross a fork.
+    PDMCache(cache_path).close()
     try:
-        _, _, coords, atom_types, lattice = read_poscar(filepath)
-        distances = calculate_distances(coords, lattice)
-        descriptors = calculate_sro(distances, atom_types, cutoff, modes)
-        return os.path.basename(filepath), descriptors
-    except Exception as e:
-        print(f"[ERROR] {filepath}: {e}")
-        return os.path.basename(filepath), {}
+        yield
+    finally:
+        cache = PDMCache(cache_path)
+        evicted = cache.evict(cache_max_mb)
+        if evicted:
+            print(f"[CACHE] Evicted {evicted} least recently used entries from {cache_path}")
+        cache.close()
+
+
+def compute_pdm(poscar_files, cutoff=5.0, modes=('pair',), n_jobs=4, pool=None,
+                cache_path=None, cache_max_mb=DEFAULT_CACHE_MB):
+    """
+    SRO descriptors for a list of POSCAR files as a DataFrame with columns
+    material_id, cif_file and one column per sorted element cluster, rows in
+    the order of poscar_files.  Runs on pool when given, otherwise on a
+    one-off joblib pool of n_jobs workers.
+
+    With cache_path, descriptors of structures seen before (same lattice,
+    species, coordinates, cutoff and modes) are read from the SQLite cache
+    instead of recomputed, and the cache is trimmed to cache_max_mb.
+    """
+    poscar_files = list(poscar_files)
+    with _cache_session(cache_path, cache_max_mb):
+        if pool is not None:
+            results = pool.map(poscar_files, cutoff, modes, cache_path)
+        else:
+            chunked = Parallel(n_jobs=n_jobs)(
+                delayed(process_files)(chunk, cutoff, list(modes), cache_path)
+                for chunk in chunks(poscar_files, n_jobs)
+            )
+            results = [result for chunk in chunked for result in chunk]
+    return descriptors_to_frame(results)
+
+
+def fixed_lattice_groups(batch):
+    """
+    Group the structures of a batch that occupy the same sites: same lattice
+    and the same Cartesian positions up to atom order, e.g. shuffles of one
+    template.  Returns (groups, orders), groups being lists of structure
+    indices and orders[i] the lexicographic order of the atoms of structure
+    i, so atom orders[i][r] of every group member sits on the same site.
+    """
+    groups, orders = {}, []
+    for i in range(len(batch)):
+        coords = batch.coords[batch.atom_slice(i)]
+        order = np.lexsort(coords.T[::-1])
+        key = (batch.lattices[i].tobytes(), coords[order].tobytes())
+        groups.setdefault(key, []).append(i)
+        orders.append(order)
+    return list(groups.values()), orders
+
+
+def _fixed_lattice_descriptors(batch, group, orders, cutoff, modes):
+    template = group[0]
+    atoms = batch.atom_slice(template)
+    sro = FixedLatticeSRO(batch.coords[atoms], batch.lattices[template], cutoff, modes)
+    codes = np.empty((len(group), sro.num_atoms), dtype=np.int64)
+    codes[:, orders[template]] = [batch.species[batch.atom_slice(i)][orders[i]] for i in group]
+    return sro.descriptors(codes, batch.symbols)
+
+
+def compute_pdm_batch(batch, cutoff=5.0, modes=('pair',), n_jobs=4,
+                      cache_path=None, cache_max_mb=DEFAULT_CACHE_MB, fixed_lattice=True):
+    """
+    Same as compute_pdm for structures already loaded into a StructureBatch,
+    rows in batch order.
+
+    With fixed_lattice, structures sharing their sites with others (see
+    fixed_lattice_groups) get their neighbor clusters from one template and
+    are counted together in-process; the cache and workers are only used for
+    the remaining structures.
+    """
+    results = [None] * len(batch)
+    singles = range(len(batch))
+    if fixed_lattice:
+        groups, orders = fixed_lattice_groups(batch)
+        singles = []
+        for group in groups:
+            if len(group) == 1:
+                singles.append(group[0])
+                continue
+            try:
+                descriptors = _fixed_lattice_descriptors(batch, group, orders, cutoff, modes)
+            except Exception as e:
+                print(f"[ERROR] {batch.names[group[0]]} (fixed lattice, {len(group)} structures): {e}")
+                singles.extend(group)
+                continue
+            for i, desc in zip(group, descriptors):
+                results[i] = (batch.names[i], desc)
+        shared = len(batch) - len(singles)
+        if shared:
+            print(f"[PDM] {shared} structures share sites with others; "
+                  f"{len(singles)} computed individually")
+
+    structures = [(batch.names[i],) + batch.structure(i)[2:] for i in singles]
+    with _cache_session(cache_path, cache_max_mb):
+        chunked = Parallel(n_jobs=n_jobs)(
+            delayed(process_structures)(chunk, cutoff, list(modes), cache_path)
+            for chunk in chunks(structures, n_jobs)
+        )
+    computed = [result for chunk in chunked for result in chunk]
+    for i, result in zip(singles, computed):
+        results[i] = result
+    return descriptors_to_frame(results)
 
 
 def main():
     parser = argparse.ArgumentParser(description="SRO Descriptor Extractor (multi-mode)")
-    parser.add_argument('--input_dir', required=True, help='Directory containing POSCAR files')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input_dir', help='Directory containing POSCAR files')
+    source.add_argument('--archive', help='Structure archive to read instead of a POSCAR directory')
     parser.add_argument('--output_csv', default='all_structures_summary.csv', help='Output CSV filename')
     parser.add_argument('--cutoff', type=float, default=5.0, help='Distance cutoff in angstrom')
     parser.add_argument('--n_jobs', type=int, default=4, help='Number of parallel workers')
@@ -104,14 +233,34 @@ def main():
                         default=['pair'], help='One or more SRO modes')
     parser.add_argument('--starts_with', default='', help='Only include files starting with this prefix')
     parser.add_argument('--ends_with', default='', help='Only include files ending with this suffix')
+    parser.add_argument('--cache', default=None, help='SQLite file caching descriptors by structure hash')
+    parser.add_argument('--cache_max_mb', type=float, default=DEFAULT_CACHE_MB,
+                        help='Evict least recently used cache entries above this size')
+    parser.add_argument('--fixed_lattice', action='store_true',
+                        help='Load the whole directory up front and share neighbor lists between structures '
+                             'that are permutations of the same sites (always on with --archive)')
 
     args = parser.parse_args()
 
-    poscar_files = [
-        os.path.join(args.input_dir, f)
-        for f in os.listdir(args.input_dir)
-        if f.startswith(args.starts_with) and f.endswith(args.ends_with)
-    ]
+    if args.archive or args.fixed_lattice:
+        if args.archive:
+            with StructureArchive(args.archive) as archive:
+                indices = [i for i, name in enumerate(archive.names)
+                           if name.startswith(args.starts_with) and name.endswith(args.ends_with)]
+                batch = archive.to_batch(indices)
+        else:
+            batch = load_structure_dir(args.input_dir, args.starts_with, args.ends_with, n_jobs=args.n_jobs)
+        if not len(batch):
+            print("No structures matched the criteria.")
+            return
+        print(f"Found {len(batch)} structures. Running with {args.n_jobs} threads and modes {args.mode}...")
+        df = compute_pdm_batch(batch, args.cutoff, args.mode, n_jobs=args.n_jobs,
+                               cache_path=args.cache, cache_max_mb=args.cache_max_mb)
+        df.to_csv(args.output_csv, index=False)
+        print(f"✅ Done. Output saved to {args.output_csv}")
+        return
+
+    poscar_files = find_poscar_files(args.input_dir, args.starts_with, args.ends_with)
 
     if not poscar_files:
         print("No POSCAR files matched the criteria.")
@@ -119,25 +268,11 @@ def main():
 
     print(f"Found {len(poscar_files)} files. Running with {args.n_jobs} threads and modes {args.mode}...")
 
-    results = Parallel(n_jobs=args.n_jobs)(
-        delayed(process_file)(f, args.cutoff, args.mode) for f in poscar_files
-    )
-
-    all_keys = set()
-    for _, desc in results:
-        all_keys.update(desc.keys())
-    all_keys = sorted(all_keys)
-
-    rows = []
-    for fname, desc in results:
-        row = [fname, fname + '.cif'] + [desc.get(k, 0) for k in all_keys]
-        rows.append(row)
-
-    df = pd.DataFrame(rows, columns=['material_id', 'cif_file'] + all_keys)
+    df = compute_pdm(poscar_files, args.cutoff, args.mode, n_jobs=args.n_jobs,
+                     cache_path=args.cache, cache_max_mb=args.cache_max_mb)
     df.to_csv(args.output_csv, index=False)
     print(f"✅ Done. Output saved to {args.output_csv}")
 
 
 if __name__ == '__main__':
     main()
-
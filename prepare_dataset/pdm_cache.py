@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from pdm_kernels import calculate_sro, neighbor_pairs
+
+# Bump when the descriptor definition changes so stale entries are never hit.
+CACHE_VERSION = 1
+DEFAULT_CACHE_MB = 1024
+
+_connections = {}
+
+
+def structure_key(coords, atom_types, lattice, cutoff, modes):
+    """
+    Content hash of a structure plus the PDM settings.  Two files with the same
+    lattice, species and coordinates share a key whatever their name or path.
+    """
+    h = hashlib.sha256()
+    h.update(f"pdm-v{CACHE_VERSION}|{float(cutoff)!r}|{','.join(sorted(modes))}|".encode())
+    h.update('\0'.join(atom_types).encode())
+    h.update(np.ascontiguousarray(lattice, dtype=np.float64).tobytes())
+    h.update(np.ascontiguousarray(coords, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+class PDMCache:
+    """
+    SQLite store of SRO descriptors keyed by structure_key, with last-use
+    timestamps for least-recently-used eviction.  Safe to share between the
+    worker processes of one run; each process opens its own connection.
+
+    Hits only read: their last-use times are kept in memory until flush(),
+    so workers do not queue up on the write lock once per cached structure.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(str(path))
+        self._conn = sqlite3.connect(self.path, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pdm ("
+            "key TEXT PRIMARY KEY, descriptors TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pdm_last_used ON pdm (last_used)")
+        self._conn.commit()
+        self._touched = {}
+
+    def get(self, key):
+        row = self._conn.execute("SELECT descriptors FROM pdm WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._touched[key] = time.time()
+        return json.loads(row[0])
+
+    def flush(self):
+        """Write the last-use times of the hits since the last flush in one transaction."""
+        if not self._touched:
+            return
+        with self._conn:
+            self._conn.executemany("UPDATE pdm SET last_used = ? WHERE key = ?",
+                                   [(used, key) for key, used in self._touched.items()])
+        self._touched.clear()
+
+    def put(self, key, descriptors):
+        value = json.dumps(descriptors, sort_keys=True)
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pdm (key, descriptors, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()),
+            )
+
+    def evict(self, max_mb=DEFAULT_CACHE_MB):
+        """
+        Drop the least recently used entries until the stored descriptors fit
+        in max_mb.  Returns the number of entries removed.
+        """
+        self.flush()
+        with self._conn:
+            cur = self._conn.execute(
+                "DELETE FROM pdm WHERE key IN ("
+                " SELECT key FROM ("
+                "  SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS total FROM pdm"
+                " ) WHERE total > ?)",
+                (int(max_mb * 1024 * 1024),),
+            )
+        return cur.rowcount
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM pdm").fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+
+def open_cache(path):
+    """Per-process PDMCache for path, reused across calls."""
+    key = (os.getpid(), os.path.expanduser(str(path)))
+    if key not in _connections:
+        _connections[key] = PDMCache(path)
+    return _connections[key]
+
+
+def flush_cache(path):
+    """Flush the hits of this process's PDMCache for path, if it has one open."""
+    if not path:
+        return
+    cache = _connections.get((os.getpid(), os.path.expanduser(str(path))))
+    if cache is not None:
+        cache.flush()
+
+
+def chunks(items, n_jobs):
+    """items split into about four chunks per worker; the unit of work that
+    records its cache hits with one flush_cache."""
+    items = list(items)
+    size = max(1, len(items) // (4 * n_jobs))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def cached_sro(coords, atom_types, lattice, cutoff, modes, cache_path=None):
+    """
+    calculate_sro over the cutoff neighbor list, looked up in / stored to the
+    cache at cache_path when one is given.  Callers flush_cache after a chunk
+    of structures so the hits are recorded before the cache is evicted.
+    """
+    cache = key = None
+    if cache_path:
+        cache = open_cache(cache_path)
+        key = structure_key(coords, atom_types, lattice, cutoff, modes)
+        descriptors = cache.get(key)
+        if descriptors is not None:
+            return descriptors
+
+    first, second, _ = neighbor_pairs(coords, lattice, cutoff)
+    descriptors = calculate_sro(first, second, atom_types, modes)
+    if cache is not None:
+        cache.put(key, descriptors)
+    return descriptors
@@ -0,0 +1,315 @@
+from itertools import combinations_with_replacement
+
+import numpy as np
+
+# Upper bound on the number of (i, j) pairs held in memory at once by the
+# chunked distance kernel; each pair costs a few 3-vectors of float64.
+DEFAULT_CHUNK_PAIRS = 1 << 20
+# Number of lowest-index atoms whose clusters are enumerated per chunk.
+DEFAULT_CLUSTER_CHUNK_ATOMS = 1024
+
+# Largest (size + 1) ** num_species table for sort-free cluster counting.
+MAX_COMPOSITION_KEYS = 1 << 16
+
+SRO_ORDERS = {'pair': 2, 'triple': 3, 'quadruple': 4}
+
+
+def _resolve_chunk_size(num_atoms, chunk_size):
+    if chunk_size is None:
+        chunk_size = DEFAULT_CHUNK_PAIRS // max(num_atoms, 1)
+    return max(1, min(int(chunk_size), max(num_atoms, 1)))
+
+
+def _expand_ranges(starts, stops):
+    """
+    Concatenate arange(start, stop) over all ranges without a Python loop.
+    Returns (owner, values) where owner is the index of the range each value
+    came from.
+    """
+    counts = np.maximum(stops - starts, 0)
+    owner = np.repeat(np.arange(len(counts)), counts)
+    values = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, values + np.repeat(starts, counts)
+
+
+def _minimum_image_norms(vec, inv_lattice, lattice_vectors):
+    vec = vec - np.round(vec @ inv_lattice) @ lattice_vectors
+    # Stacked (1, 3) @ (3, 1) products reduce with the same dot kernel as
+    # np.linalg.norm on a single vector, so results match a per-pair loop.
+    return np.sqrt(vec[..., None, :] @ vec[..., :, None])[..., 0, 0]
+
+
+def iter_distance_blocks(positions, lattice_vectors, chunk_size=None):
+    """
+    Yield (start, block) where block holds the minimum-image distances from
+    atoms start:start+len(block) to every atom in the cell.
+
+    positions are Cartesian (N, 3) and lattice_vectors holds the cell vectors
+    as rows.  chunk_size is the number of rows per block; by default it is
+    chosen so that at most DEFAULT_CHUNK_PAIRS pairs are processed at once.
+    """
+    positions = np.asarray(positions, dtype=float)
+    lattice_vectors = np.asarray(lattice_vectors, dtype=float)
+    inv_lattice = np.linalg.inv(lattice_vectors)
+    num_atoms = len(positions)
+    chunk_size = _resolve_chunk_size(num_atoms, chunk_size)
+
+    for start in range(0, num_atoms, chunk_size):
+        vec = positions[None, :, :] - positions[start:start + chunk_size, None, :]
+        yield start, _minimum_image_norms(vec, inv_lattice, lattice_vectors)
+
+
+def calculate_distances(positions, lattice_vectors, chunk_size=None):
+    """
+    Full (N, N) matrix of pairwise distances under the minimum image convention.
+    """
+    num_atoms = len(positions)
+    distances = np.empty((num_atoms, num_atoms))
+    for start, block in iter_distance_blocks(positions, lattice_vectors, chunk_size):
+        distances[start:start + len(block)] = block
+    return distances
+
+
+def neighbor_pairs(positions, lattice_vectors, cutoff):
+    """
+    Sparse list of atom pairs closer than cutoff under the minimum image convention.
+
+    Returns (first, second, distances) with first < second, sorted by
+    (first, second).  Candidates come from a periodic cell list built on
+    fractional coordinates, with bins no thinner than cutoff along each
+    perpendicular cell width, so the cost grows linearly with the number of
+    atoms for any cell shape.  Candidate distances use the same expression as
+    calculate_distances, so the result agrees exactly with thresholding the
+    dense matrix.
+    """
+    positions = np.asarray(positions, dtype=float)
+    lattice_vectors = np.asarray(lattice_vectors, dtype=float)
+    inv_lattice = np.linalg.inv(lattice_vectors)
+    num_atoms = len(positions)
+
+    # Columns of the inverse lattice are the reciprocal vectors; their inverse
+    # norms are the distances between opposite cell faces.
+    widths = 1.0 / np.linalg.norm(inv_lattice, axis=0)
+    num_bins = np.maximum(np.floor(widths / cutoff * (1 - 1e-9)).astype(int), 1)
+
+    frac = positions @ inv_lattice
+    frac -= np.floor(frac)
+    bins = np.minimum((frac * num_bins).astype(int), num_bins - 1)
+    cell_ids = np.ravel_multi_index(bins.T, num_bins)
+    order = np.argsort(cell_ids, kind='stable')
+    cell_counts = np.bincount(cell_ids, minlength=int(np.prod(num_bins)))
+    cell_starts = np.cumsum(cell_counts) - cell_counts
+
+    # Thin cells wrap onto themselves; visit every neighbouring bin only once.
+    shifts = [np.unique(np.array([-1, 0, 1]) % nb) for nb in num_bins]
+    firsts, seconds, distances = [], [], []
+    for dx in shifts[0]:
+        for dy in shifts[1]:
+            for dz in shifts[2]:
+                neighbor_cells = np.ravel_multi_index(
+                    ((bins + (dx, dy, dz)) % num_bins).T, num_bins)
+                starts = cell_starts[neighbor_cells]
+                first, slots = _expand_ranges(starts, starts + cell_counts[neighbor_cells])
+                second = order[slots]
+
+                keep = first < second
+                first, second = first[keep], second[keep]
+                d = _minimum_image_norms(positions[second] - positions[first],
+                                         inv_lattice, lattice_vectors)
+                within = d < cutoff
+                firsts.append(first[within])
+                seconds.append(second[within])
+                distances.append(d[within])
+
+    first = np.concatenate(firsts)
+    second = np.concatenate(seconds)
+    distances = np.concatenate(distances)
+    order = np.lexsort((second, first))
+    return first[order], second[order], distances[order]
+
+
+def _has_edges(edge_keys, num_atoms, a, b):
+    if len(edge_keys) == 0:
+        return np.zeros(len(a), dtype=bool)
+    query = a * num_atoms + b
+    pos = np.minimum(np.searchsorted(edge_keys, query), len(edge_keys) - 1)
+    return edge_keys[pos] == query
+
+
+def iter_clusters(first, second, num_atoms, size, chunk_size=None):
+    """
+    Yield (M, size) arrays of atom indices i < j < k < l whose members are all
+    pairwise neighbors, i.e. the pairs, triangles or 4-cliques of the neighbor
+    graph given by the sorted pair list (first, second).
+
+    Clusters are grouped by their lowest-index atom, chunk_size atoms at a
+    time, which bounds the size of the candidate arrays for large cells.
+    """
+    first = np.asarray(first, dtype=np.int64)
+    second = np.asarray(second, dtype=np.int64)
+    if chunk_size is None:
+        chunk_size = DEFAULT_CLUSTER_CHUNK_ATOMS
+    indptr = np.searchsorted(first, np.arange(num_atoms + 1))
+    edge_keys = first * num_atoms + second
+
+    for start in range(0, num_atoms, chunk_size):
+        stop = min(start + chunk_size, num_atoms)
+        e1 = np.arange(indptr[start], indptr[stop])
+        if size == 2:
+            yield np.stack([first[e1], second[e1]], axis=1)
+            continue
+
+        # Edges i->j and i->k (j < k) close a triangle when j->k is an edge.
+        owner, e2 = _expand_ranges(e1 + 1, indptr[first[e1] + 1])
+        e1 = e1[owner]
+        keep = _has_edges(edge_keys, num_atoms, second[e1], second[e2])
+        e1, e2 = e1[keep], e2[keep]
+        if size == 3:
+            yield np.stack([first[e1], second[e1], second[e2]], axis=1)
+            continue
+
+        owner, e3 = _expand_ranges(e2 + 1, indptr[first[e1] + 1])
+        e1, e2 = e1[owner], e2[owner]
+        keep = (_has_edges(edge_keys, num_atoms, second[e1], second[e3])
+                & _has_edges(edge_keys, num_atoms, second[e2], second[e3]))
+        e1, e2, e3 = e1[keep], e2[keep], e3[keep]
+        yield np.stack([first[e1], second[e1], second[e2], second[e3]], axis=1)
+
+
+def _composition_bins(num_codes, size):
+    """
+    For every multiset of size codes, its key sum((size + 1) ** code) and its
+    packed sorted-tuple bin as used by count_clusters.
+    """
+    combos = np.array(list(combinations_with_replacement(range(num_codes), size)), dtype=np.int64)
+    keys = ((size + 1) ** combos).sum(axis=1)
+    packed = combos @ num_codes ** np.arange(size - 1, -1, -1, dtype=np.int64)
+    return keys, packed
+
+
+def count_clusters(clusters, codes, num_codes):
+    """
+    Histogram of clusters by element composition.
+
+    Each cluster's species codes are sorted and packed base num_codes into a
+    single integer, so the result has num_codes ** size bins.  codes may also
+    be a (B, N) stack of species assignments of the same atoms, giving a
+    (B, num_codes ** size) histogram per row.
+    """
+    size = clusters.shape[1]
+    num_bins = num_codes ** size
+    rows = len(codes) if codes.ndim == 2 else None
+
+    num_keys = (size + 1) ** num_codes
+    if num_keys <= MAX_COMPOSITION_KEYS:
+        # Counting atoms per code, as digits base size + 1, identifies the
+        # composition without sorting the codes of every cluster.
+        digits = ((size + 1) ** np.arange(num_codes, dtype=np.int64))[codes]
+        keys = np.take(digits, clusters[:, 0], axis=-1)
+        for column in range(1, size):
+            keys += np.take(digits, clusters[:, column], axis=-1)
+        key_bins, packed_bins = _composition_bins(num_codes, size)
+        if rows is None:
+            counts = np.zeros(num_bins, dtype=np.int64)
+            counts[packed_bins] = np.bincount(keys, minlength=num_keys)[key_bins]
+            return counts
+        keys += np.arange(rows)[:, None] * num_keys
+        by_key = np.bincount(keys.ravel(), minlength=rows * num_keys).reshape(rows, num_keys)
+        counts = np.zeros((rows, num_bins), dtype=np.int64)
+        counts[:, packed_bins] = by_key[:, key_bins]
+        return counts
+
+    weights = num_codes ** np.arange(size - 1, -1, -1, dtype=np.int64)
+    packed = np.sort(codes[..., clusters], axis=-1) @ weights
+    if rows is None:
+        return np.bincount(packed, minlength=num_bins)
+    packed += np.arange(rows)[:, None] * num_bins
+    return np.bincount(packed.ravel(), minlength=rows * num_bins).reshape(rows, num_bins)
+
+
+def encode_species(atom_types):
+    """
+    Map element symbols to small integer codes ordered like the symbols, so
+    that sorting codes sorts symbols.  Returns (symbols, codes).
+    """
+    symbols, codes = np.unique(np.asarray(atom_types), return_inverse=True)
+    return symbols.tolist(), codes.astype(np.int64)
+
+
+def histogram_to_descriptors(counts, symbols, size, descriptors=None):
+    """
+    Convert a packed cluster histogram into {'CoFeO': count, ...} keys, the
+    sorted concatenation of element symbols used as PDM column names.
+    """
+    if descriptors is None:
+        descriptors = {}
+    shape = (len(symbols),) * size
+    for packed in np.flatnonzero(counts):
+        key = ''.join(symbols[c] for c in np.unravel_index(packed, shape))
+        descriptors[key] = descriptors.get(key, 0) + int(counts[packed])
+    return descriptors
+
+
+def calculate_sro(first, second, atom_types, modes, chunk_size=None):
+    """
+    Count element pairs, triples and quadruples of mutually neighbouring atoms.
+
+    first/second are the sorted neighbor pairs from neighbor_pairs.  Every
+    cluster is counted once and keyed by the sorted concatenation of its
+    element symbols.
+    """
+    symbols, codes = encode_species(atom_types)
+    num_atoms = len(codes)
+    descriptors = {}
+    for mode, size in SRO_ORDERS.items():
+        if mode not in modes:
+            continue
+        counts = np.zeros(len(symbols) ** size, dtype=np.int64)
+        for clusters in iter_clusters(first, second, num_atoms, size, chunk_size):
+            counts += count_clusters(clusters, codes, len(symbols))
+        histogram_to_descriptors(counts, symbols, size, descriptors)
+    return descriptors
+
+
+class FixedLatticeSRO:
+    """
+    SRO descriptors for many species assignments on one set of sites, such
+    as the shuffles of a template structure.
+
+    Only the species change between assignments, so the neighbor pairs and
+    their clusters are found once here; each assignment then costs a
+    histogram of code tuples, computed for many assignments at a time.
+    Results equal calculate_sro on the permuted structures.
+    """
+
+    def __init__(self, positions, lattice_vectors, cutoff, modes, chunk_size=None):
+        first, second, _ = neighbor_pairs(positions, lattice_vectors, cutoff)
+        self.num_atoms = len(positions)
+        self.clusters = {}
+        for mode, size in SRO_ORDERS.items():
+            if mode in modes:
+                chunks = list(iter_clusters(first, second, self.num_atoms, size, chunk_size))
+                self.clusters[size] = np.concatenate(chunks) if chunks else np.zeros((0, size), dtype=np.int64)
+
+    def descriptors(self, codes, symbols):
+        """
+        codes is a (B, N) array of per-site indices into symbols; returns one
+        descriptor dict per row.  Cluster keys need the codes to sort like
+        the symbols, so symbols in any other order (a structure archive's
+        symbol table lists elements as they were added) are sorted first.
+        """
+        codes = np.atleast_2d(np.asarray(codes, dtype=np.int64))
+        order = np.argsort(symbols, kind='stable')
+        if np.any(order != np.arange(len(order))):
+            rank = np.empty_like(order)
+            rank[order] = np.arange(len(order))
+            codes = rank[codes]
+            symbols = [symbols[i] for i in order]
+        results = [{} for _ in range(len(codes))]
+        for size, clusters in self.clusters.items():
+            rows = max(1, DEFAULT_CHUNK_PAIRS // max(clusters.size, 1))
+            for start in range(0, len(codes), rows):
+                counts = count_clusters(clusters, codes[start:start + rows], len(symbols))
+                for descriptors, row in zip(results[start:start + rows], counts):
+                    histogram_to_descriptors(row, symbols, size, descriptors)
+        return results
@@ -0,0 +1,184 @@
+import os
+import warnings
+
+import numpy as np
+from joblib import Parallel, delayed
+
+
+def _parse_coordinates(lines, num_atoms):
+    block = '\n'.join(lines)
+    try:
+        with warnings.catch_warnings():
+            # fromstring stops at selective-dynamics flags or trailing species
+            # labels (a warning on older NumPy, an error on newer); fall back to
+            # column slicing in that case.
+            warnings.simplefilter('ignore', DeprecationWarning)
+            values = np.fromstring(block, sep=' ')
+    except ValueError:
+        values = None
+    if values is not None and values.size == 3 * num_atoms:
+        return values.reshape(num_atoms, 3)
+    return np.array([line.split()[:3] for line in lines], dtype=float)
+
+
+def read_poscar_arrays(poscar_path):
+    """
+    Parse a POSCAR/CONTCAR with one vectorized conversion for the coordinate
+    block.  Returns (element_types, element_counts, frac_coords, coords,
+    lattice) with coords Cartesian and the scale factor applied.
+    """
+    with open(poscar_path, 'r') as file:
+        lines = file.read().splitlines()
+
+    scale = float(lines[1].split()[0])
+    lattice = np.fromstring(' '.join(lines[2:5]), sep=' ').reshape(3, 3) * scale
+    element_types = lines[5].split()
+    element_counts = [int(c) for c in lines[6].split()]
+    total_atoms = sum(element_counts)
+
+    start = 7
+    if lines[start].strip()[:1] in ('S', 's'):
+        start += 1  # Selective dynamics
+    coord_type = 'direct' if lines[start].strip()[:1] in ('D', 'd') else 'cartesian'
+    raw = _parse_coordinates(lines[start + 1:start + 1 + total_atoms], total_atoms)
+    if len(raw) != total_atoms:
+        raise ValueError(f"expected {total_atoms} coordinates, found {len(raw)}")
+
+    if coord_type == 'direct':
+        frac_coords = raw
+        coords = raw @ lattice
+    else:
+        # VASP and pymatgen apply the scale to Cartesian coordinates too; the
+        # old compute_pdm.py reader left them unscaled
+        coords = raw * scale
+        frac_coords = coords @ np.linalg.inv(lattice)
+    return element_types, element_counts, frac_coords, coords, lattice
+
+
+def expand_atom_types(element_types, element_counts):
+    atom_types = []
+    for el, count in zip(element_types, element_counts):
+        atom_types.extend([el] * count)
+    return atom_types
+
+
+def read_poscar(poscar_path):
+    """
+    Read a POSCAR file and return (element_types, element_counts, coords,
+    atom_types, lattice) with Cartesian coords and lattice vectors as rows.
+    """
+    element_types, element_counts, _, coords, lattice = read_poscar_arrays(poscar_path)
+    return element_types, element_counts, coords, expand_atom_types(element_types, element_counts), lattice
+
+
+def format_poscar(element_types, element_counts, frac_coords, lattice, comment=None):
+    """
+    POSCAR text in Direct coordinates.  Values are written with 17 significant
+    digits so that reading the file back reproduces the arrays exactly.
+    """
+    if comment is None:
+        comment = ' '.join(f"{el}{count}" for el, count in zip(element_types, element_counts))
+    lines = [comment, '1.0']
+    lines += ['  ' + ' '.join(f"{x:.17g}" for x in row) for row in np.asarray(lattice)]
+    lines.append('  ' + ' '.join(element_types))
+    lines.append('  ' + ' '.join(str(c) for c in element_counts))
+    lines.append('Direct')
+    lines += ['  ' + ' '.join(f"{x:.17g}" for x in row) for row in np.asarray(frac_coords)]
+    return '\n'.join(lines) + '\n'
+
+
+def write_poscar(poscar_path, element_types, element_counts, frac_coords, lattice, comment=None):
+    with open(poscar_path, 'w') as file:
+        file.write(format_poscar(element_types, element_counts, frac_coords, lattice, comment))
+
+
+class StructureBatch:
+    """
+    Many structures held as flat arrays: per-atom coordinates and species
+    codes concatenated over all structures, with offsets[i]:offsets[i + 1]
+    selecting the atoms of structure i.
+
+    names        list of source file names
+    lattices     (M, 3, 3) lattice vectors as rows, scale applied
+    frac_coords  (N, 3) fractional coordinates as read
+    coords       (N, 3) Cartesian coordinates
+    species      (N,) indices into symbols
+    offsets      (M + 1,) atom offsets
+    """
+
+    def __init__(self, names, symbols, lattices, frac_coords, coords, species, offsets):
+        self.names = list(names)
+        self.symbols = list(symbols)
+        self.lattices = np.asarray(lattices, dtype=float).reshape(-1, 3, 3)
+        self.frac_coords = np.asarray(frac_coords, dtype=float).reshape(-1, 3)
+        self.coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+        self.species = np.asarray(species, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_arrays(cls, names, arrays):
+        """Build from (element_types, element_counts, frac, coords, lattice) tuples."""
+        symbols = sorted({el for element_types, *_ in arrays for el in element_types})
+        code = {el: i for i, el in enumerate(symbols)}
+        species = [np.repeat([code[el] for el in element_types], element_counts)
+                   for element_types, element_counts, *_ in arrays]
+        counts = [len(s) for s in species]
+        return cls(
+            names, symbols,
+            np.array([a[4] for a in arrays]).reshape(-1, 3, 3),
+            np.concatenate([a[2] for a in arrays]) if arrays else np.empty((0, 3)),
+            np.concatenate([a[3] for a in arrays]) if arrays else np.empty((0, 3)),
+            np.concatenate(species) if arrays else np.empty(0, dtype=np.int32),
+            np.concatenate([[0], np.cumsum(counts)]),
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def num_atoms(self):
+        return np.diff(self.offsets)
+
+    def atom_slice(self, i):
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def element_blocks(self, i):
+        """Element order and counts as in the POSCAR header of structure i."""
+        species = self.species[self.atom_slice(i)]
+        starts = np.flatnonzero(np.diff(species, prepend=-1))
+        counts = np.diff(np.append(starts, len(species)))
+        return [self.symbols[c] for c in species[starts]], counts.tolist()
+
+    def structure(self, i):
+        """Same tuple as read_poscar for structure i."""
+        element_types, element_counts = self.element_blocks(i)
+        atoms = self.atom_slice(i)
+        atom_types = [self.symbols[c] for c in self.species[atoms]]
+        return element_types, element_counts, self.coords[atoms], atom_types, self.lattices[i]
+
+
+def _read_or_none(path):
+    try:
+        return read_poscar_arrays(path)
+    except Exception as e:
+        print(f"[ERROR] {path}: {e}")
+        return None
+
+
+def load_structure_dir(input_dir, starts_with='', ends_with='', n_jobs=1):
+    """
+    Read every matching POSCAR in input_dir into one StructureBatch.  Files
+    that fail to parse are reported and skipped.
+    """
+    names = sorted(
+        f for f in os.listdir(input_dir)
+        if f.startswith(starts_with) and f.endswith(ends_with)
+        and os.path.isfile(os.path.join(input_dir, f))
+    )
+    paths = [os.path.join(input_dir, f) for f in names]
+    if n_jobs == 1:
+        arrays = [_read_or_none(p) for p in paths]
+    else:
+        arrays = Parallel(n_jobs=n_jobs, batch_size=64)(delayed(_read_or_none)(p) for p in paths)
+    kept = [(n, a) for n, a in zip(names, arrays) if a is not None]
+    return StructureBatch.from_arrays([n for n, _ in kept], [a for _, a in kept])
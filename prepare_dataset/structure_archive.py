@@ -0,0 +1,264 @@
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+
+from poscar_io import StructureBatch, expand_atom_types, load_structure_dir, write_poscar
+
+ARCHIVE_VERSION = 1
+INDEX_DTYPE = np.dtype([('offset', '<i8'), ('natoms', '<i4'), ('lattice', '<f8', (3, 3))])
+
+
+class StructureArchive:
+    """
+    Append-only store for many structures in one directory, replacing a
+    directory of POSCAR files:
+
+        meta.json    format version and the element symbol table
+        index.bin    one INDEX_DTYPE record per structure
+        frac.bin     float64 fractional coordinates, 3 per atom
+        species.bin  int16 codes into the symbol table, 1 per atom
+        names.txt    one structure name per line
+
+    The binary files are raw little-endian arrays, so readers memory-map them
+    and fetch any structure by index without touching the rest.  Records are
+    only ever appended; a partially written tail (e.g. after a crash) is
+    dropped when the archive is reopened for appending.
+
+    mode is 'r' (read), 'a' (append, create if missing) or 'w' (truncate).
+    """
+
+    def __init__(self, path, mode='r'):
+        if mode not in ('r', 'a', 'w'):
+            raise ValueError(f"mode must be 'r', 'a' or 'w', got {mode!r}")
+        self.path = os.path.expanduser(str(path))
+        self.mode = mode
+        if mode == 'w' and os.path.exists(self.path):
+            shutil.rmtree(self.path)
+
+        meta_path = self._file('meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            if meta.get('version') != ARCHIVE_VERSION:
+                raise ValueError(f"Unsupported structure archive version {meta.get('version')} in {self.path}")
+        elif mode == 'r':
+            raise FileNotFoundError(f"No structure archive at {self.path}")
+        else:
+            os.makedirs(self.path, exist_ok=True)
+            meta = {'version': ARCHIVE_VERSION, 'symbols': []}
+            self._write_meta(meta['symbols'])
+        self.symbols = list(meta['symbols'])
+        self._code = {el: i for i, el in enumerate(self.symbols)}
+
+        self._index = self._read_array('index.bin', INDEX_DTYPE)
+        self._names = []
+        if os.path.exists(self._file('names.txt')):
+            with open(self._file('names.txt'), 'r') as f:
+                self._names = f.read().splitlines()
+        self._maps = None
+        self._handles = None
+        if mode != 'r':
+            self._recover()
+            self._handles = {name: open(self._file(name), 'ab')
+                             for name in ('index.bin', 'frac.bin', 'species.bin', 'names.txt')}
+        else:
+            n = min(len(self._index), len(self._names))
+            self._index, self._names = self._index[:n], self._names[:n]
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _write_meta(self, symbols):
+        tmp = self._file('meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'version': ARCHIVE_VERSION, 'symbols': symbols}, f)
+        os.replace(tmp, self._file('meta.json'))
+
+    def _read_array(self, name, dtype):
+        path = self._file(name)
+        if not os.path.exists(path) or os.path.getsize(path) < np.dtype(dtype).itemsize:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r')
+
+    def _recover(self):
+        """Drop records whose data did not reach every file."""
+        frac_atoms = os.path.getsize(self._file('frac.bin')) // 24 if os.path.exists(self._file('frac.bin')) else 0
+        species_atoms = os.path.getsize(self._file('species.bin')) // 2 if os.path.exists(self._file('species.bin')) else 0
+        n = min(len(self._index), len(self._names))
+        ends = self._index['offset'][:n] + self._index['natoms'][:n]
+        while n and ends[n - 1] > min(frac_atoms, species_atoms):
+            n -= 1
+        atoms = int(ends[n - 1]) if n else 0
+        self._index = np.array(self._index[:n])
+        self._names = self._names[:n]
+        for name, size in (('index.bin', n * INDEX_DTYPE.itemsize), ('frac.bin', atoms * 24),
+                           ('species.bin', atoms * 2)):
+            with open(self._file(name), 'ab') as f:
+                f.truncate(size)
+        with open(self._file('names.txt'), 'w') as f:
+            f.writelines(name + '\n' for name in self._names)
+
+    def _codes_for(self, symbols):
+        new = [el for el in symbols if el not in self._code]
+        if new:
+            if self.mode == 'r':
+                raise ValueError(f"Unknown element symbols {new}")
+            for el in new:
+                self._code[el] = len(self.symbols)
+                self.symbols.append(el)
+            self._write_meta(self.symbols)
+        return np.array([self._code[el] for el in symbols], dtype=np.int16)
+
+    def __len__(self):
+        return len(self._names)
+
+    @property
+    def names(self):
+        return list(self._names)
+
+    @property
+    def num_atoms(self):
+        return np.asarray(self._index['natoms'], dtype=np.int64)
+
+    def append_batch(self, batch):
+        """Append every structure of a StructureBatch."""
+        if self._handles is None:
+            raise ValueError("Archive opened read-only")
+        if len(batch) == 0:
+            return
+        if any('\n' in name for name in batch.names):
+            raise ValueError("Structure names must not contain newlines")
+        codes = self._codes_for(batch.symbols)
+        start = int(self._index['offset'][-1] + self._index['natoms'][-1]) if len(self._index) else 0
+
+        records = np.zeros(len(batch), dtype=INDEX_DTYPE)
+        records['offset'] = start + batch.offsets[:-1]
+        records['natoms'] = batch.num_atoms
+        records['lattice'] = batch.lattices
+
+        self._handles['frac.bin'].write(np.ascontiguousarray(batch.frac_coords, dtype='<f8').tobytes())
+        self._handles['species.bin'].write(codes[batch.species].astype('<i2').tobytes())
+        self._handles['names.txt'].write(''.join(name + '\n' for name in batch.names).encode())
+        # The index goes last: a record is only visible once its data exists.
+        self._handles['index.bin'].write(records.tobytes())
+        self._index = np.concatenate([self._index, records])
+        self._names.extend(batch.names)
+        self._maps = None
+
+    def append(self, name, element_types, element_counts, frac_coords, lattice):
+        frac_coords = np.asarray(frac_coords, dtype=float).reshape(-1, 3)
+        self.append_batch(StructureBatch.from_arrays(
+            [name], [(element_types, element_counts, frac_coords, frac_coords @ lattice, lattice)]))
+
+    def flush(self):
+        if self._handles is not None:
+            for name in ('frac.bin', 'species.bin', 'names.txt', 'index.bin'):
+                self._handles[name].flush()
+
+    def _arrays(self):
+        if self._maps is None:
+            self.flush()
+            frac = self._read_array('frac.bin', '<f8').reshape(-1, 3)
+            species = self._read_array('species.bin', '<i2')
+            self._maps = frac, species
+        return self._maps
+
+    def structure_arrays(self, i):
+        """Same tuple as read_poscar_arrays for structure i."""
+        frac, species = self._arrays()
+        record = self._index[i]
+        atoms = slice(int(record['offset']), int(record['offset'] + record['natoms']))
+        lattice = np.array(record['lattice'])
+        frac_coords = np.array(frac[atoms])
+        codes = species[atoms]
+        starts = np.flatnonzero(np.diff(codes, prepend=-1))
+        counts = np.diff(np.append(starts, len(codes)))
+        element_types = [self.symbols[c] for c in codes[starts]]
+        return element_types, counts.tolist(), frac_coords, frac_coords @ lattice, lattice
+
+    def read(self, i):
+        """Same tuple as read_poscar for structure i."""
+        element_types, element_counts, _, coords, lattice = self.structure_arrays(i)
+        return element_types, element_counts, coords, expand_atom_types(element_types, element_counts), lattice
+
+    def to_batch(self, indices=None):
+        """Load the given structures (all by default) into a StructureBatch."""
+        if indices is None:
+            indices = range(len(self))
+        indices = list(indices)
+        frac, species = self._arrays()
+        records = np.array(self._index[indices])
+        lattices = records['lattice']
+        counts = records['natoms'].astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        atoms = np.concatenate([np.arange(o, o + n) for o, n in zip(records['offset'], counts)]) \
+            if len(indices) else np.zeros(0, dtype=np.int64)
+        frac_coords = np.array(frac[atoms])
+        coords = np.empty_like(frac_coords)
+        for i in range(len(indices)):
+            atoms_i = slice(offsets[i], offsets[i + 1])
+            coords[atoms_i] = frac_coords[atoms_i] @ lattices[i]
+        return StructureBatch([self._names[i] for i in indices], self.symbols, lattices,
+                              frac_coords, coords, species[atoms], offsets)
+
+    def close(self):
+        if self._handles is not None:
+            for name in ('frac.bin', 'species.bin', 'names.txt', 'index.bin'):
+                self._handles[name].close()
+            self._handles = None
+        self._maps = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def pack_poscar_dir(input_dir, archive_path, starts_with='', ends_with='', n_jobs=1, mode='a'):
+    batch = load_structure_dir(input_dir, starts_with, ends_with, n_jobs=n_jobs)
+    with StructureArchive(archive_path, mode) as archive:
+        archive.append_batch(batch)
+        total = len(archive)
+    print(f"[ARCHIVE] Packed {len(batch)} structures from {input_dir} into {archive_path} ({total} total)")
+
+
+def unpack_to_poscar_dir(archive_path, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    with StructureArchive(archive_path) as archive:
+        for i, name in enumerate(archive.names):
+            element_types, element_counts, frac_coords, _, lattice = archive.structure_arrays(i)
+            write_poscar(os.path.join(output_dir, name), element_types, element_counts, frac_coords, lattice)
+        total = len(archive)
+    print(f"[ARCHIVE] Wrote {total} POSCAR files from {archive_path} to {output_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert between POSCAR directories and structure archives")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    pack = sub.add_parser('pack', help='Append the POSCAR files of a directory to an archive')
+    pack.add_argument('--input_dir', required=True, help='Directory containing POSCAR files')
+    pack.add_argument('--archive', required=True, help='Archive directory to create or append to')
+    pack.add_argument('--starts_with', default='', help='Only include files starting with this prefix')
+    pack.add_argument('--ends_with', default='', help='Only include files ending with this suffix')
+    pack.add_argument('--n_jobs', type=int, default=1, help='Number of parallel readers')
+    pack.add_argument('--overwrite', action='store_true', help='Replace an existing archive instead of appending')
+
+    unpack = sub.add_parser('unpack', help='Write every structure of an archive as a POSCAR file')
+    unpack.add_argument('--archive', required=True, help='Archive directory')
+    unpack.add_argument('--output_dir', required=True, help='Directory for the POSCAR files')
+
+    args = parser.parse_args()
+    if args.command == 'pack':
+        pack_poscar_dir(args.input_dir, args.archive, args.starts_with, args.ends_with,
+                        n_jobs=args.n_jobs, mode='w' if args.overwrite else 'a')
+    else:
+        unpack_to_poscar_dir(args.archive, args.output_dir)
+
+
+if __name__ == '__main__':
+    main()
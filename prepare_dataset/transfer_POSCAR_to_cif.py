@@ -1,14 +1,18 @@
 import os
 import argparse
-from pymatgen.io.vasp import Poscar
+import pandas as pd
+from pymatgen.core import Lattice, Structure
 from pymatgen.io.cif import CifWriter
 from multiprocessing import Pool
 
+from poscar_io import expand_atom_types, read_poscar_arrays
+from structure_archive import StructureArchive
+
 
 def convert_poscar_to_cif(poscar_file, output_dir):
     try:
-        poscar = Poscar.from_file(poscar_file)
-        structure = poscar.structure
+        element_types, element_counts, frac_coords, _, lattice = read_poscar_arrays(poscar_file)
+        structure = Structure(Lattice(lattice), expand_atom_types(element_types, element_counts), frac_coords)
         cif_writer = CifWriter(structure)
 
         cif_filename = os.path.join(output_dir, os.path.splitext(os.path.basename(poscar_file))[0] + '.cif')
@@ -19,6 +23,35 @@ def convert_poscar_to_cif(poscar_file, output_dir):
         print(f"[✘] Error converting {poscar_file}: {e}")
 
 
+def structure_to_cif_string(name, lattice, atom_types, frac_coords):
+    try:
+        return str(CifWriter(Structure(Lattice(lattice), atom_types, frac_coords)))
+    except Exception as e:
+        print(f"[✘] Error converting {name}: {e}")
+        return 'File not found'
+
+
+def convert_archive(base_dir, archive_path, nproc=4):
+    """
+    Convert every structure of a structure archive and store the CIF text in
+    base_dir/cif.csv (material_id, cif) instead of one .cif file each.
+    """
+    with StructureArchive(archive_path) as archive:
+        batch = archive.to_batch()
+    args = [
+        (name, batch.lattices[i], batch.structure(i)[3], batch.frac_coords[batch.atom_slice(i)])
+        for i, name in enumerate(batch.names)
+    ]
+
+    with Pool(processes=nproc) as pool:
+        cifs = pool.starmap(structure_to_cif_string, args, chunksize=max(1, len(args) // (4 * nproc)))
+
+    table_path = os.path.join(base_dir, 'cif.csv')
+    pd.DataFrame({'material_id': [os.path.splitext(n)[0] for n in batch.names], 'cif': cifs}).to_csv(
+        table_path, index=False)
+    print(f"[✔] {len(cifs)} structures from {archive_path} → {table_path}")
+
+
 def convert_all_poscars(base_dir, nproc=4):
     poscar_dir = os.path.join(base_dir, 'poscar')
     output_dir = os.path.join(base_dir, 'cif')
@@ -29,23 +62,26 @@ def convert_all_poscars(base_dir, nproc=4):
 
     os.makedirs(output_dir, exist_ok=True)
 
-    poscar_files = [
-        os.path.join(poscar_dir, f)
-        for f in os.listdir(poscar_dir)
+    # each worker reads and parses its own files
+    poscar_files = sorted(
+        os.path.join(poscar_dir, f) for f in os.listdir(poscar_dir)
         if f.startswith("POSCAR") and os.path.isfile(os.path.join(poscar_dir, f))
-    ]
-
-    args = [(f, output_dir) for f in poscar_files]
-
+    )
     with Pool(processes=nproc) as pool:
-        pool.starmap(convert_poscar_to_cif, args)
+        pool.starmap(convert_poscar_to_cif, [(f, output_dir) for f in poscar_files],
+                     chunksize=max(1, len(poscar_files) // (4 * nproc)))
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convert all POSCAR files under poscar/ to CIF format under cif/")
     parser.add_argument('base_path', type=str, help="Path: The directory containing the 'poscar' folder, e.g., ./data")
     parser.add_argument('--n', type=int, default=4, help="Number of parallel processes, default is 4")
+    parser.add_argument('--archive', type=str, default=None,
+                        help="Read structures from this structure archive and write base_path/cif.csv")
 
     args = parser.parse_args()
 
-    convert_all_poscars(args.base_path, args.n)
+    if args.archive:
+        convert_archive(args.base_path, args.archive, args.n)
+    else:
+        convert_all_poscars(args.base_path, args.n)
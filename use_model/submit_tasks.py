@@ -38,6 +38,17 @@ def run_cmd(cmd):
     return result
 
 
+def get_element_values_str(df, row):
+    """Comma-separated element values of one row, as passed to evaluate.py"""
+    if 'element_values_str' in df.columns:
+        return row['element_values_str']
+    formula_col_index = df.columns.get_loc('formula')
+    element_cols = df.columns[formula_col_index + 1:]
+    element_cols = [c for c in element_cols if c not in ['label_for_script', 'element_values_str']]
+    element_values = [str(row[col]) for col in element_cols if pd.notna(row[col])]
+    return ",".join(element_values)
+
+
 # --- 1. Setup and Configuration ---
 print("[INFO] Starting script...")
 try:
@@ -70,6 +81,8 @@ try:
         params = config["structure_mode_params"]
         pdm_output_csv = "all_structures_summary.csv"
         cmd_pdm = f"python {apollox_path}/use_model/compute_pdm_formula.py --input_dir {params['input_dir']} --output {pdm_output_csv} --cutoff {params['cutoff']} --n_jobs {params['n_jobs']} --mode {params['compute_mode']} --starts_with \"{params['starts_with']}\" --ends_with \"{params['ends_with']}\""
+        if params.get('pdm_cache'):
+            cmd_pdm += f" --cache {os.path.expanduser(params['pdm_cache'])}"
         if run_cmd(cmd_pdm).returncode != 0: sys.exit(1)
 
         standardized_output_csv = "standardized.csv"
@@ -117,6 +130,35 @@ if df_processed is None:
     print("[ERROR] Data processing failed, DataFrame is empty.", file=sys.stderr)
     sys.exit(1)
 
+final_structures_dir = Path("final_generated_structures")
+final_structures_dir.mkdir(exist_ok=True)
+
+generation_server = config.get("generation_server")
+if generation_server:
+    # The model stays loaded in gen_server.py; only send the conditions.
+    sys.path.insert(0, str(Path(apollox_path) / "cond-cdvae" / "scripts"))
+    from gen_client import generate_to_files
+
+    print(f"\n[INFO] Data loaded. Requesting {len(df_processed)} materials from {generation_server}")
+    requests = [
+        {
+            "label": Path(row["label_for_script"]).stem,
+            "formula": row["formula"],
+            "pressure": 0,
+            "element_values": get_element_values_str(df_processed, row),
+            "num_samples": batch_size * num_batches,
+        }
+        for _, row in df_processed.iterrows()
+    ]
+    processed_count, failed = generate_to_files(
+        generation_server, requests,
+        lambda label, i: final_structures_dir / f"{label}_{i}.vasp",
+    )
+    if failed:
+        print(f"[WARNING] Generation failed for {len(failed)} materials: {failed}")
+    print(f"\n[SUCCESS] All jobs done. {processed_count} structures consolidated into '{final_structures_dir}'.")
+    sys.exit(0)
+
 sh_dir = Path("sh_files_multi_pdm")
 sh_dir.mkdir(exist_ok=True)
 log_dir = Path("parallel_logs")
@@ -128,8 +170,6 @@ print(f"[INFO] Starting parallel job submission (max {max_parallel} jobs at a ti
 
 active_processes = []  # [(Popen对象, label_for_script)]
 processed_count = 0
-final_structures_dir = Path("final_generated_structures")
-final_structures_dir.mkdir(exist_ok=True)
 
 for idx, row in df_processed.iterrows():
     # --- 控制并行数 ---
@@ -165,14 +205,7 @@ for idx, row in df_processed.iterrows():
     label_for_script = row["label_for_script"]
     formula = row["formula"]
 
-    if 'element_values_str' in df_processed.columns:
-        element_values_str = row['element_values_str']
-    else:
-        formula_col_index = df_processed.columns.get_loc('formula')
-        element_cols = df_processed.columns[formula_col_index + 1:]
-        element_cols = [c for c in element_cols if c not in ['label_for_script', 'element_values_str']]
-        element_values = [str(row[col]) for col in element_cols if pd.notna(row[col])]
-        element_values_str = ",".join(element_values)
+    element_values_str = get_element_values_str(df_processed, row)
 
     sh_content = (
         "#!/bin/bash\n"